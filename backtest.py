@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""Backtests a Telegram signal channel offline with the bot's own classification, parsing and sizing.
+
+Every message of an exported channel history goes through ClassifySignal like a live update. Each signal is sized
+with SizeTrade and split into legs with BuildOrderLegs, for PLAN A and PLAN B, with and without the TP1 breakeven
+trailing stop. The legs are then filled against a price CSV. The fills are vectorized with NumPy: for every leg,
+the first bar where the price reaches its entry, stop loss, take profit or trailing threshold is found with a
+binary search over sparse tables of the bar highs and lows. This takes O(log bars) per leg, whatever the length of
+the price history.
+
+Inputs:
+    history: Telegram Desktop export (result.json) or a JSON list of {"date": ..., "text": ...} messages
+    prices: CSV with a time column and either open/high/low/close or bid/ask columns, plus a symbol column unless
+            --symbol is given. Times are ISO 8601 or epoch seconds, in the timezone of the history.
+    specs: JSON list of MetaAPI symbol specifications (get_symbol_specification) of the signal symbols. A pip is
+           valued from the contract size and the profit currency, whose rate against the account currency is read
+           from the price CSV at the time of each signal. Signals whose pip value is not known are skipped.
+
+Fills are simulated as follows:
+    - Market orders fill at the open of the first bar at or after the signal. Pending orders fill at their entry
+      the first time a bar reaches it.
+    - When the stop loss and the take profit are both reached within one bar, the stop loss counts.
+    - The breakeven stop only applies from the bar after the one that reached its threshold.
+    - Every signal is sized for the starting balance. Legs still open at the end are valued at the last close.
+
+Usage:
+    python backtest.py result.json prices.csv --specs specs.json [--symbol XAUUSD] [--balance 10000] [--plans A,B]
+                       [--expiry 0] [--equity-csv equity.csv]
+"""
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy
+
+# run.py reads its settings at import time
+os.environ.setdefault('RISK_FACTOR', '0.01')
+os.environ.setdefault('RISK_PERTRADE', '0.01')
+
+import run  # noqa: E402
+from prettytable import PrettyTable  # noqa: E402
+
+# leg outcomes
+UNFILLED, TAKE_PROFIT, STOP_LOSS, BREAKEVEN, OPEN = range(5)
+
+
+class PriceSeries:
+    """Bars of one symbol with sparse tables that find the first bar reaching a price in O(log bars)."""
+
+    def __init__(self, times: numpy.ndarray, opens: numpy.ndarray, highs: numpy.ndarray, lows: numpy.ndarray,
+                 closes: numpy.ndarray):
+        order = numpy.argsort(times, kind='stable')
+        self.times = times[order]
+        self.opens = opens[order]
+        self.highs = highs[order]
+        self.lows = lows[order]
+        self.closes = closes[order]
+        self.high_table = None
+        self.low_table = None
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def first_above(self, start: numpy.ndarray, level: numpy.ndarray) -> numpy.ndarray:
+        """Returns for every start index the first bar from it whose high reaches level, len(self) if none does."""
+        if self.high_table is None:
+            self.high_table = self._sparse_table(self.highs)
+        return self._first(self.high_table, start, level)
+
+    def first_below(self, start: numpy.ndarray, level: numpy.ndarray) -> numpy.ndarray:
+        """Returns for every start index the first bar from it whose low reaches level, len(self) if none does."""
+        if self.low_table is None:
+            self.low_table = self._sparse_table(-self.lows)
+        return self._first(self.low_table, start, -level)
+
+    def _first(self, table: list, start: numpy.ndarray, level: numpy.ndarray) -> numpy.ndarray:
+        # skips the longest run of bars that all stay below level, one power of two at a time
+        size = len(self)
+        position = numpy.minimum(start, size)
+        for power in range(len(table) - 1, -1, -1):
+            width = 1 << power
+            maxima = table[power]
+            fits = position + width <= size
+            below = fits & (maxima[numpy.where(fits, position, 0)] < level)
+            position = numpy.where(below, position + width, position)
+        return position
+
+    @staticmethod
+    def _sparse_table(values: numpy.ndarray) -> list:
+        # table[k][i] is the maximum of values[i:i + 2 ** k]
+        table = [values]
+        width = 1
+        while width * 2 <= len(values):
+            previous = table[-1]
+            table.append(numpy.maximum(previous[:-width], previous[width:]))
+            width *= 2
+        return table
+
+
+def message_text(message: dict) -> str:
+    """Returns the plain text of an exported message, whose text may be a list of strings and entities."""
+    text = message.get('text', '')
+    if isinstance(text, list):
+        return ''.join(part if isinstance(part, str) else part.get('text', '') for part in text)
+    return text
+
+
+def load_history(path: str) -> list:
+    """Returns the (time, text) of every text message in a channel export, oldest first."""
+    with open(path, encoding='utf-8') as history_file:
+        history = json.load(history_file)
+    messages = history['messages'] if isinstance(history, dict) else history
+    loaded = []
+    for message in messages:
+        text = message_text(message)
+        if message.get('type', 'message') == 'message' and text:
+            loaded.append((numpy.datetime64(message['date'], 's'), text))
+    loaded.sort(key=lambda item: item[0])
+    return loaded
+
+
+def parse_time(value: str) -> numpy.datetime64:
+    try:
+        return numpy.datetime64(int(float(value)), 's')
+    except ValueError:
+        return numpy.datetime64(value.replace(' ', 'T'), 's')
+
+
+def load_prices(path: str, symbol: str = None) -> dict:
+    """Reads a price CSV into one PriceSeries per symbol, bid/ask rows become bars at the mid price."""
+    columns = {}
+    with open(path, newline='', encoding='utf-8') as prices_file:
+        reader = csv.DictReader(prices_file)
+        fields = {field.lower(): field for field in reader.fieldnames}
+        for row in reader:
+            row_symbol = row[fields['symbol']] if 'symbol' in fields else symbol
+            if row_symbol is None:
+                raise ValueError('the price CSV has no symbol column, pass --symbol')
+            if 'bid' in fields:
+                mid = (float(row[fields['bid']]) + float(row[fields['ask']])) / 2
+                bar = (mid, mid, mid, mid)
+            else:
+                bar = tuple(float(row[fields[name]]) for name in ('open', 'high', 'low', 'close'))
+            columns.setdefault(row_symbol, []).append((parse_time(row[fields['time']]),) + bar)
+
+    series = {}
+    for row_symbol, rows in columns.items():
+        times, opens, highs, lows, closes = zip(*rows)
+        canonical = run.symbol_index.find(row_symbol) or row_symbol
+        series[canonical] = PriceSeries(numpy.array(times, dtype='datetime64[s]'), numpy.array(opens),
+                                        numpy.array(highs), numpy.array(lows), numpy.array(closes))
+    return series
+
+
+def load_specifications(path: str) -> int:
+    """Stores the symbol specifications of a JSON list (or symbol to specification object) for sizing.
+
+    Returns:
+        the number of specifications stored, incomplete ones are skipped
+    """
+    with open(path, encoding='utf-8') as specs_file:
+        specifications = json.load(specs_file)
+    if isinstance(specifications, dict):
+        specifications = [dict(specification, symbol=specification.get('symbol', symbol))
+                          for symbol, specification in specifications.items()]
+    return sum(run.symbol_specs.put(specification) is not None for specification in specifications)
+
+
+def update_rates(series: dict, signal_time: numpy.datetime64) -> None:
+    """Updates the exchange rates of the pip values with the last close of every symbol before signal_time."""
+    for symbol, prices in series.items():
+        bar = int(numpy.searchsorted(prices.times, signal_time)) - 1
+        if bar >= 0:
+            close = float(prices.closes[bar])
+            run.pip_values.update(symbol, {'bid': close, 'ask': close})
+
+
+def classify_signals(messages: list) -> tuple:
+    """Classifies every message like TotalMessHandle and drops duplicates within DUPLICATE_WINDOW.
+
+    Returns:
+        a list of (time, trade) tuples and the number of duplicates dropped
+    """
+    signals = []
+    placed = {}
+    duplicates = 0
+    window = numpy.timedelta64(int(run.DUPLICATE_WINDOW), 's')
+    for message_time, text in messages:
+        confidence, trade = run.ClassifySignal(text)
+        if confidence < run.SIGNAL_MIN_CONFIDENCE or not trade:
+            continue
+        key = run.SignalKey(trade)
+        if key in placed and message_time - placed[key] < window:
+            duplicates += 1
+            continue
+        placed[key] = message_time
+        signals.append((message_time, trade))
+    return signals, duplicates
+
+
+def build_legs(signals: list, series: dict, plan: str, trailing: bool, balance: float) -> tuple:
+    """Sizes every signal like ConnectMetaTrader and returns its order legs as columns of NumPy arrays.
+
+    Arguments:
+        signals: (time, trade) tuples from classify_signals
+        series: PriceSeries per symbol
+        plan: PLAN used for sizing
+        trailing: adds the breakeven trailing stop of BuildOrderLegs
+        balance: balance every signal is sized for
+
+    Returns:
+        a dictionary of leg columns and a dictionary counting the signals that were skipped, by reason
+    """
+    columns = {name: [] for name in ('symbol', 'signal', 'tp_index', 'time', 'bar', 'direction', 'pending', 'entry',
+                                     'stop_loss', 'take_profit', 'volume', 'pip_size', 'pip_value', 'trigger')}
+    skipped = {'no prices': 0, 'no pip value': 0, 'not sized': 0}
+    for number, (signal_time, parsed) in enumerate(signals):
+        prices = series.get(parsed['Symbol'])
+        bar = int(numpy.searchsorted(prices.times, signal_time)) if prices is not None else 0
+        if prices is None or bar >= len(prices):
+            skipped['no prices'] += 1
+            continue
+
+        # the open of the first bar after the signal stands in for the current bid and ask
+        price = {'bid': float(prices.opens[bar]), 'ask': float(prices.opens[bar])}
+        update_rates(series, signal_time)
+        run.pip_values.update(parsed['Symbol'], price)
+        if run.pip_values.pip_value(parsed['Symbol']) is None:
+            skipped['no pip value'] += 1
+            continue
+
+        trade = run.CopyTrade(parsed)
+        try:
+            run.ResolveEntry(trade, price)
+            run.AdjustOrderType(trade, price)
+            run.SizeTrade(trade, balance, plan)
+            legs = run.BuildOrderLegs(trade, price, plan, trailing)
+        except (ValueError, ZeroDivisionError, TypeError, KeyError, IndexError):
+            skipped['not sized'] += 1
+            continue
+
+        direction = 1 if trade['OrderType'].startswith('Buy') else -1
+        pending = 0 if trade['OrderType'] in ('Buy', 'Buy Now', 'Sell', 'Sell Now') else (
+            1 if trade['OrderType'].endswith('Limit') else 2)
+        pip_size = run.symbol_specs.pip_size(trade['Symbol'], trade['Entry'])
+        for tp_index, (take_profit, volume, options) in enumerate(legs):
+            trigger = numpy.nan
+            if options is not None:
+                trigger = options['trailingStopLoss']['threshold']['thresholds'][0]['threshold']
+            for name, value in (('symbol', trade['Symbol']), ('signal', number), ('tp_index', tp_index),
+                                ('time', signal_time), ('bar', bar), ('direction', direction), ('pending', pending),
+                                ('entry', trade['Entry']), ('stop_loss', trade['StopLoss']),
+                                ('take_profit', take_profit), ('volume', volume), ('pip_size', pip_size),
+                                ('pip_value', trade['PipValue']), ('trigger', trigger)):
+                columns[name].append(value)
+
+    legs = {name: numpy.array(values, dtype='datetime64[s]' if name == 'time' else None)
+            for name, values in columns.items()}
+    for name in ('entry', 'stop_loss', 'take_profit', 'volume', 'pip_size', 'pip_value', 'trigger'):
+        legs[name] = legs[name].astype(float)
+    return legs, skipped
+
+
+def first_touch(prices: PriceSeries, start: numpy.ndarray, level: numpy.ndarray, above: numpy.ndarray) -> numpy.ndarray:
+    """First bar from start whose high (above) or low (not above) reaches level, len(prices) if none does."""
+    return numpy.where(above, prices.first_above(start, level), prices.first_below(start, level))
+
+
+def simulate(legs: dict, series: dict, expiry_bars: int = 0) -> dict:
+    """Fills every leg against its symbol's bars.
+
+    Arguments:
+        legs: leg columns from build_legs
+        series: PriceSeries per symbol
+        expiry_bars: bars after which an unfilled pending order is cancelled, 0 keeps it until the end
+
+    Returns:
+        columns outcome, fill_bar, exit_bar, exit_time, exit_price and profit (in the account currency)
+    """
+    count = len(legs['entry'])
+    result = {
+        'outcome': numpy.full(count, UNFILLED), 'exit_price': numpy.full(count, numpy.nan),
+        'profit': numpy.zeros(count), 'exit_time': numpy.full(count, numpy.datetime64('NaT'), dtype='datetime64[s]'),
+    }
+    for symbol in numpy.unique(legs['symbol']) if count else []:
+        rows = numpy.flatnonzero(legs['symbol'] == symbol)
+        prices = series[symbol]
+        size = len(prices)
+        bar = legs['bar'][rows]
+        direction = legs['direction'][rows]
+        pending = legs['pending'][rows]
+        entry = legs['entry'][rows]
+        buy = direction > 0
+
+        # market orders fill at the signal bar, a buy limit or sell stop once the price falls to the entry,
+        # a buy stop or sell limit once it rises to it
+        rises_to_entry = (pending == 2) == buy
+        fill = numpy.where(pending == 0, bar, first_touch(prices, bar, entry, rises_to_entry))
+        if expiry_bars:
+            fill = numpy.where((pending != 0) & (fill - bar >= expiry_bars), size, fill)
+        filled = fill < size
+        fill_price = numpy.where(pending == 0, prices.opens[numpy.minimum(bar, size - 1)], entry)
+
+        stop = first_touch(prices, fill, legs['stop_loss'][rows], ~buy)
+        take = first_touch(prices, fill, legs['take_profit'][rows], buy)
+        stop_price = legs['stop_loss'][rows]
+        outcome_stop = numpy.full(len(rows), STOP_LOSS)
+
+        # the trailing stop moves the stop loss to the entry once its threshold is reached before the stop loss
+        trigger = legs['trigger'][rows]
+        trails = ~numpy.isnan(trigger)
+        triggered = numpy.where(trails, first_touch(prices, fill, numpy.where(trails, trigger, 0.0), buy), size)
+        moved = trails & (triggered < stop) & (triggered < size)
+        breakeven = first_touch(prices, numpy.minimum(triggered + 1, size), fill_price, ~buy)
+        stop = numpy.where(moved, breakeven, stop)
+        stop_price = numpy.where(moved, fill_price, stop_price)
+        outcome_stop = numpy.where(moved, BREAKEVEN, outcome_stop)
+
+        # a stop loss and a take profit within the same bar count as the stop loss
+        took_profit = take < stop
+        closed = numpy.minimum(take, stop) < size
+        outcome = numpy.where(took_profit, TAKE_PROFIT, numpy.where(closed, outcome_stop, OPEN))
+        outcome = numpy.where(filled, outcome, UNFILLED)
+        exit_bar = numpy.where(closed, numpy.minimum(take, stop), size - 1)
+        exit_price = numpy.where(took_profit, legs['take_profit'][rows],
+                                 numpy.where(closed, stop_price, prices.closes[-1]))
+
+        profit = direction * (exit_price - fill_price) / legs['pip_size'][rows] * legs['pip_value'][rows] * legs['volume'][rows]
+        result['outcome'][rows] = outcome
+        result['exit_price'][rows] = numpy.where(filled, exit_price, numpy.nan)
+        result['profit'][rows] = numpy.where(filled, profit, 0.0)
+        result['exit_time'][rows] = numpy.where(filled, prices.times[exit_bar], numpy.datetime64('NaT'))
+    return result
+
+
+def equity_curve(result: dict, balance: float) -> tuple:
+    """Returns the exit times and account equity after every filled leg, and the largest drawdown and its fraction of the peak."""
+    filled = result['outcome'] != UNFILLED
+    order = numpy.argsort(result['exit_time'][filled], kind='stable')
+    times = result['exit_time'][filled][order]
+    equity = balance + numpy.cumsum(result['profit'][filled][order])
+    if not len(equity):
+        return times, equity, 0.0, 0.0
+    peaks = numpy.maximum.accumulate(numpy.concatenate(([balance], equity)))[1:]
+    return times, equity, float((peaks - equity).max()), float(((peaks - equity) / peaks).max())
+
+
+def summary_row(plan: str, trailing: bool, signals: int, legs: dict, result: dict, balance: float, max_tps: int) -> list:
+    outcome = result['outcome']
+    filled = outcome != UNFILLED
+    _, equity, drawdown, drawdown_fraction = equity_curve(result, balance)
+    filled_signals = len(numpy.unique(legs['signal'][filled]))
+    tp_rates = []
+    for tp_index in range(max_tps):
+        rows = filled & (legs['tp_index'] == tp_index)
+        tp_rates.append(f'{(outcome[rows] == TAKE_PROFIT).mean():.0%}' if rows.any() else '-')
+    stopped = filled & (outcome == STOP_LOSS)
+    final = equity[-1] if len(equity) else balance
+    return [plan, 'Y' if trailing else 'N', signals, filled_signals, int(filled.sum())] + tp_rates + [
+        f'{stopped.sum() / max(filled.sum(), 1):.0%}', f'{(outcome == BREAKEVEN).sum() / max(filled.sum(), 1):.0%}',
+        f'{final - balance:,.2f}', f'{drawdown:,.2f}', f'{drawdown_fraction:.1%}',
+        f'{final:,.2f}',
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('history', help='exported channel history (JSON)')
+    parser.add_argument('prices', help='tick or OHLC price CSV')
+    parser.add_argument('--specs', help='symbol specifications (JSON) the pip values are computed from')
+    parser.add_argument('--symbol', help='symbol of every row when the price CSV has no symbol column')
+    parser.add_argument('--balance', type=float, default=10000.0, help='starting balance every signal is sized for')
+    parser.add_argument('--plans', default='A,B', help='comma separated PLANs to test')
+    parser.add_argument('--trailing', choices=('both', 'Y', 'N'), default='both', help='TP1 breakeven trailing stop')
+    parser.add_argument('--expiry', type=int, default=0, help='bars after which unfilled pending orders are cancelled')
+    parser.add_argument('--equity-csv', help='writes the equity curve of every run to this CSV')
+    args = parser.parse_args()
+
+    run.logger.disabled = True
+    start = time.perf_counter()
+    messages = load_history(args.history)
+    series = load_prices(args.prices, args.symbol)
+    specifications = load_specifications(args.specs) if args.specs else 0
+    loaded = time.perf_counter()
+    signals, duplicates = classify_signals(messages)
+    print(f'{len(messages)} messages, {len(signals)} signals ({duplicates} duplicates dropped), '
+          f'{sum(len(prices) for prices in series.values())} bars of {len(series)} symbols, '
+          f'{specifications} symbol specifications, '
+          f'loaded in {loaded - start:.2f} s, classified in {time.perf_counter() - loaded:.2f} s')
+
+    runs = [(plan, trailing) for plan in args.plans.split(',')
+            for trailing in ((True, False) if args.trailing == 'both' else (args.trailing == 'Y',))]
+    outputs = []
+    for plan, trailing in runs:
+        run_start = time.perf_counter()
+        legs, skipped = build_legs(signals, series, plan, trailing, args.balance)
+        sized = time.perf_counter()
+        result = simulate(legs, series, args.expiry)
+        outputs.append((plan, trailing, legs, result))
+        print(f'PLAN {plan} trailing {"Y" if trailing else "N"}: {len(legs["entry"])} legs sized in {sized - run_start:.2f} s, '
+              f'simulated in {time.perf_counter() - sized:.2f} s, skipped {skipped}')
+
+    max_tps = max((int(legs['tp_index'].max()) + 1 for _, _, legs, _ in outputs if len(legs['tp_index'])), default=0)
+    table = PrettyTable()
+    table.field_names = ['PLAN', 'Trailing', 'Signals', 'Filled', 'Legs'] + [f'TP{index + 1} hit' for index in range(max_tps)] + [
+        'SL hit', 'Breakeven', 'Net profit', 'Max DD', 'Max DD %', 'Final equity']
+    for plan, trailing, legs, result in outputs:
+        table.add_row(summary_row(plan, trailing, len(signals), legs, result, args.balance, max_tps))
+    print(table)
+
+    if args.equity_csv:
+        with open(args.equity_csv, 'w', newline='', encoding='utf-8') as equity_file:
+            writer = csv.writer(equity_file)
+            writer.writerow(['plan', 'trailing', 'time', 'equity'])
+            for plan, trailing, _, result in outputs:
+                times, equity, _, _ = equity_curve(result, args.balance)
+                writer.writerows((plan, 'Y' if trailing else 'N', str(exit_time), f'{value:.2f}')
+                                 for exit_time, value in zip(times, equity))
+        print(f'equity curves written to {args.equity_csv}')
+
+
+if __name__ == '__main__':
+    main()
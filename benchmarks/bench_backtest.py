@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Times the backtester on a synthetic gold channel and checks its fills against a bar by bar simulation.
+
+A random walk of one minute XAUUSD bars is generated together with a channel posting market, limit and stop
+signals around the current price. The vectorized fills of backtest.simulate are compared with a plain loop over the
+bars for the first --check legs, and the script exits with 1 when any of them differs.
+
+Usage:
+    python benchmarks/bench_backtest.py [--bars 500000] [--signals 20000] [--check 500] [--expiry 240] [--seed 42]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+# run.py reads its settings at import time
+os.environ.setdefault('RISK_FACTOR', '0.01')
+os.environ.setdefault('RISK_PERTRADE', '0.01')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import backtest  # noqa: E402
+import run  # noqa: E402
+from fake_broker import specification  # noqa: E402
+
+
+def random_walk(bars: int, rng: numpy.random.Generator) -> backtest.PriceSeries:
+    """One minute XAUUSD bars starting at 1900 with a volatility of about 0.4 per bar."""
+    times = numpy.datetime64('2023-01-02T00:00', 's') + numpy.arange(bars) * numpy.timedelta64(60, 's')
+    closes = 1900 + numpy.cumsum(rng.normal(0, 0.4, bars))
+    opens = numpy.concatenate(([1900.0], closes[:-1]))
+    spread = numpy.abs(rng.normal(0, 0.3, (2, bars)))
+    highs = numpy.maximum(opens, closes) + spread[0]
+    lows = numpy.minimum(opens, closes) - spread[1]
+    return backtest.PriceSeries(times, opens.round(2), highs.round(2), lows.round(2), closes.round(2))
+
+
+def channel(prices: backtest.PriceSeries, signals: int, rng: numpy.random.Generator) -> list:
+    """Posts signals at random bars, with entries, stop losses and take profits a few dollars from the price."""
+    messages = []
+    for bar in numpy.sort(rng.choice(len(prices) - 1, signals, replace=False)):
+        price = round(float(prices.opens[bar + 1]))
+        side = 'BUY' if rng.random() < 0.5 else 'SELL'
+        sign = 1 if side == 'BUY' else -1
+        kind = rng.integers(3)
+        if kind == 0:
+            entry, header = price, f'XAUUSD {side} NOW'
+        elif kind == 1:
+            entry = price - sign * int(rng.integers(1, 4))
+            header = f'XAUUSD {side} LIMIT {entry}'
+        else:
+            entry = price + sign * int(rng.integers(1, 4))
+            header = f'XAUUSD {side} STOP\nEntry {entry}'
+        stop_loss = entry - sign * int(rng.integers(4, 9))
+        take_profits = [entry + sign * step for step in (3, 6, 10)[:int(rng.integers(1, 4))]]
+        text = '\n'.join([header, f'SL {stop_loss}'] + [f'TP {take_profit}' for take_profit in take_profits])
+        # the signal is posted during the minute before the bar it is placed on
+        messages.append((prices.times[bar] + numpy.timedelta64(30, 's'), text))
+    return messages
+
+
+def simulate_leg(legs: dict, row: int, prices: backtest.PriceSeries, expiry_bars: int) -> tuple:
+    """Fills one leg bar by bar, returns its outcome and exit price."""
+    bar, buy, pending = legs['bar'][row], legs['direction'][row] > 0, legs['pending'][row]
+    entry, stop_loss, take_profit = legs['entry'][row], legs['stop_loss'][row], legs['take_profit'][row]
+    trigger = legs['trigger'][row]
+    fill = None
+    for index in range(bar, len(prices)):
+        if pending == 0:
+            fill = index
+        elif expiry_bars and index - bar >= expiry_bars:
+            break
+        elif (prices.highs[index] >= entry) if (pending == 2) == buy else (prices.lows[index] <= entry):
+            fill = index
+        if fill is not None:
+            break
+    if fill is None:
+        return backtest.UNFILLED, None
+
+    fill_price = prices.opens[bar] if pending == 0 else entry
+    outcome, triggered_at = backtest.STOP_LOSS, None
+    for index in range(fill, len(prices)):
+        high, low = prices.highs[index], prices.lows[index]
+        if (low <= stop_loss) if buy else (high >= stop_loss):
+            return outcome, stop_loss
+        if (high >= take_profit) if buy else (low <= take_profit):
+            return backtest.TAKE_PROFIT, take_profit
+        if triggered_at is None and not numpy.isnan(trigger) and ((high >= trigger) if buy else (low <= trigger)):
+            triggered_at = index
+            outcome, stop_loss = backtest.BREAKEVEN, fill_price
+    return backtest.OPEN, prices.closes[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bars', type=int, default=500000, help='one minute bars of synthetic prices')
+    parser.add_argument('--signals', type=int, default=20000, help='signals posted to the synthetic channel')
+    parser.add_argument('--check', type=int, default=500, help='legs compared with the bar by bar simulation')
+    parser.add_argument('--expiry', type=int, default=240, help='bars after which pending orders are cancelled')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    run.logger.disabled = True
+    run.symbol_specs.put(specification('XAUUSD'))
+    rng = numpy.random.default_rng(args.seed)
+    series = {'XAUUSD': random_walk(args.bars, rng)}
+    messages = channel(series['XAUUSD'], args.signals, rng)
+
+    start = time.perf_counter()
+    signals, _ = backtest.classify_signals(messages)
+    classified = time.perf_counter()
+    print(f'classified {len(messages)} messages into {len(signals)} signals in {classified - start:.2f} s')
+
+    mismatches = 0
+    for plan in ('A', 'B'):
+        for trailing in (True, False):
+            start = time.perf_counter()
+            legs, _ = backtest.build_legs(signals, series, plan, trailing, 10000.0)
+            sized = time.perf_counter()
+            result = backtest.simulate(legs, series, args.expiry)
+            simulated = time.perf_counter()
+            rows = len(legs['entry'])
+            print(f'PLAN {plan} trailing {"Y" if trailing else "N"}: {rows} legs sized in {sized - start:.2f} s, '
+                  f'simulated in {simulated - sized:.3f} s ({rows / (simulated - sized):,.0f} legs/s) '
+                  f'over {args.bars} bars')
+
+            for row in range(min(args.check, rows)):
+                outcome, exit_price = simulate_leg(legs, row, series['XAUUSD'], args.expiry)
+                if outcome != result['outcome'][row] or (
+                        exit_price is not None and not numpy.isclose(exit_price, result['exit_price'][row])):
+                    mismatches += 1
+                    print(f'MISMATCH leg {row}: loop {outcome} {exit_price}, '
+                          f'vectorized {result["outcome"][row]} {result["exit_price"][row]}')
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
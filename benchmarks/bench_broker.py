@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Runs ConnectMetaTrader and the bulk position commands end to end against the in-process fake broker.
+
+The fake answers every RPC request after --latency seconds, so the numbers show the latency the bot adds on top of
+the broker and how it behaves under load. Some ERR_NO_ERROR exceptions are injected on market orders, which must
+still be reported as entered. The script exits with 1 when any signal is not entered.
+
+Usage:
+    python benchmarks/bench_broker.py [--signals 200] [--concurrency 20] [--latency 0.05] [--jitter 0.02]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# run.py reads its settings at import time
+os.environ.setdefault('RISK_FACTOR', '0.01')
+os.environ.setdefault('RISK_PERTRADE', '0.01')
+os.environ.setdefault('ACCOUNT_ID', 'bench')
+# the replies go to recording messages, not Telegram, so its rate limits do not apply
+os.environ.setdefault('TELEGRAM_GLOBAL_RATE', '100000')
+os.environ.setdefault('TELEGRAM_CHAT_RATE', '100000')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import run  # noqa: E402
+from bench_classifier import load_corpus  # noqa: E402
+from fake_broker import FakeBroker  # noqa: E402
+
+
+class RecordingMessage:
+    """Stands in for the Telegram message the handlers reply to and keeps the replies."""
+
+    chat_id = 1
+
+    def __init__(self):
+        self.replies = []
+
+    def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+class RecordingUpdate:
+    def __init__(self):
+        self.effective_message = RecordingMessage()
+
+
+async def place_signals(texts: list, concurrency: int) -> tuple:
+    """Places every signal through ConnectMetaTrader with at most concurrency signals in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    updates = []
+
+    async def place(text: str) -> None:
+        async with semaphore:
+            update = RecordingUpdate()
+            updates.append(update)
+            await run.ConnectMetaTrader(update, run.ParseSignal(text), True)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(place(text) for text in texts))
+    elapsed = time.perf_counter() - start
+    # replies are sent by the Telegram outbox after the orders were placed
+    run.telegram_outbox.drain()
+    entered = sum(any('Trade entered successfully' in reply for reply in update.effective_message.replies)
+                  for update in updates)
+    return entered, elapsed
+
+
+async def bulk(command, position_ids: list, chunk: int) -> tuple:
+    """Runs a bulk position command on chunks of position IDs, one chunk per command message."""
+    start = time.perf_counter()
+    updates = []
+    for index in range(0, len(position_ids), chunk):
+        update = RecordingUpdate()
+        updates.append(update)
+        await command(update, [','.join(position_ids[index:index + chunk])])
+    elapsed = time.perf_counter() - start
+    run.telegram_outbox.drain()
+    succeeded = sum(int(update.effective_message.replies[-1].split(': ')[1].split('/')[0]) for update in updates)
+    return succeeded, elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--signals', type=int, default=200, help='number of signals placed')
+    parser.add_argument('--concurrency', type=int, default=20, help='signals placed at the same time')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds every fake RPC request takes')
+    parser.add_argument('--jitter', type=float, default=0.02, help='extra random seconds per fake RPC request')
+    parser.add_argument('--no-errors', type=int, default=5, help='ERR_NO_ERROR exceptions injected on market orders')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    run.logger.disabled = True
+    broker = FakeBroker(latency=args.latency, jitter=args.jitter, balance=100000.0, seed=args.seed)
+    run.connection_manager.api_factory = broker
+    broker.inject_error('create_market_buy_order', count=args.no_errors)
+
+    signals = [message['text'] for message in load_corpus() if message['signal']]
+    texts = [signals[index % len(signals)] for index in range(args.signals)]
+
+    entered, elapsed = await place_signals(texts, args.concurrency)
+    account = broker.account(run.ACCOUNT_ID)
+    print(f'ConnectMetaTrader: {entered}/{len(texts)} signals entered in {elapsed:.2f} s '
+          f'({len(texts) / elapsed:,.1f} signals/s), {len(account.positions)} positions, {len(account.orders)} orders')
+
+    position_ids = list(account.positions)
+    half = len(position_ids) // 2
+    succeeded, elapsed = await bulk(run.trailing_stop, position_ids, 50)
+    print(f'trailing_stop: {succeeded}/{len(position_ids)} positions in {elapsed:.2f} s')
+    succeeded, elapsed = await bulk(run.close_position, position_ids[:half], 50)
+    print(f'close_position: {succeeded}/{half} positions in {elapsed:.2f} s')
+
+    async def close_half(update, ids):
+        await run.close_position_partially(update, [f"{ids[0]}|{','.join('0.01' for _ in ids[0].split(','))}"])
+    succeeded, elapsed = await bulk(close_half, position_ids[half:], 50)
+    print(f'close_position_partially: {succeeded}/{len(position_ids) - half} positions in {elapsed:.2f} s')
+
+    print(f'\nfake broker requests: {dict(sorted(broker.calls.items()))}')
+    print(f'\nLatency per stage (ms), fake RPC latency {args.latency * 1000:.0f} ms + up to {args.jitter * 1000:.0f} ms')
+    print(run.latency_recorder.report())
+
+    await run.connection_manager.reset()
+    await run.connection_manager.reset_streaming()
+    sys.exit(1 if entered != len(texts) else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Measures how many messages per second the signal classifier handles on a mixed chatter/signal corpus.
+
+Usage:
+    python benchmarks/bench_classifier.py [--seconds 2] [--chatter-ratio 0.8]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# run.py reads its settings at import time
+os.environ.setdefault('RISK_FACTOR', '0.01')
+os.environ.setdefault('RISK_PERTRADE', '0.01')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import run  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus.json')
+
+
+def load_corpus() -> list:
+    with open(CORPUS_PATH, encoding='utf-8') as corpus_file:
+        return json.load(corpus_file)
+
+
+def mixed_stream(corpus: list, chatter_ratio: float, size: int = 10000) -> list:
+    """Builds a reproducible stream of messages where chatter_ratio of them are chatter."""
+    rng = random.Random(42)
+    signals = [message['text'] for message in corpus if message['signal']]
+    chatter = [message['text'] for message in corpus if not message['signal']]
+    return [rng.choice(chatter) if rng.random() < chatter_ratio else rng.choice(signals) for _ in range(size)]
+
+
+def messages_per_second(function, messages: list, seconds: float) -> float:
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for message in messages:
+            function(message)
+        count += len(messages)
+    return count / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0, help='time spent on each measurement')
+    parser.add_argument('--chatter-ratio', type=float, default=0.8, help='share of chatter in the mixed stream')
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+
+    # the classifier must agree with the labels before its speed means anything
+    wrong = [message['text'] for message in corpus
+             if (run.ClassifySignal(message['text'])[0] >= run.SIGNAL_MIN_CONFIDENCE) != message['signal']]
+    for text in wrong:
+        print(f'misclassified: {text!r}')
+
+    stream = mixed_stream(corpus, args.chatter_ratio)
+    chatter = [message['text'] for message in corpus if not message['signal']]
+    signals = [message['text'] for message in corpus if message['signal']]
+
+    print(f'corpus: {len(signals)} signals, {len(chatter)} chatter, {len(wrong)} misclassified')
+    print(f'mixed ({args.chatter_ratio:.0%} chatter): {messages_per_second(run.ClassifySignal, stream, args.seconds):,.0f} msg/s')
+    print(f'chatter only: {messages_per_second(run.ClassifySignal, chatter, args.seconds):,.0f} msg/s')
+    print(f'signals only: {messages_per_second(run.ClassifySignal, signals, args.seconds):,.0f} msg/s')
+
+    sys.exit(1 if wrong else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""Times the signal parsing and trade sizing hot paths offline and compares them with a stored baseline.
+
+Every benchmark runs on the checked-in corpus without network access. Throughput is reported in operations per
+second and allocations as the average peak bytes traced by tracemalloc during one call. A benchmark that is slower or
+allocates more than the baseline allows (see --tolerance) is reported as a regression and the script exits with 1,
+as it does when ParseSignal no longer returns the expected trade for a corpus signal.
+
+Usage:
+    python benchmarks/bench_hotpaths.py [--seconds 1] [--tolerance 0.3] [--only ParseSignal] [--update-baseline]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# run.py reads its settings at import time
+os.environ.setdefault('RISK_FACTOR', '0.01')
+os.environ.setdefault('RISK_PERTRADE', '0.01')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import run  # noqa: E402
+from bench_classifier import load_corpus  # noqa: E402
+from fake_broker import DEFAULT_PRICES, specification  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# account balance used for sizing
+BALANCE = 10000.0
+
+# trade fields compared with the expected parse results in the corpus
+PARSED_FIELDS = ('OrderType', 'Symbol', 'Entry', 'StopLoss', 'TP')
+
+
+class NullMessage:
+    """Stands in for the reply aggregator GetTradeInformation adds its table to, replies are dropped."""
+
+    def reply_text(self, text, **kwargs):
+        return None
+
+
+class NullUpdate:
+    effective_message = NullMessage()
+
+
+def check_parser(corpus: list) -> list:
+    """Returns the corpus signals whose parsed trade differs from the expected one."""
+    wrong = []
+    for message in corpus:
+        if 'expected' not in message:
+            continue
+        trade = run.ParseSignal(message['text'])
+        parsed = {key: trade[key] for key in PARSED_FIELDS if key in trade}
+        if parsed != message['expected']:
+            wrong.append((message['text'], message['expected'], parsed))
+    return wrong
+
+
+def load_specifications() -> None:
+    """Stores the fake broker's symbol specifications and quotes, which SizeTrade needs to value a pip."""
+    for symbol, (bid, ask) in DEFAULT_PRICES.items():
+        run.symbol_specs.put(specification(symbol))
+        run.pip_values.update(symbol, {'bid': bid, 'ask': ask})
+
+
+def sizing_trades(corpus: list) -> list:
+    """Builds the trades GetTradeInformation sizes, market orders get an entry between stop loss and TP1."""
+    trades = []
+    for message in corpus:
+        trade = run.ParseSignal(message['text']) if message['signal'] else {}
+        if not trade or 'Entry' not in trade:
+            continue
+        if trade['Entry'] == 'NOW':
+            trade['Entry'] = round(trade['StopLoss'] + (trade['TP'][0] - trade['StopLoss']) * 2 / 3, 5)
+        trades.append(trade)
+    return trades
+
+
+def table_arguments(trades: list, plan: str) -> list:
+    """Records the CreateTable arguments GetTradeInformation computes for every trade."""
+    recorded = []
+    create_table = run.CreateTable
+
+    def recording_create_table(*args):
+        recorded.append(tuple(run.CopyTrade(arg) if isinstance(arg, dict) else arg for arg in args))
+        return create_table(*args)
+
+    run.PLAN = plan
+    run.CreateTable = recording_create_table
+    try:
+        for trade in trades:
+            run.GetTradeInformation(NullUpdate(), run.CopyTrade(trade), BALANCE, NullMessage())
+    finally:
+        run.CreateTable = create_table
+    return recorded
+
+
+def positions(count: int) -> list:
+    return [{'id': str(40000000 + i), 'type': 'POSITION_TYPE_BUY' if i % 2 else 'POSITION_TYPE_SELL',
+             'symbol': 'XAUUSD' if i % 3 else 'EURUSD', 'volume': 0.01 * (i % 7 + 1), 'openPrice': 1925.12 + i,
+             'stopLoss': 1915.0 + i, 'takeProfit': 1940.0 + i, 'profit': (i % 11 - 5) * 3.17} for i in range(count)]
+
+
+def orders(count: int) -> list:
+    return [{'id': str(50000000 + i), 'type': 'ORDER_TYPE_BUY_LIMIT' if i % 2 else 'ORDER_TYPE_SELL_STOP',
+             'symbol': 'XAUUSD' if i % 3 else 'GBPJPY', 'volume': 0.01 * (i % 5 + 1), 'openPrice': 1925.12 + i,
+             'stopLoss': 1915.0 + i, 'takeProfit': 1940.0 + i} for i in range(count)]
+
+
+def sizing_batch(signals: int, accounts: int) -> tuple:
+    """Builds SizePositions arguments sizing every signal for every account, balances vary per account."""
+    balances = [[BALANCE * (account + 1)] for account in range(accounts)]
+    stop_loss_pips = [10 + signal % 490 for signal in range(signals)]
+    pip_values = [(10.0, 6.89, 1.0, 7.35)[signal % 4] for signal in range(signals)]
+    return balances, 0.01, stop_loss_pips, pip_values
+
+
+def fresh_signal_cache() -> None:
+    run.signal_cache = run.SignalCache(run.PARSE_CACHE_SIZE, run.DUPLICATE_WINDOW)
+
+
+def benchmarks(corpus: list) -> list:
+    """Returns (name, setup, function, inputs) for every benchmark, setup runs before each pass over the inputs."""
+    texts = [message['text'] for message in corpus]
+    signals = [message['text'] for message in corpus if message['signal']]
+    trades = sizing_trades(corpus)
+    plan_a_tables = table_arguments(trades, 'A')
+    plan_b_tables = table_arguments(trades, 'B')
+
+    def plan(name):
+        def setup():
+            run.PLAN = name
+        return setup
+
+    return [
+        ('ParseSignal', None, run.ParseSignal, signals),
+        ('CheckSignalMessage (uncached)', fresh_signal_cache, run.CheckSignalMessage, texts),
+        ('CheckSignalMessage (cached)', None, run.CheckSignalMessage, texts),
+        ('remove_pips', None, run.remove_pips, texts),
+        ('replace_spaces', None, run.replace_spaces, texts),
+        ('GetTradeInformation PLAN A', plan('A'), lambda trade: run.GetTradeInformation(NullUpdate(), trade, BALANCE, NullMessage()), trades),
+        ('GetTradeInformation PLAN B', plan('B'), lambda trade: run.GetTradeInformation(NullUpdate(), trade, BALANCE, NullMessage()), trades),
+        ('CreateTable PLAN A', plan('A'), lambda args: run.CreateTable(*args), plan_a_tables),
+        ('CreateTable PLAN B', plan('B'), lambda args: run.CreateTable(*args), plan_b_tables),
+        ('create_table positions x50', None, lambda data: run.create_table(data, is_pending=False).get_string(), [positions(50)]),
+        ('create_table orders x50', None, lambda data: run.create_table(data, is_pending=True).get_string(), [orders(50)]),
+        ('SizePositions 10k signals x10', None, lambda args: run.SizePositions(*args), [sizing_batch(10000, 10)]),
+        ('render_table_chunks positions x500', None,
+         lambda data: list(run.render_table_chunks(*run.table_rows(data, is_pending=False))), [positions(500)]),
+    ]
+
+
+def ops_per_second(setup, function, inputs: list, seconds: float) -> float:
+    count = 0
+    elapsed = 0.0
+    while elapsed < seconds:
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for item in inputs:
+            function(item)
+        elapsed += time.perf_counter() - start
+        count += len(inputs)
+    return count / elapsed
+
+
+def peak_bytes(setup, function, inputs: list) -> float:
+    """Average peak of traced memory during one call."""
+    if setup is not None:
+        setup()
+    total = 0
+    tracemalloc.start()
+    try:
+        for item in inputs:
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            function(item)
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / len(inputs)
+
+
+def load_baseline() -> dict:
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding='utf-8') as baseline_file:
+        return json.load(baseline_file)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=1.0, help='time spent on each throughput measurement')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='allowed slowdown or allocation growth (0.3 = 30%%)')
+    parser.add_argument('--only', help='runs only the benchmarks whose name contains this text')
+    parser.add_argument('--update-baseline', action='store_true', help='stores these results as the new baseline')
+    args = parser.parse_args()
+
+    # timing is measured on the pipeline only, not on its logging
+    run.logger.disabled = True
+    corpus = load_corpus()
+    load_specifications()
+
+    wrong = check_parser(corpus)
+    for text, expected, parsed in wrong:
+        print(f'PARSE MISMATCH: {text!r}\n  expected {expected}\n  parsed   {parsed}')
+
+    baseline = load_baseline()
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<32} {'ops/sec':>12} {'baseline':>12} {'change':>8} {'peak B/op':>10} {'baseline':>10}")
+    for name, setup, function, inputs in benchmarks(corpus):
+        if args.only and args.only not in name:
+            continue
+        # one untimed pass warms up caches and compiled patterns
+        if setup is not None:
+            setup()
+        for item in inputs:
+            function(item)
+
+        throughput = ops_per_second(setup, function, inputs, args.seconds)
+        allocated = peak_bytes(setup, function, inputs)
+        results[name] = {'ops_per_sec': round(throughput, 1), 'peak_bytes': round(allocated)}
+
+        expected = baseline.get(name)
+        change = ''
+        if expected:
+            change = f"{throughput / expected['ops_per_sec'] - 1:+.0%}"
+            if throughput < expected['ops_per_sec'] * (1 - args.tolerance):
+                regressions.append(f"{name}: {throughput:,.0f} ops/sec, baseline {expected['ops_per_sec']:,.0f}")
+            if allocated > expected['peak_bytes'] * (1 + args.tolerance) + 1024:
+                regressions.append(f"{name}: {allocated:,.0f} peak bytes/op, baseline {expected['peak_bytes']:,.0f}")
+        print(f"{name:<32} {throughput:>12,.0f} {expected['ops_per_sec'] if expected else 0:>12,.0f} {change:>8} "
+              f"{allocated:>10,.0f} {expected['peak_bytes'] if expected else 0:>10,.0f}")
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f'baseline updated: {BASELINE_PATH}')
+    else:
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+
+    sys.exit(1 if wrong or (regressions and not args.update_baseline) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Times the paper broker's matching engine per price tick as the number of open positions and orders grows.
+
+Every book size gets a fresh account holding that many XAUUSD positions and pending orders, with stop losses, take
+profits and threshold trailing stops a few dollars around the price. A random walk is then streamed tick by tick,
+filling, trailing and closing whatever it reaches. A tick costs about the same whatever the book size, plus a little
+per level it triggers, and a denser book triggers more levels per tick, so the time per tick and level is reported
+as well.
+
+Usage:
+    python benchmarks/bench_paper.py [--sizes 1000,10000,50000] [--ticks 20000] [--seed 42]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from paper_broker import PaperBroker  # noqa: E402
+
+
+async def fill_book(broker: PaperBroker, size: int, rng: random.Random):
+    """Opens size positions and orders around the current price, half of them with a trailing stop."""
+    account = broker.account(f'bench-{size}')
+    price = broker.price('XAUUSD')['bid']
+    for index in range(size):
+        sign = 1 if rng.random() < 0.5 else -1
+        side = 'BUY' if sign > 0 else 'SELL'
+        entry = round(price + rng.uniform(-20, 20), 2)
+        stop_loss = round(entry - sign * rng.uniform(20, 60), 2)
+        take_profit = round(entry + sign * rng.uniform(20, 60), 2)
+        options = None
+        if index % 2:
+            options = {'trailingStopLoss': {'threshold': {'thresholds': [
+                {'threshold': round(entry + sign * 10, 2), 'stopLoss': entry}], 'units': 'ABSOLUTE_PRICE'}}}
+        if index % 3:
+            await account.open_position('XAUUSD', side, 0.01, stop_loss, take_profit, options)
+        else:
+            order_type = f"{side}_{'LIMIT' if (entry < price) == (sign > 0) else 'STOP'}"
+            await account.place_order('XAUUSD', order_type, 0.01, entry, stop_loss, take_profit, options)
+    return account
+
+
+async def stream(broker: PaperBroker, ticks: int, rng: random.Random) -> float:
+    """Streams a random walk of ticks and returns the seconds spent in the broker."""
+    bid = broker.price('XAUUSD')['bid']
+    elapsed = 0.0
+    for _ in range(ticks):
+        bid = round(bid + rng.gauss(0, 0.3), 2)
+        start = time.perf_counter()
+        await broker.set_price('XAUUSD', bid, round(bid + 0.28, 2))
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,50000', help='comma separated numbers of positions and orders')
+    parser.add_argument('--ticks', type=int, default=20000, help='ticks streamed per book size')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'book':>8} {'levels':>8} {'setup s':>8} {'us/tick':>8} {'ticks/s':>10} {'filled':>7} {'closed':>7} "
+          f"{'trailed':>8} {'us/(tick+level)':>16}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        rng = random.Random(args.seed)
+        broker = PaperBroker(seed=args.seed)
+        start = time.perf_counter()
+        account = await fill_book(broker, size, rng)
+        setup = time.perf_counter() - start
+        book = account.books['XAUUSD']
+        levels = len(book)
+
+        # counts the triggered levels by kind
+        triggered = Counter()
+        book_triggered = book.triggered
+
+        def counting_triggered(bid, ask):
+            keys = book_triggered(bid, ask)
+            triggered.update(kind for kind, _ in keys)
+            return keys
+        book.triggered = counting_triggered
+
+        elapsed = await stream(broker, args.ticks, rng)
+        events = sum(triggered.values())
+        print(f'{size:>8} {levels:>8} {setup:>8.2f} {elapsed / args.ticks * 1e6:>8.1f} {args.ticks / elapsed:>10,.0f} '
+              f"{triggered['order']:>7} {triggered['stop'] + triggered['take']:>7} {triggered['trail']:>8} "
+              f'{elapsed / (args.ticks + events) * 1e6:>16.1f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""In-process fake of the MetaAPI SDK calls made by run.py, for offline end-to-end, latency and load testing.
+
+FakeBroker stands in for the MetaApi client: it can be passed as the ConnectionManager api_factory (or selected with
+BROKER=fake) and hands out accounts whose RPC and streaming connections behave like the SDK ones. Positions, pending
+orders, balances and prices live in memory, every RPC request waits for the configured latency and errors can be
+injected per method, including the ERR_NO_ERROR trade exceptions MetaAPI raises for orders that were placed.
+"""
+import asyncio
+import itertools
+import logging
+import random
+from collections import Counter
+from datetime import datetime, timezone
+
+from metaapi_cloud_sdk.clients.metaApi.tradeException import TradeException
+
+logger = logging.getLogger(__name__)
+
+# initial bid/ask of the symbols the fake broker quotes
+DEFAULT_PRICES = {
+    'XAUUSD': (1925.12, 1925.40), 'XAGUSD': (23.512, 23.540), 'EURUSD': (1.08501, 1.08509),
+    'GBPUSD': (1.26502, 1.26511), 'USDJPY': (145.201, 145.212), 'GBPJPY': (183.702, 183.721),
+    'EURJPY': (158.402, 158.418), 'AUDCAD': (0.90101, 0.90118), 'AUDUSD': (0.66001, 0.66010),
+    'USDCAD': (1.36501, 1.36512), 'USDCHF': (0.88501, 0.88512), 'NZDUSD': (0.61001, 0.61012),
+    'US30': (34100.0, 34102.5), 'USTEC': (15400.0, 15401.5), 'US500': (4450.0, 4450.5),
+}
+
+# units per lot of the symbols that are not FX pairs
+CONTRACT_SIZES = {'XAUUSD': 100, 'XAGUSD': 5000, 'US30': 1, 'USTEC': 1, 'US500': 1}
+
+TRADE_DONE = {'numericCode': 10009, 'stringCode': 'TRADE_RETCODE_DONE', 'message': 'Request completed'}
+
+
+def no_error_exception() -> TradeException:
+    """The exception MetaAPI raises for some orders although they were placed."""
+    return TradeException('No error returned', 0, 'ERR_NO_ERROR')
+
+
+def trade_exception(string_code: str = 'TRADE_RETCODE_REJECT', numeric_code: int = 10006,
+                    message: str = 'Request rejected') -> TradeException:
+    return TradeException(message, numeric_code, string_code)
+
+
+class FakeBroker:
+    """Fake MetaApi client whose accounts share one price feed, latency model and error injection.
+
+    Arguments:
+        latency: seconds every RPC request waits before it is answered
+        jitter: extra random latency, uniform between 0 and jitter seconds
+        error_rate: share of trade requests rejected with a TradeException
+        balance: starting balance of every account
+        seed: random seed, so jitter and random errors are reproducible
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, balance: float = 10000.0,
+                 seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.balance = balance
+        self.random = random.Random(seed)
+        self.accounts = {}
+        self.prices = {}
+        self.errors = {}
+        self.calls = Counter()
+        self.ids = itertools.count(100000000)
+
+        # MetaApi(token).metatrader_account_api.get_account(account_id)
+        self.metatrader_account_api = self
+
+        for symbol, (bid, ask) in DEFAULT_PRICES.items():
+            self.prices[symbol] = self._quote(symbol, bid, ask)
+
+    def __call__(self, token: str) -> 'FakeBroker':
+        """Lets the broker itself be used as the ConnectionManager api_factory."""
+        return self
+
+    async def get_account(self, account_id: str) -> 'FakeAccount':
+        return self.account(account_id)
+
+    def account(self, account_id: str) -> 'FakeAccount':
+        """Returns the account with this ID, creating it with the starting balance if needed."""
+        if account_id not in self.accounts:
+            self.accounts[account_id] = FakeAccount(self, account_id, self.balance)
+        return self.accounts[account_id]
+
+    def inject_error(self, method: str, error: Exception = None, count: int = 1) -> None:
+        """Makes the next count calls of an RPC method raise.
+
+        Arguments:
+            method: RPC method name, e.g. create_market_buy_order
+            error: exception to raise, an ERR_NO_ERROR TradeException by default (the request still takes effect)
+            count: number of calls that raise
+        """
+        self.errors.setdefault(method, []).extend([error or no_error_exception()] * count)
+
+    async def set_price(self, symbol: str, bid: float, ask: float) -> None:
+        """Moves the price of a symbol and streams it, with the revalued positions, to every account."""
+        self.prices[symbol] = self._quote(symbol, bid, ask)
+        for account in self.accounts.values():
+            await account.price_changed(self.prices[symbol])
+
+    def price(self, symbol: str) -> dict:
+        if symbol not in self.prices:
+            raise trade_exception('TRADE_RETCODE_INVALID', 10013, f'Unknown symbol {symbol}')
+        return self.prices[symbol]
+
+    async def call(self, method: str, coro_function):
+        """Runs one RPC request with the configured latency and injected errors.
+
+        An injected ERR_NO_ERROR exception is raised after the request took effect, like MetaAPI does.
+        """
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0))
+
+        queued = self.errors.get(method)
+        error = queued.pop(0) if queued else None
+        if error is None and self.error_rate and method.startswith('create_') and self.random.random() < self.error_rate:
+            error = trade_exception()
+        if error is not None and getattr(error, 'numericCode', None) != 0:
+            raise error
+
+        result = await coro_function()
+        if error is not None:
+            raise error
+        return result
+
+    @staticmethod
+    def _quote(symbol: str, bid: float, ask: float) -> dict:
+        return {'symbol': symbol, 'bid': bid, 'ask': ask, 'time': datetime.now(timezone.utc)}
+
+
+class FakeAccount:
+    """Fake MetaTrader account with its positions, pending orders and open streaming connections."""
+
+    def __init__(self, broker: FakeBroker, account_id: str, balance: float):
+        self.broker = broker
+        self.id = account_id
+        self.state = 'DEPLOYED'
+        self.balance = balance
+        self.leverage = 100
+        self.positions = {}
+        self.orders = {}
+        self.streams = []
+
+    async def deploy(self) -> None:
+        self.state = 'DEPLOYED'
+
+    async def wait_connected(self) -> None:
+        await asyncio.sleep(self.broker.latency)
+
+    def get_rpc_connection(self) -> 'FakeRpcConnection':
+        return FakeRpcConnection(self)
+
+    def get_streaming_connection(self) -> 'FakeStreamingConnection':
+        return FakeStreamingConnection(self)
+
+    def account_information(self) -> dict:
+        equity = self.balance + sum(position['profit'] for position in self.positions.values())
+        margin = sum(position['volume'] * contract_size(position['symbol']) * position['openPrice'] / self.leverage
+                     for position in self.positions.values())
+        return {
+            'platform': 'mt5', 'broker': 'Fake Broker', 'currency': 'USD', 'server': 'Fake-Demo', 'name': self.id,
+            'login': self.id, 'balance': round(self.balance, 2), 'equity': round(equity, 2), 'margin': round(margin, 2),
+            'freeMargin': round(equity - margin, 2), 'leverage': self.leverage,
+            'marginLevel': round(equity / margin * 100, 2) if margin else None,
+        }
+
+    async def open_position(self, symbol: str, side: str, volume: float, stop_loss: float, take_profit: float,
+                            options: dict = None) -> dict:
+        price = self.broker.price(symbol)
+        position_id = str(next(self.broker.ids))
+        position = {
+            'id': position_id, 'type': f'POSITION_TYPE_{side}', 'symbol': symbol, 'volume': round(volume, 2),
+            'openPrice': price['ask'] if side == 'BUY' else price['bid'], 'stopLoss': stop_loss,
+            'takeProfit': take_profit, 'profit': 0.0, 'time': datetime.now(timezone.utc),
+        }
+        if options and 'trailingStopLoss' in options:
+            position['trailingStopLoss'] = options['trailingStopLoss']
+        self._revalue(position, price)
+        self.positions[position_id] = position
+        await self.notify('on_position_updated', dict(position))
+        return dict(TRADE_DONE, orderId=position_id, positionId=position_id)
+
+    async def place_order(self, symbol: str, order_type: str, volume: float, open_price: float, stop_loss: float,
+                          take_profit: float, options: dict = None) -> dict:
+        self.broker.price(symbol)
+        order_id = str(next(self.broker.ids))
+        order = {
+            'id': order_id, 'type': f'ORDER_TYPE_{order_type}', 'symbol': symbol, 'volume': round(volume, 2),
+            'openPrice': open_price, 'stopLoss': stop_loss, 'takeProfit': take_profit, 'state': 'ORDER_STATE_PLACED',
+            'time': datetime.now(timezone.utc),
+        }
+        if options and 'trailingStopLoss' in options:
+            order['trailingStopLoss'] = options['trailingStopLoss']
+        self.orders[order_id] = order
+        await self.notify('on_pending_order_updated', dict(order))
+        return dict(TRADE_DONE, orderId=order_id)
+
+    async def modify_position(self, position_id: str, stop_loss: float = None, take_profit: float = None) -> dict:
+        position = self.position(position_id)
+        position['stopLoss'] = stop_loss
+        position['takeProfit'] = take_profit
+        await self.notify('on_position_updated', dict(position))
+        return dict(TRADE_DONE, positionId=position_id)
+
+    async def close_position(self, position_id: str, volume: float = None) -> dict:
+        position = self.position(position_id)
+        if volume is None or volume >= position['volume']:
+            self.balance += position['profit']
+            del self.positions[position_id]
+            await self.notify('on_position_removed', position_id)
+        else:
+            realized = position['profit'] * volume / position['volume']
+            self.balance += realized
+            position['volume'] = round(position['volume'] - volume, 2)
+            self._revalue(position, self.broker.price(position['symbol']))
+            await self.notify('on_position_updated', dict(position))
+        await self.notify('on_account_information_updated', self.account_information())
+        return dict(TRADE_DONE, positionId=position_id)
+
+    def position(self, position_id: str) -> dict:
+        if position_id not in self.positions:
+            raise trade_exception('TRADE_RETCODE_POSITION_CLOSED', 10036, f'Position {position_id} not found')
+        return self.positions[position_id]
+
+    async def price_changed(self, price: dict) -> None:
+        changed = [position for position in self.positions.values() if position['symbol'] == price['symbol']]
+        for position in changed:
+            self._revalue(position, price)
+        information = self.account_information()
+        await self.notify('on_symbol_price_updated', price)
+        await self.notify('on_symbol_prices_updated', [price], information['equity'], information['margin'],
+                          information['freeMargin'], information['marginLevel'], 1)
+        for position in changed:
+            await self.notify('on_position_updated', dict(position))
+
+    async def notify(self, event: str, *args) -> None:
+        """Calls a synchronization listener method on every listener of every open streaming connection."""
+        for stream in list(self.streams):
+            await stream.notify(event, *args)
+
+    @staticmethod
+    def _revalue(position: dict, price: dict) -> None:
+        if position['type'] == 'POSITION_TYPE_BUY':
+            position['currentPrice'] = price['bid']
+            difference = price['bid'] - position['openPrice']
+        else:
+            position['currentPrice'] = price['ask']
+            difference = position['openPrice'] - price['ask']
+        position['profit'] = round(difference * position['volume'] * contract_size(position['symbol']), 2)
+
+
+def contract_size(symbol: str) -> float:
+    return CONTRACT_SIZES.get(symbol, 100000)
+
+
+class FakeRpcConnection:
+    """Fake of the SDK RPC connection, every request goes through FakeBroker.call.
+
+    Like in the SDK, connect, wait_synchronized and close are coroutine functions while the requests are plain
+    methods returning a coroutine.
+    """
+
+    def __init__(self, account: FakeAccount):
+        self.account = account
+        self.broker = account.broker
+
+    async def connect(self) -> None:
+        await self.broker.call('connect', self._done)
+
+    async def wait_synchronized(self, timeout_in_seconds: float = 300) -> None:
+        await self.broker.call('wait_synchronized', self._done)
+
+    async def close(self) -> None:
+        pass
+
+    def get_account_information(self) -> dict:
+        return self.broker.call('get_account_information', self._value(self.account.account_information))
+
+    def get_positions(self) -> list:
+        return self.broker.call('get_positions', self._value(
+            lambda: [dict(position) for position in self.account.positions.values()]))
+
+    def get_position(self, position_id: str) -> dict:
+        return self.broker.call('get_position', self._value(lambda: dict(self.account.position(position_id))))
+
+    def get_orders(self) -> list:
+        return self.broker.call('get_orders', self._value(
+            lambda: [dict(order) for order in self.account.orders.values()]))
+
+    def get_symbol_price(self, symbol: str, keep_subscription: bool = False) -> dict:
+        return self.broker.call('get_symbol_price', self._value(lambda: dict(self.broker.price(symbol))))
+
+    def get_symbol_specification(self, symbol: str) -> dict:
+        return self.broker.call('get_symbol_specification', self._value(lambda: specification(symbol)))
+
+    def get_server_time(self) -> dict:
+        return self.broker.call('get_server_time', self._value(
+            lambda: {'time': datetime.now(timezone.utc), 'brokerTime': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')}))
+
+    def create_market_buy_order(self, symbol: str, volume: float, stop_loss: float = None,
+                                      take_profit: float = None, options: dict = None) -> dict:
+        return self.broker.call('create_market_buy_order', lambda: self.account.open_position(
+            symbol, 'BUY', volume, stop_loss, take_profit, options))
+
+    def create_market_sell_order(self, symbol: str, volume: float, stop_loss: float = None,
+                                       take_profit: float = None, options: dict = None) -> dict:
+        return self.broker.call('create_market_sell_order', lambda: self.account.open_position(
+            symbol, 'SELL', volume, stop_loss, take_profit, options))
+
+    def create_limit_buy_order(self, symbol: str, volume: float, open_price: float, stop_loss: float = None,
+                                     take_profit: float = None, options: dict = None) -> dict:
+        return self.broker.call('create_limit_buy_order', lambda: self.account.place_order(
+            symbol, 'BUY_LIMIT', volume, open_price, stop_loss, take_profit, options))
+
+    def create_limit_sell_order(self, symbol: str, volume: float, open_price: float, stop_loss: float = None,
+                                      take_profit: float = None, options: dict = None) -> dict:
+        return self.broker.call('create_limit_sell_order', lambda: self.account.place_order(
+            symbol, 'SELL_LIMIT', volume, open_price, stop_loss, take_profit, options))
+
+    def create_stop_buy_order(self, symbol: str, volume: float, open_price: float, stop_loss: float = None,
+                                    take_profit: float = None, options: dict = None) -> dict:
+        return self.broker.call('create_stop_buy_order', lambda: self.account.place_order(
+            symbol, 'BUY_STOP', volume, open_price, stop_loss, take_profit, options))
+
+    def create_stop_sell_order(self, symbol: str, volume: float, open_price: float, stop_loss: float = None,
+                                     take_profit: float = None, options: dict = None) -> dict:
+        return self.broker.call('create_stop_sell_order', lambda: self.account.place_order(
+            symbol, 'SELL_STOP', volume, open_price, stop_loss, take_profit, options))
+
+    def modify_position(self, position_id: str, stop_loss: float = None, take_profit: float = None) -> dict:
+        return self.broker.call('modify_position', lambda: self.account.modify_position(
+            position_id, stop_loss, take_profit))
+
+    def close_position(self, position_id: str, options: dict = None) -> dict:
+        return self.broker.call('close_position', lambda: self.account.close_position(position_id))
+
+    def close_position_partially(self, position_id: str, volume: float, options: dict = None) -> dict:
+        return self.broker.call('close_position_partially', lambda: self.account.close_position(position_id, volume))
+
+    @staticmethod
+    async def _done() -> None:
+        return None
+
+    @staticmethod
+    def _value(function):
+        async def value():
+            return function()
+        return value
+
+
+def specification(symbol: str) -> dict:
+    """Symbol specification in the shape MetaAPI returns it."""
+    bid, _ = DEFAULT_PRICES.get(symbol, (1.0, 1.0))
+    digits = len(repr(bid).split('.')[1]) if '.' in repr(bid) else 0
+    return {
+        'symbol': symbol, 'digits': digits, 'point': 10 ** -digits, 'tickSize': 10 ** -digits,
+        'contractSize': contract_size(symbol), 'minVolume': 0.01, 'maxVolume': 100.0, 'volumeStep': 0.01,
+        'profitCurrency': symbol[3:] if len(symbol) == 6 else 'USD',
+    }
+
+
+class FakeStreamingConnection:
+    """Fake of the SDK streaming connection that replays the account state to its synchronization listeners."""
+
+    def __init__(self, account: FakeAccount):
+        self.account = account
+        self.broker = account.broker
+        self.listeners = []
+        self.subscriptions = set()
+
+    def add_synchronization_listener(self, listener) -> None:
+        self.listeners.append(listener)
+
+    def remove_synchronization_listener(self, listener) -> None:
+        self.listeners.remove(listener)
+
+    async def connect(self) -> None:
+        await asyncio.sleep(self.broker.latency)
+        if self not in self.account.streams:
+            self.account.streams.append(self)
+        await self.notify('on_connected', 1)
+        await self.notify('on_symbol_specifications_updated', [specification(symbol) for symbol in self.broker.prices], [])
+        await self.notify('on_account_information_updated', self.account.account_information())
+        await self.notify('on_positions_replaced', [dict(position) for position in self.account.positions.values()])
+        await self.notify('on_positions_synchronized', 'fake')
+        await self.notify('on_pending_orders_replaced', [dict(order) for order in self.account.orders.values()])
+        await self.notify('on_pending_orders_synchronized', 'fake')
+
+    async def wait_synchronized(self, options: dict = None) -> None:
+        pass
+
+    async def subscribe_to_market_data(self, symbol: str, subscriptions: list = None, timeout_in_seconds: float = None,
+                                       wait_for_quote: bool = True) -> None:
+        await asyncio.sleep(self.broker.latency)
+        self.subscriptions.add(symbol)
+        await self.notify('on_symbol_price_updated', self.broker.price(symbol))
+
+    async def unsubscribe_from_market_data(self, symbol: str, subscriptions: list = None) -> None:
+        self.subscriptions.discard(symbol)
+
+    async def close(self) -> None:
+        if self in self.account.streams:
+            self.account.streams.remove(self)
+        await self.notify('on_stream_closed')
+
+    async def notify(self, event: str, *args) -> None:
+        # prices only reach connections subscribed to the symbol, like MetaAPI market data subscriptions
+        if event == 'on_symbol_price_updated' and args[0]['symbol'] not in self.subscriptions:
+            return
+        for listener in self.listeners:
+            try:
+                await getattr(listener, event)('0', *args)
+            except Exception as error:
+                logger.warning(f'Fake broker listener {event} failed: {error}')
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""Paper trading broker: the in-process fake broker with a matching engine that fills orders against a price stream.
+
+PaperBroker is selected with BROKER=paper. ConnectMetaTrader, the bulk position commands and the views run unchanged
+against it. Prices come from a replayed tick file or from a random walk of the fake broker's quotes. On every tick:
+    - pending limit and stop orders fill at the current quote once the price reaches them
+    - positions close at the current quote once the price reaches their stop loss or take profit
+    - the threshold trailing stop that BuildOrderLegs attaches moves the stop loss once its threshold is reached
+
+Every level sits in a heap of its symbol, ordered by the quote side and direction that trigger it, so a tick only
+looks at the top of four heaps and pops the levels it triggers. Equity and margin come from running totals of the
+open volume per symbol. The cost of a tick therefore does not grow with the number of open positions. Position
+profits are revalued when positions are read, and streamed to the listeners every revalue_interval seconds.
+"""
+import asyncio
+import csv
+import heapq
+import itertools
+import logging
+import math
+from datetime import datetime, timezone
+
+from fake_broker import FakeAccount, FakeBroker, FakeRpcConnection, contract_size, specification
+
+logger = logging.getLogger(__name__)
+
+# order types filled by a rising price, on the quote side a buy or sell fills at
+RISING_ORDERS = {'ORDER_TYPE_BUY_STOP': 'ask', 'ORDER_TYPE_SELL_LIMIT': 'bid'}
+FALLING_ORDERS = {'ORDER_TYPE_BUY_LIMIT': 'ask', 'ORDER_TYPE_SELL_STOP': 'bid'}
+
+
+class TriggerBook:
+    """Price levels of one symbol in heaps by the quote side (bid or ask) and the direction that triggers them.
+
+    Removed or replaced levels stay in the heaps until they reach the top, or until they outnumber the live levels
+    and the heaps are rebuilt.
+    """
+
+    def __init__(self):
+        self.heaps = {(side, rising): [] for side in ('bid', 'ask') for rising in (True, False)}
+        self.live = {}
+        self.sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.live)
+
+    def add(self, key: tuple, level: float, side: str, rising: bool) -> None:
+        """Adds a level, replacing the one of the same key.
+
+        Arguments:
+            key: (kind, id) of the level
+            level: price at which it triggers
+            side: quote side that triggers it, bid or ask
+            rising: triggers when the quote rises to the level, otherwise when it falls to it
+        """
+        sequence = next(self.sequence)
+        self.live[key] = sequence
+        heapq.heappush(self.heaps[side, rising], (level if rising else -level, sequence, key))
+        if sum(len(heap) for heap in self.heaps.values()) > 2 * len(self.live) + 64:
+            self._compact()
+
+    def discard(self, key: tuple) -> None:
+        self.live.pop(key, None)
+
+    def triggered(self, bid: float, ask: float) -> list:
+        """Removes and returns the keys of the levels the quote reached."""
+        keys = []
+        for (side, rising), heap in self.heaps.items():
+            price = bid if side == 'bid' else ask
+            bound = price if rising else -price
+            while heap and heap[0][0] <= bound:
+                _, sequence, key = heapq.heappop(heap)
+                if self.live.get(key) == sequence:
+                    del self.live[key]
+                    keys.append(key)
+        return keys
+
+    def _compact(self) -> None:
+        for heap in self.heaps.values():
+            heap[:] = [entry for entry in heap if self.live.get(entry[2]) == entry[1]]
+            heapq.heapify(heap)
+
+
+class PaperBroker(FakeBroker):
+    """Fake broker whose accounts fill orders against a price feed started with the first account request.
+
+    Arguments:
+        prices_path: CSV with time, symbol, bid and ask columns to replay, a random walk is used if it is None
+        speed: replay speed, 1 replays the file in real time and 0 as fast as possible
+        tick_interval: seconds between the random walk ticks
+        volatility: standard deviation of the relative random walk move per tick
+        revalue_interval: seconds between the position profit updates streamed to the listeners
+        latency, balance, seed: as for FakeBroker
+    """
+
+    def __init__(self, prices_path: str = None, speed: float = 1.0, tick_interval: float = 0.5,
+                 volatility: float = 0.0002, revalue_interval: float = 5.0, latency: float = 0.0,
+                 balance: float = 10000.0, seed: int = None):
+        super().__init__(latency=latency, balance=balance, seed=seed)
+        self.prices_path = prices_path
+        self.speed = speed
+        self.tick_interval = tick_interval
+        self.volatility = volatility
+        self.revalue_interval = revalue_interval
+        self.feed = None
+        self.ticks = 0
+
+    async def get_account(self, account_id: str) -> 'PaperAccount':
+        self.start()
+        return self.account(account_id)
+
+    def account(self, account_id: str) -> 'PaperAccount':
+        if account_id not in self.accounts:
+            self.accounts[account_id] = PaperAccount(self, account_id, self.balance)
+        return self.accounts[account_id]
+
+    def start(self) -> None:
+        """Starts the price feed on the running event loop if it is not running yet."""
+        if self.feed is None or self.feed.done():
+            self.feed = asyncio.get_running_loop().create_task(self.run_feed())
+
+    async def stop(self) -> None:
+        if self.feed is not None:
+            self.feed.cancel()
+            await asyncio.gather(self.feed, return_exceptions=True)
+
+    async def run_feed(self) -> None:
+        """Streams the replayed or random walk ticks to every account and revalues their positions periodically."""
+        ticks = self.replay_ticks() if self.prices_path else self.random_walk_ticks()
+        loop = asyncio.get_running_loop()
+        revalued = loop.time()
+        try:
+            async for symbol, bid, ask in ticks:
+                await self.set_price(symbol, bid, ask)
+                self.ticks += 1
+                if loop.time() - revalued >= self.revalue_interval:
+                    revalued = loop.time()
+                    for account in list(self.accounts.values()):
+                        await account.stream_positions()
+            logger.info(f'Paper price replay finished after {self.ticks} ticks')
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.error(f'Paper price feed failed: {error!r}')
+
+    async def random_walk_ticks(self):
+        """Moves every quoted symbol by a random relative step each tick_interval, keeping its spread."""
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            for symbol, price in list(self.prices.items()):
+                spread = price['ask'] - price['bid']
+                digits = specification(symbol)['digits']
+                bid = round(price['bid'] * math.exp(self.random.gauss(0, self.volatility)), digits)
+                yield symbol, bid, round(bid + spread, digits)
+
+    async def replay_ticks(self):
+        """Reads the ticks of prices_path, waiting between them as long as the file does, divided by speed."""
+        previous = None
+        with open(self.prices_path, newline='', encoding='utf-8') as prices_file:
+            for row in csv.DictReader(prices_file):
+                tick_time = parse_time(row['time'])
+                if previous is not None and self.speed > 0:
+                    await asyncio.sleep(max(tick_time - previous, 0.0) / self.speed)
+                elif self.ticks % 1000 == 0:
+                    # lets the bot's requests in between ticks when replaying as fast as possible
+                    await asyncio.sleep(0)
+                previous = tick_time
+                yield row['symbol'], float(row['bid']), float(row['ask'])
+
+
+def parse_time(value: str) -> float:
+    """Returns epoch seconds of an epoch or ISO 8601 time, naive times are taken as UTC."""
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+class PaperAccount(FakeAccount):
+    """Fake account whose pending orders, stop losses, take profits and trailing stops trigger on price ticks."""
+
+    def __init__(self, broker: PaperBroker, account_id: str, balance: float):
+        super().__init__(broker, account_id, balance)
+        self.books = {}
+        # per symbol: buy volume, buy volume x open price, sell volume, sell volume x open price
+        self.exposure = {}
+        # per position: threshold trailing stop thresholds and the index of the next one
+        self.trailing = {}
+
+    def get_rpc_connection(self) -> 'PaperRpcConnection':
+        return PaperRpcConnection(self)
+
+    def book(self, symbol: str) -> TriggerBook:
+        if symbol not in self.books:
+            self.books[symbol] = TriggerBook()
+        return self.books[symbol]
+
+    def account_information(self) -> dict:
+        profit = 0.0
+        margin = 0.0
+        for symbol, (buy_volume, buy_cost, sell_volume, sell_cost) in self.exposure.items():
+            price = self.broker.prices[symbol]
+            size = contract_size(symbol)
+            profit += (price['bid'] * buy_volume - buy_cost + sell_cost - price['ask'] * sell_volume) * size
+            margin += (buy_cost + sell_cost) * size / self.leverage
+        equity = self.balance + profit
+        return {
+            'platform': 'mt5', 'broker': 'Paper Broker', 'currency': 'USD', 'server': 'Paper', 'name': self.id,
+            'login': self.id, 'balance': round(self.balance, 2), 'equity': round(equity, 2), 'margin': round(margin, 2),
+            'freeMargin': round(equity - margin, 2), 'leverage': self.leverage,
+            'marginLevel': round(equity / margin * 100, 2) if margin else None,
+        }
+
+    async def open_position(self, symbol: str, side: str, volume: float, stop_loss: float, take_profit: float,
+                            options: dict = None) -> dict:
+        result = await super().open_position(symbol, side, volume, stop_loss, take_profit, options)
+        position = self.positions[result['positionId']]
+        self._expose(position, position['volume'])
+        self._track_position(position)
+        thresholds = (options or {}).get('trailingStopLoss', {}).get('threshold')
+        if thresholds:
+            if thresholds.get('units', 'ABSOLUTE_PRICE') != 'ABSOLUTE_PRICE':
+                logger.warning(f"Paper broker ignores {thresholds['units']} trailing stops of position {position['id']}")
+            else:
+                self.trailing[position['id']] = [sorted(thresholds['thresholds'], key=lambda item: item['threshold'],
+                                                        reverse=side == 'SELL'), 0]
+                self._track_trailing(position)
+        return result
+
+    async def place_order(self, symbol: str, order_type: str, volume: float, open_price: float, stop_loss: float,
+                          take_profit: float, options: dict = None) -> dict:
+        result = await super().place_order(symbol, order_type, volume, open_price, stop_loss, take_profit, options)
+        order = self.orders[result['orderId']]
+        side = RISING_ORDERS.get(order['type']) or FALLING_ORDERS[order['type']]
+        self.book(symbol).add(('order', order['id']), open_price, side, order['type'] in RISING_ORDERS)
+        return result
+
+    async def modify_position(self, position_id: str, stop_loss: float = None, take_profit: float = None) -> dict:
+        result = await super().modify_position(position_id, stop_loss, take_profit)
+        self._track_position(self.positions[position_id])
+        return result
+
+    async def close_position(self, position_id: str, volume: float = None) -> dict:
+        position = self.position(position_id)
+        closed = position['volume'] if volume is None else min(volume, position['volume'])
+        self._expose(position, -closed)
+        if closed >= position['volume']:
+            book = self.book(position['symbol'])
+            for kind in ('stop', 'take', 'trail'):
+                book.discard((kind, position_id))
+            self.trailing.pop(position_id, None)
+        return await super().close_position(position_id, volume)
+
+    def position(self, position_id: str) -> dict:
+        position = super().position(position_id)
+        self._revalue(position, self.broker.prices[position['symbol']])
+        return position
+
+    def revalue_positions(self) -> list:
+        """Revalues every position at the current quotes and returns them."""
+        positions = list(self.positions.values())
+        for position in positions:
+            self._revalue(position, self.broker.prices[position['symbol']])
+        return positions
+
+    async def stream_positions(self) -> None:
+        """Streams the revalued positions to the listeners, which only hear of them on changes otherwise."""
+        if not self.streams:
+            return
+        for position in self.revalue_positions():
+            await self.notify('on_position_updated', dict(position))
+
+    async def price_changed(self, price: dict) -> None:
+        book = self.books.get(price['symbol'])
+        while book:
+            triggered = book.triggered(price['bid'], price['ask'])
+            if not triggered:
+                break
+            for kind, item_id in triggered:
+                await self._trigger(kind, item_id)
+
+        information = self.account_information()
+        await self.notify('on_symbol_price_updated', price)
+        await self.notify('on_symbol_prices_updated', [price], information['equity'], information['margin'],
+                          information['freeMargin'], information['marginLevel'], 1)
+
+    async def _trigger(self, kind: str, item_id: str) -> None:
+        if kind == 'order':
+            order = self.orders.pop(item_id, None)
+            if order is None:
+                return
+            await self.notify('on_pending_order_completed', item_id)
+            side = 'BUY' if order['type'].startswith('ORDER_TYPE_BUY') else 'SELL'
+            options = {'trailingStopLoss': order['trailingStopLoss']} if 'trailingStopLoss' in order else None
+            await self.open_position(order['symbol'], side, order['volume'], order['stopLoss'], order['takeProfit'],
+                                     options)
+        elif item_id in self.positions:
+            if kind == 'trail':
+                await self._trail(self.positions[item_id])
+            else:
+                await self.close_position(item_id)
+
+    async def _trail(self, position: dict) -> None:
+        # moves the stop loss to the reached threshold's stop loss if that protects more, then waits for the next one
+        thresholds = self.trailing[position['id']]
+        stop_loss = thresholds[0][thresholds[1]]['stopLoss']
+        thresholds[1] += 1
+        buy = position['type'] == 'POSITION_TYPE_BUY'
+        current = position['stopLoss']
+        if current is None or (stop_loss > current if buy else stop_loss < current):
+            await self.modify_position(position['id'], stop_loss, position['takeProfit'])
+        self._track_trailing(position)
+
+    def _track_position(self, position: dict) -> None:
+        # a buy closes on the bid: its stop loss triggers when the bid falls to it, its take profit when it rises
+        book = self.book(position['symbol'])
+        buy = position['type'] == 'POSITION_TYPE_BUY'
+        side = 'bid' if buy else 'ask'
+        for kind, level, rising in (('stop', position['stopLoss'], not buy), ('take', position['takeProfit'], buy)):
+            if level:
+                book.add((kind, position['id']), level, side, rising)
+            else:
+                book.discard((kind, position['id']))
+
+    def _track_trailing(self, position: dict) -> None:
+        thresholds, index = self.trailing[position['id']]
+        if index >= len(thresholds):
+            del self.trailing[position['id']]
+            return
+        buy = position['type'] == 'POSITION_TYPE_BUY'
+        self.book(position['symbol']).add(('trail', position['id']), thresholds[index]['threshold'],
+                                          'bid' if buy else 'ask', buy)
+
+    def _expose(self, position: dict, volume: float) -> None:
+        exposure = self.exposure.setdefault(position['symbol'], [0.0, 0.0, 0.0, 0.0])
+        offset = 0 if position['type'] == 'POSITION_TYPE_BUY' else 2
+        exposure[offset] += volume
+        exposure[offset + 1] += volume * position['openPrice']
+
+
+class PaperRpcConnection(FakeRpcConnection):
+    """Fake RPC connection that revalues the positions it returns at the current quotes."""
+
+    def get_positions(self) -> list:
+        return self.broker.call('get_positions', self._value(
+            lambda: [dict(position) for position in self.account.revalue_positions()]))
@@ -1,11 +1,19 @@
 #!/usr/bin/env python3
 import asyncio
+import bisect
+import functools
+import html
+import inspect
+import itertools
 import logging
 import math
+import numpy
 import os
 import re
 import json
 import pytz
+import threading
+import time
 
 
 try:
@@ -13,11 +21,18 @@ try:
 except ImportError:
     from typing_extensions import Literal
 
-from metaapi_cloud_sdk import MetaApi
+from cachetools import LRUCache, TTLCache
+from metaapi_cloud_sdk import MetaApi, SynchronizationListener
 from prettytable import PrettyTable
-from telegram import ParseMode, Update
-from telegram.ext import CommandHandler, Filters, MessageHandler, Updater, ConversationHandler, CallbackContext
+from telegram import Bot, ParseMode, Update
+from telegram.error import RetryAfter
+from telegram.ext import CommandHandler, Filters, MessageHandler, TypeHandler, Updater, ConversationHandler, CallbackContext
+from telegram.utils.request import Request
+from concurrent.futures import Future
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 
 
@@ -25,6 +40,22 @@ from datetime import datetime
 API_KEY = os.environ.get("API_KEY")
 ACCOUNT_ID = os.environ.get("ACCOUNT_ID")
 
+# multi-account mode: JSON list of accounts every signal is copied to, e.g.
+# [{"id": "...", "name": "main", "risk_factor": 0.01, "risk_per_trade": 0.01, "plan": "A"}], missing settings use the
+# globals below, and an empty list trades ACCOUNT_ID only
+ACCOUNTS = json.loads(os.environ.get('ACCOUNTS', '[]'))
+
+# broker behind the MetaAPI calls: "metaapi", or "fake" for the in-process fake broker (fake_broker.py) with the given RPC latency in seconds
+BROKER = os.environ.get('BROKER', 'metaapi')
+FAKE_BROKER_LATENCY = float(os.environ.get('FAKE_BROKER_LATENCY', '0.05'))
+
+# paper trading (BROKER "paper", paper_broker.py): orders fill against the ticks of PAPER_PRICES (CSV with time, symbol, bid, ask)
+# replayed at PAPER_SPEED times real time (0 = as fast as possible), or against a random walk ticking every PAPER_TICK_INTERVAL seconds
+PAPER_PRICES = os.environ.get('PAPER_PRICES')
+PAPER_SPEED = float(os.environ.get('PAPER_SPEED', '1'))
+PAPER_TICK_INTERVAL = float(os.environ.get('PAPER_TICK_INTERVAL', '0.5'))
+PAPER_BALANCE = float(os.environ.get('PAPER_BALANCE', '10000'))
+
 # Telegram Credentials
 TOKEN = os.environ.get("TOKEN")
 TELEGRAM_USER = os.environ.get("TELEGRAM_USER", "")  # Đọc biến môi trường TELEGRAM_USERS, mặc định là chuỗi trống
@@ -37,18 +68,85 @@ APP_URL = os.environ.get("APP_URL")
 # Port number for Telegram bot web hook
 PORT = int(os.environ.get('PORT', '8443'))
 
+# Port number for the Prometheus metrics endpoint (/metrics), 0 disables it
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+
 PLAN = os.environ.get('PLAN','A')
 
 TRAILINGSTOP = os.environ.get('TRAILING_STOP','Y')
 
+# broker specific symbol names: a suffix added to every symbol (e.g. "m" for XAUUSDm) and/or a JSON map of exceptions
+SYMBOL_SUFFIX = os.environ.get('SYMBOL_SUFFIX', '')
+BROKER_SYMBOLS = json.loads(os.environ.get('BROKER_SYMBOLS', '{}'))
+
+# minimum classifier confidence (0.5 - 1.0) for a message to be traded as a signal
+SIGNAL_MIN_CONFIDENCE = float(os.environ.get('SIGNAL_MIN_CONFIDENCE', '0.5'))
+
+# parsed signals kept in memory, and seconds during which an identical signal is not placed again (0 disables)
+PARSE_CACHE_SIZE = int(os.environ.get('PARSE_CACHE_SIZE', '1024'))
+DUPLICATE_WINDOW = float(os.environ.get('DUPLICATE_WINDOW', '120'))
+
 # RISK FACTOR
 RISK_FACTOR = float(os.environ.get("RISK_FACTOR"))
 RISK_PERTRADE = float(os.environ.get("RISK_PERTRADE"))
 
+# seconds replies of one update are collected before they are sent (or appended to the message already sent)
+REPLY_DELAY = float(os.environ.get('REPLY_DELAY', '1.0'))
+
+# Telegram outbound queue: sender threads, messages per second overall and per chat, messages per minute per group,
+# and the burst a chat may send before its rate applies
+TELEGRAM_SEND_WORKERS = int(os.environ.get('TELEGRAM_SEND_WORKERS', '4'))
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_GROUP_RATE = float(os.environ.get('TELEGRAM_GROUP_RATE', '20'))
+TELEGRAM_CHAT_BURST = float(os.environ.get('TELEGRAM_CHAT_BURST', '3'))
+
+# work queues behind the Telegram handlers: workers and queued jobs for trade signals, position management commands
+# (close, partial close, trailing stop) and read-only views (account info, open trades, pending orders)
+SIGNAL_WORKERS = int(os.environ.get('SIGNAL_WORKERS', '4'))
+SIGNAL_QUEUE_SIZE = int(os.environ.get('SIGNAL_QUEUE_SIZE', '100'))
+COMMAND_WORKERS = int(os.environ.get('COMMAND_WORKERS', '2'))
+COMMAND_QUEUE_SIZE = int(os.environ.get('COMMAND_QUEUE_SIZE', '20'))
+VIEW_WORKERS = int(os.environ.get('VIEW_WORKERS', '1'))
+VIEW_QUEUE_SIZE = int(os.environ.get('VIEW_QUEUE_SIZE', '10'))
+
+# MetaAPI connection retries before a command gives up
+CONNECT_RETRIES = int(os.environ.get('CONNECT_RETRIES', '3'))
+
+# Bulk close/partial close/trailing stop: parallel position requests and seconds allowed per position
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', '5'))
+BULK_TIMEOUT = float(os.environ.get('BULK_TIMEOUT', '15'))
+
+# streaming price cache: seconds before a price is stale, symbols kept subscribed, and Y to subscribe to every symbol
+PRICE_MAX_AGE = float(os.environ.get('PRICE_MAX_AGE', '5'))
+PRICE_SUBSCRIPTIONS = int(os.environ.get('PRICE_SUBSCRIPTIONS', '20'))
+PRICE_SUBSCRIBE_ALL = os.environ.get('PRICE_SUBSCRIBE_ALL', 'N') == 'Y'
+
+# currency of the MetaTrader account until the account information says otherwise, pip values are converted to it
+ACCOUNT_CURRENCY = os.environ.get('ACCOUNT_CURRENCY', 'USD')
+
+# seconds a symbol specification (digits, point, volume step, ...) is used before it is loaded again
+SPEC_MAX_AGE = float(os.environ.get('SPEC_MAX_AGE', '3600'))
+
+# seconds the cached balance/equity/margin stay valid once the streaming connection is down
+ACCOUNT_MAX_AGE = float(os.environ.get('ACCOUNT_MAX_AGE', '30'))
+
+# start-up warm-up: symbols whose specifications are loaded, seconds to wait before accepting updates anyway,
+# and seconds between keepalive requests that stop the MetaAPI connection from going idle (0 disables)
+WARMUP_SYMBOLS = [symbol for symbol in os.environ.get('WARMUP_SYMBOLS', 'XAUUSD').split(',') if symbol]
+WARMUP_TIMEOUT = float(os.environ.get('WARMUP_TIMEOUT', '120'))
+KEEPALIVE_INTERVAL = float(os.environ.get('KEEPALIVE_INTERVAL', '60'))
+
 # Enables logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Telegram message length limit in characters
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Telegram outbox priorities, trade confirmations are sent before informational replies
+PRIORITY_TRADE, PRIORITY_INFO = range(2)
+
 # possibles states for conversation handler
 CALCULATE, TRADE, DECISION, ERROR = range(4)
 
@@ -58,6 +156,23 @@ SYMBOLSPLUS = ['AUD/CAD', 'AUD/CHF', 'AUD/JPY', 'AUD/NZD', 'AUD/USD', 'CAD/CHF',
 TYPETRADE = ['BUY','BUY LIMIT','BUY NOW','SELL','SELL LIMIT','SELL NOW']
 OTHER = ['@','Entry','TP','SL','STOP LOSS','TAKE PROFIT','TARGET PROFIT','BUY','BUY LIMIT','BUY NOW','SELL','SELL LIMIT','SELL NOW']
 
+# order types in the priority ParseSignal checks them, with the lowercase text that identifies each one
+ORDER_TYPES = [('buy limit', 'Buy Limit'), ('sell limit', 'Sell Limit'), ('buy stop', 'Buy Stop'), ('sell stop', 'Sell Stop'), ('buy now', 'Buy Now'), ('sell now', 'Sell Now'), ('buy', 'Buy'), ('sell', 'Sell')]
+
+# symbols that are renamed before trading
+SYMBOL_ALIASES = {'GOLD': 'XAUUSD', 'NAS100': 'USTEC'}
+
+# pip sizes of the metals, which do not follow the FX digits convention
+METAL_PIP_SIZES = {'XAUUSD': 0.1, 'XAGUSD': 0.001}
+
+# precompiled patterns used while parsing signals
+# same matches as (pips|\(.+\))|(pip|\(.+\))|..., without retrying the bracket alternative five times per character
+PIPS_PATTERN = re.compile(r"\(.+\)|pips?|scalper|intraday|swing")
+SPACED_NUMBER_PATTERN = re.compile(r"(\d+) +(\d+)(?!0)")
+PRICE_SPLIT_PATTERN = re.compile('[a-z]+|[-,/,@]', flags=re.IGNORECASE)
+# every signal names a side, so messages without one are rejected before any other work
+SIGNAL_PREFILTER_PATTERN = re.compile('buy|sell', flags=re.IGNORECASE)
+
 
 def ConvertDateTime(date) -> str:
     """Convert datetime object to string
@@ -114,20 +229,6 @@ def CheckSymbolStr(stringcheck,stringsrc)-> int:
         return checkstr
     return checkstr
 
-def FindTP(alphacheck,signalsrc) -> float: 
-    arrayfind=[]
-    alphacheck = alphacheck.lower()
-    for i in range(len(signalsrc)):
-        if(signalsrc[i] != ''):
-            j = signalsrc[i].lower().find(alphacheck,0)
-            if(j!=-1):
-                try:
-                    tpfindvar = float((signalsrc[i].split())[-1])
-                    arrayfind.append(tpfindvar)
-                except ValueError:
-                    pass
-    return arrayfind
-
 def calculate_rr_coefficient(take_profit_pips, stop_loss_pips):
     rr_coefficients = []
     
@@ -138,367 +239,2036 @@ def calculate_rr_coefficient(take_profit_pips, stop_loss_pips):
     return rr_coefficients
 
 def remove_pips(signal):
-  temp = re.sub(r"(pips|\(.+\))|(pip|\(.+\))|(scalper|\(.+\))|(intraday|\(.+\))|(swing|\(.+\))", "", signal)
+  temp = PIPS_PATTERN.sub("", signal)
   return temp
 
-# Lấy danh sách pending orders
-async def get_pending_orders(update: Update):
-    try:
-        api = MetaApi(API_KEY)
-        account = await api.metatrader_account_api.get_account(ACCOUNT_ID)
-        initial_state = account.state
+
+def is_connection_error(error: Exception) -> bool:
+    """Checks if an exception means the MetaAPI connection is no longer usable.
+
+    Arguments:
+        error: exception raised by a MetaAPI call
+    """
+    if isinstance(error, (ConnectionError, asyncio.TimeoutError)):
+        return True
+    return type(error).__name__ in ('NotConnectedException', 'TimeoutException', 'NotSynchronizedException')
+
+
+# latency histogram bucket upper bounds in seconds, from 50 µs to about 150 s in 25% steps
+LATENCY_BUCKETS = tuple(0.00005 * 1.25 ** i for i in range(68))
+
+
+class LatencyHistogram:
+    """Fixed bucket latency histogram, recording is O(log buckets) and memory does not grow with the sample count."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """Estimates a percentile as the upper bound of the bucket holding it.
+
+        Arguments:
+            q: percentile between 0 and 1
+
+        Returns:
+            the latency in seconds, never more than the largest recorded sample
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(LATENCY_BUCKETS[index], self.max) if index < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+
+class LatencyRecorder:
+    """Collects per-stage latencies of the signal pipeline measured with a monotonic clock."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def measure(self, stage: str):
+        """Times the body of a with block, including when it raises."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - start)
+
+    def timed(self, stage: str = None):
+        """Decorator that times every call of a function or coroutine function.
+
+        Arguments:
+            stage: name of the stage, defaults to the function name
+        """
+        def decorator(function):
+            name = stage or function.__name__
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    with self.measure(name):
+                        return await function(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.measure(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self) -> PrettyTable:
+        """Builds a table with count, p50, p95, p99 and max in milliseconds for every stage."""
+        table = PrettyTable()
+        table.field_names = ['Stage', 'Count', 'p50', 'p95', 'p99', 'Max']
+        table.align['Stage'] = 'l'
+        with self.lock:
+            for stage in sorted(self.histograms):
+                histogram = self.histograms[stage]
+                table.add_row([stage, histogram.count] + [
+                    f'{seconds * 1000:.1f}' for seconds in (histogram.percentile(0.5), histogram.percentile(0.95),
+                                                            histogram.percentile(0.99), histogram.max)
+                ])
+        return table
+
+    def snapshot(self) -> dict:
+        """Returns a copy of every stage histogram as (bucket counts, count, total seconds)."""
+        with self.lock:
+            return {stage: (list(histogram.counts), histogram.count, histogram.total)
+                    for stage, histogram in self.histograms.items()}
+
+    def log_report(self) -> None:
+        if self.histograms:
+            logger.info(f'Latency per stage (ms):\n{self.report()}')
+
+
+latency_recorder = LatencyRecorder()
+
+
+class Metrics:
+    """Counters, gauges and latency histograms rendered in the Prometheus text format.
+
+    Metrics are keyed by name and label values. Gauges that describe current state (connections, readiness) are read
+    from collector callbacks at scrape time instead of being updated by the code they describe.
+    """
+
+    # every fourth latency bucket is exported, which keeps the output short with about 2.4x steps
+    EXPORTED_BUCKETS = range(3, len(LATENCY_BUCKETS), 4)
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def describe(self, name: str, text: str) -> None:
+        self.help[name] = text
+
+    def add_collector(self, collector) -> None:
+        """Registers a callback returning (name, labels, value) gauge samples computed at scrape time."""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            histograms = [(key, list(histogram.counts), histogram.count, histogram.total) for key, histogram in histograms]
+
+        self._render_samples(lines, 'counter', [(name, labels, value) for (name, labels), value in counters])
+        gauges = []
+        for collector in self.collectors:
+            try:
+                gauges.extend((name, tuple(sorted(labels.items())), value) for name, labels, value in collector())
+            except Exception as error:
+                logger.warning(f'Error collecting metrics: {error}')
+        self._render_samples(lines, 'gauge', sorted(gauges))
+
+        stages = latency_recorder.snapshot()
+        histograms += [(('signal_stage_latency_seconds', (('stage', stage),)), counts, count, total)
+                       for stage, (counts, count, total) in sorted(stages.items())]
+        described = set()
+        for (name, labels), counts, count, total in histograms:
+            if name not in described:
+                described.add(name)
+                self._header(lines, name, 'histogram')
+            cumulative = 0
+            previous = 0
+            for index in self.EXPORTED_BUCKETS:
+                cumulative += sum(counts[previous:index + 1])
+                previous = index + 1
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', f'{LATENCY_BUCKETS[index]:.6g}'),))} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f'{name}_sum{self._labels(labels)} {total}')
+            lines.append(f'{name}_count{self._labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def _render_samples(self, lines: list, kind: str, samples: list) -> None:
+        described = set()
+        for name, labels, value in samples:
+            if name not in described:
+                described.add(name)
+                self._header(lines, name, kind)
+            lines.append(f'{name}{self._labels(labels)} {value}')
+
+    def _header(self, lines: list, name: str, kind: str) -> None:
+        if name in self.help:
+            lines.append(f'# HELP {name} {self.help[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    @staticmethod
+    def _labels(labels: tuple) -> str:
+        if not labels:
+            return ''
+        escaped = []
+        for key, value in labels:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{key}="{value}"')
+        return '{' + ','.join(escaped) + '}'
+
+
+metrics = Metrics()
+metrics.describe('telegram_updates_total', 'Telegram updates received')
+metrics.describe('signals_total', 'Messages classified, by result (parsed, rejected, duplicate)')
+metrics.describe('orders_total', 'Order legs sent to MetaTrader, by order type, symbol and result (submitted, failed)')
+metrics.describe('metaapi_rpc_latency_seconds', 'MetaAPI RPC request latency by method')
+metrics.describe('metaapi_rpc_errors_total', 'MetaAPI RPC requests that raised, by method')
+metrics.describe('telegram_request_latency_seconds', 'Telegram Bot API request latency by method')
+metrics.describe('telegram_request_errors_total', 'Telegram Bot API requests that raised, by method')
+metrics.describe('signal_stage_latency_seconds', 'Signal pipeline stage latency, see /latency')
+metrics.describe('work_submitted_total', 'Handler work queued, by queue (signals, commands, views)')
+metrics.describe('work_rejected_total', 'Handler work rejected because its queue was full, by queue')
+metrics.describe('work_queue_wait_seconds', 'Seconds handler work waited in its queue before a worker started it')
+metrics.describe('signal_cache_lookups_total', 'Classified signal cache lookups, by result (hit, miss)')
+metrics.describe('account_trades_total', 'Signals copied to an account in multi-account mode, by account and result (entered, failed)')
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves GET /metrics for Prometheus."""
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # scrapes are too frequent for the info log
+        logger.debug(format, *args)
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Starts the metrics endpoint in a daemon thread next to the Telegram webhook.
+
+    Arguments:
+        port: port to listen on
+
+    Returns:
+        the running HTTP server
+    """
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f'Serving metrics on port {port}')
+    return server
+
+
+class TimedRpcConnection:
+    """Wraps the MetaAPI RPC connection and records the latency and errors of every request in the metrics.
+
+    Most SDK requests are plain methods returning a coroutine rather than coroutine functions, so every method is
+    wrapped and whatever awaitable it returns is timed until it completes.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.connection, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def timed(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if inspect.isawaitable(result):
+                return self._timed(name, result)
+            return result
+        return timed
+
+    @staticmethod
+    async def _timed(name: str, request):
+        start = time.monotonic()
+        try:
+            return await request
+        except Exception:
+            metrics.inc('metaapi_rpc_errors_total', method=name)
+            raise
+        finally:
+            metrics.observe('metaapi_rpc_latency_seconds', time.monotonic() - start, method=name)
+
+
+class TimedBot(Bot):
+    """Telegram bot that records the latency and errors of every Bot API request in the metrics."""
+
+    def _post(self, endpoint: str, *args, **kwargs):
+        start = time.monotonic()
+        try:
+            return super()._post(endpoint, *args, **kwargs)
+        except Exception:
+            metrics.inc('telegram_request_errors_total', method=endpoint)
+            raise
+        finally:
+            metrics.observe('telegram_request_latency_seconds', time.monotonic() - start, method=endpoint)
+
+
+class ConnectionManager:
+    """Keeps one MetaAPI account with its RPC and streaming connections alive for the whole process.
+
+    Handlers ask for the live connection instead of deploying, connecting and synchronizing on every message. The streaming connection feeds the synchronization listeners (price cache and friends) registered with add_listener.
+    """
+
+    def __init__(self, api_key: str, account_id: str, api_factory=None):
+        self.api_key = api_key
+        self.account_id = account_id
+        self.api_factory = api_factory or MetaApi
+        self.api = None
+        self.account = None
+        self.connection = None
+        self.synchronized = False
+        self.streaming = None
+        self.streaming_task = None
+        self.listeners = []
+        self.loop = None
+        self.lock = None
+        self.streaming_lock = None
+
+    def add_listener(self, listener: SynchronizationListener) -> None:
+        """Registers a synchronization listener on the current and every future streaming connection."""
+        self.listeners.append(listener)
+        if self.streaming is not None:
+            self.streaming.add_synchronization_listener(listener)
+
+    async def get_connection(self, synchronized: bool = False):
+        """Returns the shared RPC connection, connecting (or reconnecting) first if needed.
+
+        Arguments:
+            synchronized: waits until the terminal state is synchronized before returning
+        """
+        self._bind_loop()
+
+        async with self.lock:
+            for attempt in range(1, CONNECT_RETRIES + 1):
+                try:
+                    if self.connection is None:
+                        await self._connect()
+                    if synchronized and not self.synchronized:
+                        logger.info('Waiting for SDK to synchronize to terminal state ...')
+                        await self.connection.wait_synchronized()
+                        self.synchronized = True
+                    return self.connection
+                except Exception as error:
+                    logger.warning(f'MetaAPI connection attempt {attempt}/{CONNECT_RETRIES} failed: {error}')
+                    await self._close()
+                    if attempt == CONNECT_RETRIES:
+                        raise
+                    await asyncio.sleep(attempt)
+
+    async def get_streaming_connection(self):
+        """Returns the shared streaming connection, connecting and synchronizing it first if needed."""
+        self._bind_loop()
+
+        # synchronizing the stream can take a while, so it does not hold the RPC lock
+        async with self.streaming_lock:
+            for attempt in range(1, CONNECT_RETRIES + 1):
+                try:
+                    if self.streaming is None:
+                        await self._connect_streaming()
+                    return self.streaming
+                except Exception as error:
+                    logger.warning(f'MetaAPI streaming connection attempt {attempt}/{CONNECT_RETRIES} failed: {error}')
+                    await self._close_streaming()
+                    if attempt == CONNECT_RETRIES:
+                        raise
+                    await asyncio.sleep(attempt)
+
+    def start_streaming(self) -> None:
+        """Connects the streaming connection in the background if it is not connected or connecting yet."""
+        if self.streaming is not None or (self.streaming_task is not None and not self.streaming_task.done()):
+            return
+        self.streaming_task = asyncio.ensure_future(self._start_streaming())
+
+    async def reset(self, error: Exception = None) -> None:
+        """Drops the shared RPC connection so the next caller reconnects.
+
+        Arguments:
+            error: optional exception that caused the reset, ignored if it is not a connection error
+        """
+        if error is not None and not is_connection_error(error):
+            return
+        if self.lock is None:
+            return
+        async with self.lock:
+            await self._close()
+
+    async def reset_streaming(self, error: Exception = None) -> None:
+        """Drops the shared streaming connection so the next caller reconnects.
+
+        Arguments:
+            error: optional exception that caused the reset, ignored if it is not a connection error
+        """
+        if error is not None and not is_connection_error(error):
+            return
+        if self.streaming_lock is None:
+            return
+        async with self.streaming_lock:
+            await self._close_streaming()
+
+    async def _start_streaming(self) -> None:
+        try:
+            await self.get_streaming_connection()
+        except Exception as error:
+            logger.warning(f'Error starting MetaAPI streaming connection: {error}')
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        # connections and locks are bound to the event loop that created them
+        if self.loop is not loop:
+            self.loop = loop
+            self.lock = asyncio.Lock()
+            self.streaming_lock = asyncio.Lock()
+            self.api = self.account = self.connection = self.streaming = self.streaming_task = None
+            self.synchronized = False
+
+    async def _ensure_account(self) -> None:
+        if self.api is None:
+            self.api = self.api_factory(self.api_key)
+        self.account = await self.api.metatrader_account_api.get_account(self.account_id)
         deployed_states = ['DEPLOYING', 'DEPLOYED']
 
-        if initial_state not in deployed_states:
+        if self.account.state not in deployed_states:
             #  wait until account is deployed and connected to broker
             logger.info('Deploying account')
-            await account.deploy()
+            await self.account.deploy()
 
         logger.info('Waiting for API server to connect to broker ...')
-        await account.wait_connected()
+        await self.account.wait_connected()
+
+    async def _connect(self) -> None:
+        await self._ensure_account()
 
-        # connect to MetaApi API
-        connection = account.get_rpc_connection()
+        # connect to MetaApi API, every request is timed for the metrics endpoint
+        connection = TimedRpcConnection(self.account.get_rpc_connection())
+        await connection.connect()
+        self.connection = connection
+        self.synchronized = False
+        logger.info('Connected to MetaAPI')
+
+    async def _connect_streaming(self) -> None:
+        await self._ensure_account()
+        connection = self.account.get_streaming_connection()
+        for listener in self.listeners:
+            connection.add_synchronization_listener(listener)
         await connection.connect()
 
-        # obtains account information from MetaTrader server
-        orders = await connection.get_orders()
+        logger.info('Waiting for streaming connection to synchronize to terminal state ...')
+        await connection.wait_synchronized()
+        self.streaming = connection
+        logger.info('Connected to MetaAPI streaming')
+
+    async def _close(self) -> None:
+        connection = self.connection
+        self.connection = None
+        self.synchronized = False
+        if connection is not None:
+            try:
+                await connection.close()
+            except Exception as error:
+                logger.warning(f'Error closing MetaAPI connection: {error}')
+
+    async def _close_streaming(self) -> None:
+        connection = self.streaming
+        self.streaming = None
+        if connection is not None:
+            try:
+                await connection.close()
+            except Exception as error:
+                logger.warning(f'Error closing MetaAPI streaming connection: {error}')
+
+
+def CreateBrokerFactory():
+    """Returns the factory that creates the MetaAPI client, the in-process fake broker if BROKER is "fake" or the paper broker if it is "paper"."""
+    if BROKER == 'fake':
+        from fake_broker import FakeBroker
+
+        logger.warning('Using the in-process fake broker, no orders reach MetaTrader')
+        return FakeBroker(latency=FAKE_BROKER_LATENCY)
+    if BROKER == 'paper':
+        from paper_broker import PaperBroker
+
+        logger.warning(f"Paper trading against {PAPER_PRICES or 'random walk prices'}, no orders reach MetaTrader")
+        return PaperBroker(PAPER_PRICES, speed=PAPER_SPEED, tick_interval=PAPER_TICK_INTERVAL, balance=PAPER_BALANCE)
+    return MetaApi
+
+
+class SharedApiFactory:
+    """Creates one MetaAPI client per API key and event loop, shared by the connection managers of every account.
+
+    Every client opens its own websocket connections, so the accounts of the multi-account mode are pooled on one
+    client instead of connecting a client each.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.apis = {}
+
+    def __call__(self, api_key: str):
+        key = (asyncio.get_running_loop(), api_key)
+        api = self.apis.get(key)
+        if api is None:
+            api = self.apis[key] = self.factory(api_key)
+        return api
+
+
+broker_factory = SharedApiFactory(CreateBrokerFactory())
+connection_manager = ConnectionManager(API_KEY, ACCOUNT_ID, broker_factory)
+
+
+class TradingAccount:
+    """A MetaTrader account signals are copied to in multi-account mode, with its own risk settings and connection."""
+
+    def __init__(self, account_id: str, name: str = None, risk_factor: float = RISK_FACTOR,
+                 risk_per_trade: float = RISK_PERTRADE, plan: str = PLAN, manager: ConnectionManager = None):
+        self.account_id = account_id
+        self.name = name or account_id
+        self.risk_factor = risk_factor
+        self.risk_per_trade = risk_per_trade
+        self.plan = plan
+        self.connection_manager = manager or ConnectionManager(API_KEY, account_id, broker_factory)
+
+
+def LoadTradingAccounts(config: list) -> list:
+    """Creates the trading accounts of the ACCOUNTS setting, ACCOUNT_ID reuses the main connection manager.
+
+    Arguments:
+        config: list of dictionaries with id and optional name, risk_factor, risk_per_trade and plan
+
+    Returns:
+        a list of TradingAccount objects
+    """
+    accounts = []
+    for entry in config:
+        account_id = entry['id']
+        accounts.append(TradingAccount(
+            account_id, entry.get('name'), float(entry.get('risk_factor', RISK_FACTOR)),
+            float(entry.get('risk_per_trade', RISK_PERTRADE)), entry.get('plan', PLAN),
+            connection_manager if account_id == ACCOUNT_ID else None))
+    return accounts
+
+
+trading_accounts = LoadTradingAccounts(ACCOUNTS)
+
+
+class PriceCache(SynchronizationListener):
+    """Keeps the latest bid/ask of subscribed symbols in memory from the streaming connection.
+
+    Symbols are subscribed when they are first asked for and the least recently used one is unsubscribed once PRICE_SUBSCRIPTIONS is reached. With PRICE_SUBSCRIBE_ALL every symbol in SYMBOLS stays subscribed instead.
+    """
+
+    def __init__(self, max_age: float, max_subscriptions: int):
+        super().__init__()
+        self.max_age = max_age
+        self.max_subscriptions = max_subscriptions
+        self.prices = {}
+        self.subscribed = OrderedDict()
+        self.streaming = None
+        self.tasks = set()
+        self.hits = 0
+        self.misses = 0
+
+    async def on_symbol_price_updated(self, instance_index: str, price: dict):
+        self.prices[price['symbol']] = (price, time.monotonic())
+
+    def get(self, symbol: str) -> dict:
+        """Returns the cached price of a symbol, or None if it is missing or older than max_age seconds."""
+        cached = self.prices.get(symbol)
+        if cached is None or time.monotonic() - cached[1] > self.max_age:
+            return None
+        return cached[0]
+
+    async def get_price(self, connection, symbol: str) -> dict:
+        """Returns the current price of a symbol from memory, falling back to an RPC request if it is stale.
+
+        Arguments:
+            connection: RPC connection used when there is no fresh price in memory
+            symbol: broker symbol
+        """
+        price = self.get(symbol)
+        if price is not None:
+            self.hits += 1
+            if symbol in self.subscribed:
+                self.subscribed.move_to_end(symbol)
+            return price
+
+        self.misses += 1
+        # subscribes in the background so the next signal for this symbol is served from memory
+        task = asyncio.ensure_future(self.subscribe(symbol))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return await connection.get_symbol_price(symbol=symbol)
+
+    async def subscribe(self, symbol: str) -> None:
+        """Subscribes to the market data of a symbol, unsubscribing the least recently used one if needed."""
+        try:
+            streaming = await connection_manager.get_streaming_connection()
+            if streaming is not self.streaming:
+                # subscriptions belong to the streaming connection they were made on
+                self.streaming = streaming
+                self.subscribed.clear()
+            if symbol in self.subscribed:
+                self.subscribed.move_to_end(symbol)
+                return
+            self.subscribed[symbol] = True
+            await streaming.subscribe_to_market_data(symbol, wait_for_quote=False)
+            while not PRICE_SUBSCRIBE_ALL and len(self.subscribed) > self.max_subscriptions:
+                oldest, _ = self.subscribed.popitem(last=False)
+                self.prices.pop(oldest, None)
+                await streaming.unsubscribe_from_market_data(oldest)
+        except Exception as error:
+            self.subscribed.pop(symbol, None)
+            await connection_manager.reset_streaming(error)
+            logger.warning(f'Error subscribing to {symbol} prices: {error}')
+
+    async def subscribe_all(self) -> None:
+        """Subscribes to every allowed symbol."""
+        for symbol in sorted(set(symbol_index.broker_symbols.values())):
+            await self.subscribe(symbol)
+
+
+price_cache = PriceCache(PRICE_MAX_AGE, PRICE_SUBSCRIPTIONS)
+connection_manager.add_listener(price_cache)
+
+
+class SymbolSpecCache(SynchronizationListener):
+    """Keeps the broker's symbol specifications in memory so sizing and rounding are lookups.
+
+    The streaming connection pushes every specification when it synchronizes. A symbol it did not push, or whose
+    entry is older than max_age, is loaded with one RPC request the next time a trade needs it. Symbols without a
+    specification fall back to the pip size and digits guessed from the signal prices.
+    """
+
+    def __init__(self, max_age: float):
+        super().__init__()
+        self.max_age = max_age
+        self.specifications = {}
+        self.loading = {}
+
+    async def on_symbol_specifications_updated(self, instance_index: str, specifications: list, removed_symbols: list):
+        for specification in specifications:
+            self.put(specification)
+        for symbol in removed_symbols:
+            self.specifications.pop(symbol, None)
+
+    async def on_symbol_specification_updated(self, instance_index: str, specification: dict):
+        self.put(specification)
+
+    async def on_symbol_price_updated(self, instance_index: str, price: dict):
+        specification = self.specifications.get(price['symbol'])
+        if specification is not None and price.get('profitTickValue') is not None:
+            specification['tickValue'] = price['profitTickValue']
+
+    def put(self, specification: dict) -> dict:
+        """Stores the fields used for sizing and rounding of a MetaAPI symbol specification.
+
+        Returns:
+            the stored dictionary with digits, point, tickSize, tickValue, contractSize, profitCurrency, minVolume,
+            volumeStep, maxVolume, volumeDigits and pipSize, or None if the specification has neither digits nor a
+            point or tick size, so the symbol keeps the guessed pip size and digits
+        """
+        symbol = specification['symbol']
+        point = specification.get('point') or specification.get('tickSize')
+        digits = specification.get('digits')
+        if point is None and digits is None:
+            logger.warning(f'The symbol specification of {symbol} has no digits, point or tick size, skipping it')
+            return None
+        if point is None:
+            point = 10 ** -digits
+        if digits is None:
+            digits = max(0, -math.floor(math.log10(point)))
+        volume_step = specification.get('volumeStep') or 0.01
+        previous = self.specifications.get(symbol, {})
+        stored = {
+            'digits': digits,
+            'point': point,
+            'tickSize': specification.get('tickSize') or point,
+            'tickValue': previous.get('tickValue'),
+            'contractSize': specification.get('contractSize'),
+            'profitCurrency': specification.get('profitCurrency'),
+            'minVolume': specification.get('minVolume') or volume_step,
+            'volumeStep': volume_step,
+            'maxVolume': specification.get('maxVolume'),
+            'volumeDigits': max(0, -math.floor(math.log10(volume_step) + 1e-9)),
+            'pipSize': SpecPipSize(symbol_index.canonical_symbol(symbol), digits, point),
+            'loaded': time.monotonic(),
+        }
+        self.specifications[symbol] = stored
+        return stored
+
+    def get(self, symbol: str) -> dict:
+        """Returns the stored specification of a symbol (as in SYMBOLS, not the broker name), or None."""
+        return self.specifications.get(symbol_index.broker_symbol(symbol))
+
+    async def ensure(self, connection, symbol: str) -> dict:
+        """Returns the specification of a symbol, loading it from the broker if it is missing or stale.
+
+        Arguments:
+            connection: RPC connection used to load the specification
+            symbol: symbol as in SYMBOLS
+
+        Returns:
+            the stored specification, the stale one or None if loading failed
+        """
+        specification = self.get(symbol)
+        if specification is not None and time.monotonic() - specification['loaded'] <= self.max_age:
+            return specification
+
+        # signals for the same symbol arriving together share one request
+        task = self.loading.get(symbol)
+        if task is None:
+            task = self.loading[symbol] = asyncio.ensure_future(self._load(connection, symbol, specification))
+            task.add_done_callback(lambda _: self.loading.pop(symbol, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, connection, symbol: str, stale: dict) -> dict:
+        try:
+            return self.put(await connection.get_symbol_specification(symbol_index.broker_symbol(symbol))) or stale
+        except Exception as error:
+            logger.warning(f'Error loading symbol specification for {symbol}: {error}')
+            return stale
+
+    def pip_size(self, symbol: str, entry: float) -> float:
+        """Returns the price change of one pip, guessed from the entry price if the symbol has no specification."""
+        specification = self.get(symbol)
+        if specification is not None:
+            return specification['pipSize']
+
+        logger.warning(f'No symbol specification for {symbol}, guessing its pip size from the entry {entry}')
+        if(symbol == 'XAUUSD'):
+            return 0.1
+        elif(symbol == 'XAGUSD'):
+            return 0.001
+        elif(str(entry).index('.') >= 2):
+            return 0.01
+        return 0.0001
+
+    def digits(self, symbol: str, price: float) -> int:
+        """Returns the number of price digits, counted in the price if the symbol has no specification."""
+        specification = self.get(symbol)
+        if specification is not None:
+            return specification['digits']
+        logger.warning(f'No symbol specification for {symbol}, counting its digits in the price {price}')
+        return len(str(price).split('.')[-1]) if '.' in str(price) else 0
+
+    def round_volume(self, symbol: str, volume: float) -> float:
+        """Rounds a volume down to the volume step of the symbol (0.01 lots if unknown) and caps it at the maximum."""
+        specification = self.get(symbol)
+        step = specification['volumeStep'] if specification is not None else 0.01
+        digits = specification['volumeDigits'] if specification is not None else 2
+        # the small epsilon keeps volumes that are already a multiple of the step from losing one step
+        volume = round(math.floor(volume / step + 1e-9) * step, digits)
+        if specification is not None and specification['maxVolume']:
+            volume = min(volume, specification['maxVolume'])
+        return volume
+
+
+def SpecPipSize(symbol: str, digits: int, point: float) -> float:
+    """Returns the pip size of a symbol from its price digits.
+
+    Metals keep the pip sizes the bot always used for them. FX quoted with a fractional pip (3 or 5 digits) has a
+    pip of ten points, everything else a pip of one point.
+    """
+    if symbol in METAL_PIP_SIZES:
+        return METAL_PIP_SIZES[symbol]
+    if digits in (3, 5):
+        return round(point * 10, digits)
+    return point
+
+
+symbol_specs = SymbolSpecCache(SPEC_MAX_AGE)
+connection_manager.add_listener(symbol_specs)
+
+
+def CurrencyPair(symbol: str) -> tuple:
+    """Returns the (base, quote) currencies of an FX or metal symbol such as EURUSD or XAUUSD, or None for indices."""
+    if len(symbol) == 6 and symbol.isalpha():
+        return symbol[:3], symbol[3:]
+    return None
+
+
+class PipValueEngine(SynchronizationListener):
+    """Values one pip of one lot in the account currency with a matrix of exchange rates kept current from prices.
+
+    rates holds what one unit of every known currency is worth in the account currency. Every price of a pair that
+    quotes a currency against the account currency, or against a currency whose rate is known, updates one entry, so
+    a tick costs O(1) and a pip value is a few dictionary lookups. The broker's own tick value is used when a price
+    carried one.
+    """
+
+    def __init__(self, currency: str):
+        super().__init__()
+        self.currency = currency
+        self.rates = {currency: 1.0}
+        # currencies quoted directly against the account currency, which cross rates do not overwrite
+        self.direct = {currency}
+
+    async def on_account_information_updated(self, instance_index: str, account_information: dict):
+        currency = account_information.get('currency')
+        if currency and currency != self.currency:
+            self.currency = currency
+            self.rates = {currency: 1.0}
+            self.direct = {currency}
+
+    async def on_symbol_price_updated(self, instance_index: str, price: dict):
+        self.update(price['symbol'], price)
+
+    def update(self, symbol: str, price: dict) -> None:
+        """Updates the rate of one currency from the price of a pair (broker symbol)."""
+        pair = CurrencyPair(symbol_index.canonical_symbol(symbol))
+        if pair is None or not price.get('bid') or not price.get('ask'):
+            return
+        base, quote = pair
+        mid = (float(price['bid']) + float(price['ask'])) / 2
+        if quote == self.currency:
+            self.rates[base] = mid
+            self.direct.add(base)
+        elif base == self.currency:
+            self.rates[quote] = 1 / mid
+            self.direct.add(quote)
+        elif quote in self.rates and base not in self.direct:
+            self.rates[base] = mid * self.rates[quote]
+        elif base in self.rates and quote not in self.direct:
+            self.rates[quote] = self.rates[base] / mid
+
+    async def ensure(self, connection, symbol: str) -> None:
+        """Loads the rate the pip value of a symbol needs if it is not known yet.
+
+        The price of the profit currency against the account currency is read through the price cache, which also
+        subscribes to it so later ticks keep the rate current.
+
+        Arguments:
+            connection: RPC connection used when the price is not in memory
+            symbol: symbol as in SYMBOLS
+        """
+        currency = self.profit_currency(symbol)
+        if currency is None or currency in self.rates:
+            return
+        for pair in (currency + self.currency, self.currency + currency):
+            if pair in symbol_index.broker_symbols:
+                try:
+                    broker_symbol = symbol_index.broker_symbol(pair)
+                    self.update(broker_symbol, await price_cache.get_price(connection, broker_symbol))
+                    return
+                except Exception as error:
+                    logger.warning(f'Error loading the {pair} rate for pip values: {error}')
+
+    def profit_currency(self, symbol: str) -> str:
+        """Returns the currency profits of a symbol are made in, from its specification or its name."""
+        specification = symbol_specs.get(symbol)
+        if specification is not None and specification['profitCurrency']:
+            return specification['profitCurrency']
+        pair = CurrencyPair(symbol)
+        return pair[1] if pair is not None else None
+
+    def pip_value(self, symbol: str, currency: str = None) -> float:
+        """Returns the value of one pip for one lot of a symbol, or None if it is not known.
+
+        Arguments:
+            symbol: symbol as in SYMBOLS
+            currency: currency of the value, defaults to the account currency
+        """
+        specification = symbol_specs.get(symbol)
+        if specification is None:
+            return None
+        if specification['tickValue'] and specification['tickSize']:
+            value = specification['tickValue'] * specification['pipSize'] / specification['tickSize']
+        else:
+            rate = self.rates.get(self.profit_currency(symbol))
+            if rate is None or not specification['contractSize']:
+                return None
+            value = specification['pipSize'] * specification['contractSize'] * rate
+        if currency is not None and currency != self.currency:
+            target = self.rates.get(currency)
+            if target is None:
+                return None
+            value /= target
+        return value
+
+    def pip_values(self, symbols: list, currency: str = None) -> numpy.ndarray:
+        """Returns the pip values of many symbols as an array, NaN where a value is not known so it sizes nothing."""
+        values = (self.pip_value(symbol, currency) for symbol in symbols)
+        return numpy.fromiter((numpy.nan if value is None else value for value in values), float, len(symbols))
+
+
+def SizePositions(balances, risks, stopLossPips, pipValues, volumeStep: float = 0.01, maxVolume: float = None) -> numpy.ndarray:
+    """Sizes many signals and/or accounts at once like PLAN A: balance * risk / (stop loss pips * pip value).
+
+    The arguments broadcast against each other, so balances of shape (accounts, 1) and per-signal stop losses and
+    pip values of shape (signals,) give an (accounts, signals) array of position sizes.
+
+    Arguments:
+        balances: account balances
+        risks: risk factors (0.01 = 1 %)
+        stopLossPips: stop loss distances in pips
+        pipValues: values of one pip for one lot in the account currency
+        volumeStep: sizes are rounded down to this step
+        maxVolume: optional cap of every size
+
+    Returns:
+        an array of position sizes in lots
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        volumes = numpy.asarray(balances, float) * numpy.asarray(risks, float) / (
+            numpy.asarray(stopLossPips, float) * numpy.asarray(pipValues, float))
+    volumes = numpy.where(numpy.isfinite(volumes), volumes, 0.0)
+    # the small epsilon keeps sizes that are already a multiple of the step from losing one step
+    volumes = numpy.floor(volumes / volumeStep + 1e-9) * volumeStep
+    if maxVolume is not None:
+        volumes = numpy.minimum(volumes, maxVolume)
+    return volumes.round(max(0, -math.floor(math.log10(volumeStep) + 1e-9)))
+
+
+pip_values = PipValueEngine(ACCOUNT_CURRENCY)
+connection_manager.add_listener(pip_values)
+
+
+class AccountStateCache(SynchronizationListener):
+    """Keeps balance, equity and margin in memory from the streaming terminal state.
+
+    While the stream is connected its updates keep the cache current. Once it drops, the cached values expire after max_age seconds and are fetched over RPC again.
+    """
+
+    def __init__(self, max_age: float):
+        super().__init__()
+        self.max_age = max_age
+        self.account_information = None
+        self.updated = 0.0
+        self.live = False
+
+    async def on_account_information_updated(self, instance_index: str, account_information: dict):
+        self.account_information = dict(account_information)
+        self.updated = time.monotonic()
+        self.live = True
+
+    async def on_symbol_prices_updated(self, instance_index: str, prices: list, equity: float = None, margin: float = None,
+                                       free_margin: float = None, margin_level: float = None, account_currency_exchange_rate: float = None):
+        if self.account_information is None:
+            return
+        for field, value in (('equity', equity), ('margin', margin), ('freeMargin', free_margin), ('marginLevel', margin_level)):
+            if value is not None:
+                self.account_information[field] = value
+        self.updated = time.monotonic()
+
+    async def on_disconnected(self, instance_index: str):
+        self.live = False
+
+    async def on_stream_closed(self, instance_index: str):
+        self.live = False
+
+    def get(self) -> dict:
+        """Returns the cached account information, or None if there is none or it expired."""
+        if self.account_information is None:
+            return None
+        if not self.live and time.monotonic() - self.updated > self.max_age:
+            return None
+        return self.account_information
+
+    def age(self) -> float:
+        """Returns the seconds since the cached account information was last updated."""
+        return time.monotonic() - self.updated
+
+    async def get_account_information(self) -> dict:
+        """Returns the account information from memory, fetching it over RPC only if the cache is empty or expired."""
+        account_information = self.get()
+        if account_information is not None:
+            return account_information
+
+        # starts the stream in the background so the next request is answered from memory
+        connection_manager.start_streaming()
+
+        connection = await connection_manager.get_connection()
+        self.account_information = await connection.get_account_information()
+        self.updated = time.monotonic()
+        return self.account_information
+
+
+account_state = AccountStateCache(ACCOUNT_MAX_AGE)
+connection_manager.add_listener(account_state)
+
+
+class TradeBook(SynchronizationListener):
+    """In-memory book of open positions and pending orders kept current by streaming synchronization events.
+
+    Positions and orders are indexed by id and by symbol, so the view commands read them without an RPC request.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.positions = {}
+        self.orders = {}
+        self.positions_by_symbol = {}
+        self.orders_by_symbol = {}
+        self.positions_synced = False
+        self.orders_synced = False
+        self.last_synced = None
+
+    async def on_positions_replaced(self, instance_index: str, positions: list):
+        self._replace(self.positions, self.positions_by_symbol, positions)
+
+    async def on_positions_synchronized(self, instance_index: str, synchronization_id: str):
+        self.positions_synced = True
+        self._touch()
+
+    async def on_position_updated(self, instance_index: str, position: dict):
+        self._put(self.positions, self.positions_by_symbol, position)
+
+    async def on_position_removed(self, instance_index: str, position_id: str):
+        self._remove(self.positions, self.positions_by_symbol, position_id)
+
+    async def on_pending_orders_replaced(self, instance_index: str, orders: list):
+        self._replace(self.orders, self.orders_by_symbol, orders)
+
+    async def on_pending_orders_synchronized(self, instance_index: str, synchronization_id: str):
+        self.orders_synced = True
+        self._touch()
+
+    async def on_pending_order_updated(self, instance_index: str, order: dict):
+        self._put(self.orders, self.orders_by_symbol, order)
+
+    async def on_pending_order_completed(self, instance_index: str, order_id: str):
+        self._remove(self.orders, self.orders_by_symbol, order_id)
+
+    async def on_disconnected(self, instance_index: str):
+        self.positions_synced = self.orders_synced = False
+
+    async def on_stream_closed(self, instance_index: str):
+        self.positions_synced = self.orders_synced = False
+
+    def position(self, position_id: str) -> dict:
+        return self.positions.get(position_id)
+
+    def symbol_positions(self, symbol: str) -> list:
+        return [self.positions[position_id] for position_id in self.positions_by_symbol.get(symbol, ())]
+
+    def symbol_orders(self, symbol: str) -> list:
+        return [self.orders[order_id] for order_id in self.orders_by_symbol.get(symbol, ())]
+
+    def last_synced_text(self, synced: bool) -> str:
+        """Describes how fresh the book is, for the view commands.
+
+        Arguments:
+            synced: whether the listed items came from the synchronized book
+        """
+        if not synced or self.last_synced is None:
+            return 'fetched from server'
+        return f"synced {self.last_synced.astimezone(pytz.timezone('Asia/Bangkok')).strftime('%H:%M:%S')}"
+
+    async def get_positions(self) -> list:
+        """Returns the open positions from the book, fetching them over RPC only if the book is not synchronized."""
+        if self.positions_synced:
+            return list(self.positions.values())
+        # starts the stream in the background so the next request is answered from the book
+        connection_manager.start_streaming()
+        connection = await connection_manager.get_connection()
+        return await connection.get_positions()
+
+    async def get_orders(self) -> list:
+        """Returns the pending orders from the book, fetching them over RPC only if the book is not synchronized."""
+        if self.orders_synced:
+            return list(self.orders.values())
+        # starts the stream in the background so the next request is answered from the book
+        connection_manager.start_streaming()
+        connection = await connection_manager.get_connection()
+        return await connection.get_orders()
+
+    def _touch(self) -> None:
+        self.last_synced = datetime.now(pytz.UTC)
+
+    def _replace(self, items: dict, by_symbol: dict, new_items: list) -> None:
+        items.clear()
+        by_symbol.clear()
+        for item in new_items:
+            self._put(items, by_symbol, item)
+
+    def _put(self, items: dict, by_symbol: dict, item: dict) -> None:
+        previous = items.get(item['id'])
+        if previous is not None and previous.get('symbol') != item.get('symbol'):
+            self._unindex(by_symbol, previous.get('symbol'), item['id'])
+        items[item['id']] = item
+        by_symbol.setdefault(item.get('symbol'), set()).add(item['id'])
+        self._touch()
+
+    def _remove(self, items: dict, by_symbol: dict, item_id: str) -> None:
+        item = items.pop(item_id, None)
+        if item is not None:
+            self._unindex(by_symbol, item.get('symbol'), item_id)
+        self._touch()
+
+    @staticmethod
+    def _unindex(by_symbol: dict, symbol: str, item_id: str) -> None:
+        ids = by_symbol.get(symbol)
+        if ids is not None:
+            ids.discard(item_id)
+            if not ids:
+                del by_symbol[symbol]
+
+
+trade_book = TradeBook()
+connection_manager.add_listener(trade_book)
+
+
+class AccountWarmup:
+    """Deploys, connects and synchronizes the MetaAPI account at start-up and keeps it from going idle afterwards.
+
+    Trade placement waits on the ready flag, so a signal that arrives during a restart does not pay for the connection
+    set-up itself.
+    """
+
+    def __init__(self, symbols: list, keepalive_interval: float):
+        self.symbols = symbols
+        self.keepalive_interval = keepalive_interval
+        # the flag is read from any thread, signals wait on the event of the loop they run on
+        self.ready = threading.Event()
+        self.ready_event = None
+        self.loop = None
+        self.keepalive_task = None
+
+    async def warm_up(self) -> None:
+        """Connects the account, loads account information and symbol specifications, then starts the keepalive.
+
+        Connection attempts are retried until they succeed, the keepalive keeps retrying after a failed warm-up.
+        """
+        start = time.monotonic()
+        try:
+            connection = await connection_manager.get_connection(synchronized=True)
+            await account_state.get_account_information()
+            await asyncio.gather(*[self._load_specification(connection, symbol) for symbol in self.symbols],
+                                 *[self._connect_account(account) for account in trading_accounts])
+            connection_manager.start_streaming()
+            self.set_ready()
+            logger.info(f'MetaAPI account warmed up in {time.monotonic() - start:.1f}s')
+        except Exception as error:
+            logger.warning(f'MetaAPI warm-up failed, retrying in the keepalive: {error}')
+
+        if self.keepalive_interval > 0 and (self.keepalive_task is None or self.keepalive_task.done()):
+            self.keepalive_task = asyncio.ensure_future(self._keepalive())
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Waits without blocking the event loop until the warm-up finished.
+
+        Arguments:
+            timeout: seconds to wait at most
+
+        Returns:
+            True if the account is ready, False if the timeout expired first
+        """
+        if self.ready.is_set():
+            return True
+        if self.ready_event is None:
+            self.loop = asyncio.get_running_loop()
+            self.ready_event = asyncio.Event()
+            # set_ready may have run before the event existed
+            if self.ready.is_set():
+                self.ready_event.set()
+        try:
+            await asyncio.wait_for(self.ready_event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def set_ready(self) -> None:
+        """Marks the account ready and wakes the waiting signals, from any thread."""
+        self.ready.set()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.ready_event.set)
+
+    async def _load_specification(self, connection, symbol: str) -> None:
+        await symbol_specs.ensure(connection, symbol)
+
+    async def _connect_account(self, account: TradingAccount, keepalive: bool = False) -> None:
+        # the other accounts of the multi-account mode, whose failures do not hold up the main account
+        if account.connection_manager is connection_manager:
+            return
+        try:
+            connection = await account.connection_manager.get_connection(synchronized=True)
+            if keepalive:
+                await connection.get_server_time()
+        except Exception as error:
+            logger.warning(f'Error connecting MetaAPI account {account.name}: {error}')
+            await account.connection_manager.reset(error)
+
+    async def _keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            await asyncio.gather(*[self._connect_account(account, keepalive=True) for account in trading_accounts])
+            try:
+                connection = await connection_manager.get_connection(synchronized=True)
+
+                # a cheap request that keeps the RPC connection and the broker session busy
+                await connection.get_server_time()
+                connection_manager.start_streaming()
+                if not self.ready.is_set():
+                    self.set_ready()
+                    logger.info('MetaAPI account ready after keepalive reconnect')
+            except Exception as error:
+                logger.warning(f'MetaAPI keepalive failed: {error}')
+                await connection_manager.reset(error)
+
+
+account_warmup = AccountWarmup(WARMUP_SYMBOLS, KEEPALIVE_INTERVAL)
+
+
+def connection_state_metrics() -> list:
+    """Reports the MetaAPI connection state as gauges (1 or 0) for the metrics endpoint."""
+    return [
+        ('metaapi_rpc_connected', {}, int(connection_manager.connection is not None)),
+        ('metaapi_rpc_synchronized', {}, int(connection_manager.synchronized)),
+        ('metaapi_streaming_connected', {}, int(connection_manager.streaming is not None)),
+        ('metaapi_account_stream_live', {}, int(account_state.live)),
+        ('metaapi_trade_book_synchronized', {'book': 'positions'}, int(trade_book.positions_synced)),
+        ('metaapi_trade_book_synchronized', {'book': 'orders'}, int(trade_book.orders_synced)),
+        ('metaapi_account_ready', {}, int(account_warmup.ready.is_set())),
+    ] + [
+        ('metaapi_account_rpc_connected', {'account': account.name}, int(account.connection_manager.connection is not None))
+        for account in trading_accounts
+    ]
+
+
+metrics.add_collector(connection_state_metrics)
+
+
+class EventLoopThread:
+    """Runs a single asyncio event loop in a background thread for the whole process.
+
+    The synchronous Telegram callbacks submit coroutines to it, so connections, caches and tasks outlive one update.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.started = threading.Event()
+        self.start_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Starts the event loop thread if it is not running yet."""
+        with self.start_lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.started.clear()
+            self.thread = threading.Thread(target=self._run, name='asyncio-loop', daemon=True)
+            self.thread.start()
+        self.started.wait()
+
+    def submit(self, coro) -> Future:
+        """Schedules a coroutine on the background loop.
+
+        Arguments:
+            coro: coroutine to run
+
+        Returns:
+            a concurrent Future that resolves with the coroutine result
+        """
+        if self.thread is None or not self.thread.is_alive():
+            self.start()
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(self._log_exception)
+        return future
+
+    def stop(self) -> None:
+        """Cancels pending tasks and stops the event loop thread."""
+        if self.loop is None or not self.loop.is_running():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=10)
+
+    def _run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self.started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.close()
+
+    @staticmethod
+    def _log_exception(future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f'Background task failed: {future.exception()}')
+
+
+event_loop_thread = EventLoopThread()
+
+
+class WorkScheduler:
+    """Runs the work of the Telegram handlers on the event loop from bounded queues, each with its own workers.
+
+    Queues are (name, workers, size) tuples in priority order (trade signals, position management commands, read-only
+    views). Work of one queue never waits behind another queue's work, and a worker only starts a job when no higher
+    priority job is waiting, so a signal always goes ahead of reporting. A full queue rejects new work right away,
+    which the handler answers, instead of letting it pile up.
+    """
+
+    def __init__(self, queues: list):
+        self.names = [name for name, _, _ in queues]
+        self.workers = {name: workers for name, workers, _ in queues}
+        self.sizes = {name: size for name, _, size in queues}
+        self.depth = {name: 0 for name in self.names}
+        self.running = {name: 0 for name in self.names}
+        self.lock = threading.Lock()
+        self.loop = None
+        self.pending = None
+        self.changed = None
+
+    def submit(self, name: str, function, *args) -> bool:
+        """Queues a coroutine function call without waiting for it.
+
+        Arguments:
+            name: queue the work goes to
+            function: coroutine function run by a worker of the queue
+            args: arguments for the function
+
+        Returns:
+            False if the queue is full and the work was rejected
+        """
+        event_loop_thread.start()
+        loop = event_loop_thread.loop
+        with self.lock:
+            if self.depth[name] >= self.sizes[name]:
+                metrics.inc('work_rejected_total', queue=name)
+                logger.warning(f'Work queue {name} is full, rejecting {function.__name__}')
+                return False
+            self.depth[name] += 1
+            start = self.loop is not loop
+            self.loop = loop
+
+        # callbacks run in order on the loop, so the queues exist before the first job is put
+        if start:
+            loop.call_soon_threadsafe(self._start)
+        loop.call_soon_threadsafe(self._put, name, (function, args, time.monotonic()))
+        metrics.inc('work_submitted_total', queue=name)
+        return True
+
+    def queue_metrics(self) -> list:
+        """Reports waiting and running jobs and the size of every queue as gauges for the metrics endpoint."""
+        with self.lock:
+            return [sample for name in self.names for sample in (
+                ('work_queue_depth', {'queue': name}, self.depth[name]),
+                ('work_queue_running', {'queue': name}, self.running[name]),
+                ('work_queue_size', {'queue': name}, self.sizes[name]),
+            )]
+
+    def _start(self) -> None:
+        self.pending = {name: asyncio.Queue() for name in self.names}
+        self.changed = asyncio.Condition()
+        for priority, name in enumerate(self.names):
+            for _ in range(self.workers[name]):
+                asyncio.ensure_future(self._work(priority, name))
+
+    def _put(self, name: str, job: tuple) -> None:
+        self.pending[name].put_nowait(job)
+
+    def _waiting_ahead(self, priority: int) -> bool:
+        return any(not self.pending[name].empty() for name in self.names[:priority])
+
+    async def _work(self, priority: int, name: str) -> None:
+        queue = self.pending[name]
+        while True:
+            function, args, queued = await queue.get()
+            if priority:
+                # lower priority work waits until the jobs of the queues ahead have been picked up
+                async with self.changed:
+                    await self.changed.wait_for(lambda: not self._waiting_ahead(priority))
+            with self.lock:
+                self.depth[name] -= 1
+                self.running[name] += 1
+            async with self.changed:
+                self.changed.notify_all()
+
+            metrics.observe('work_queue_wait_seconds', time.monotonic() - queued, queue=name)
+            try:
+                await function(*args)
+            except Exception as error:
+                logger.error(f'Error running {function.__name__} from work queue {name}: {error}')
+            finally:
+                with self.lock:
+                    self.running[name] -= 1
+
+
+work_scheduler = WorkScheduler([('signals', SIGNAL_WORKERS, SIGNAL_QUEUE_SIZE),
+                                ('commands', COMMAND_WORKERS, COMMAND_QUEUE_SIZE),
+                                ('views', VIEW_WORKERS, VIEW_QUEUE_SIZE)])
+metrics.add_collector(work_scheduler.queue_metrics)
+
+# Lấy danh sách pending orders
+async def get_pending_orders(update: Update):
+    try:
+        # reads the pending orders from the synchronized book
+        orders = await trade_book.get_orders()
         return orders
     except Exception as e:
-        print(f"Error getting pending orders: {e}")
-        update.effective_message.reply_text(f"Error getting open trades: {e}")
+        await connection_manager.reset(e)
+        logger.info(f"Error getting pending orders: {e}")
+        send_reply(update, f"Error getting pending orders: {e}")
         return []
 
 # Lấy danh sách open trades
 async def get_open_trades(update: Update):
     try:
-        api = MetaApi(API_KEY)
-        account = await api.metatrader_account_api.get_account(ACCOUNT_ID)
-        initial_state = account.state
-        deployed_states = ['DEPLOYING', 'DEPLOYED']
-
-        if initial_state not in deployed_states:
-            #  wait until account is deployed and connected to broker
-            logger.info('Deploying account')
-            await account.deploy()
-
-        logger.info('Waiting for API server to connect to broker ...')
-        await account.wait_connected()
-
-        # connect to MetaApi API
-        connection = account.get_rpc_connection()
-        await connection.connect()
-
-        # wait until terminal state synchronized to the local state
-
-        # obtains account information from MetaTrader server
-        trades = await connection.get_positions()
+        # reads the open positions from the synchronized book
+        trades = await trade_book.get_positions()
         return trades
     except Exception as e:
+        await connection_manager.reset(e)
         logger.info(f"Error getting open trades: {e}")
-        update.effective_message.reply_text(f"Error getting open trades: {e}")
+        send_reply(update, f"Error getting open trades: {e}")
         return []
 
 
+def table_rows(data, is_pending=True) -> tuple:
+    """Builds the title, headers and rows of the open positions or pending orders table.
+
+    Arguments:
+        data: list of positions/orders, or its JSON string
+        is_pending: True for pending orders, False for open positions (adds the profit column and total)
+
+    Returns:
+        a tuple of (title, headers, rows)
+    """
+    # Kiểm tra xem data có phải là chuỗi không
+    if isinstance(data, str):
+        # Nếu là chuỗi, chuyển đổi thành đối tượng Python
+        json_data = json.loads(data)
+    elif isinstance(data, list):
+        # Nếu là danh sách, sử dụng trực tiếp
+        json_data = data
+    else:
+        # Nếu không phải là chuỗi hoặc danh sách, xử lý lỗi hoặc trả về
+        raise ValueError("Invalid data format")
+
+    headers = ["Id", "Type", "Symbol", "Size", "Entry", "SL", "TP","Profit"]
+    if not is_pending:
+        data_key = "positions" 
+        title = "Opening Trades"      
+    else:
+        data_key = "orders"
+        title = "Pending Orders"
+        if "Profit" in headers:
+            headers.remove("Profit")
+
+    rows = []
+    total_profit = 0
+    for order_or_position in json_data:
+        # Truy cập thông tin từng vị thế hoặc order tùy thuộc vào loại dữ liệu
+        if data_key == "positions":
+            order_type = order_or_position.get("type", "")
+            profit_value = round(float(order_or_position.get("profit", 0)), 2)
+            if profit_value >= 0:
+                profit_with_currency = f"{profit_value:,.2f} $"
+            else:
+                profit_with_currency = f"{profit_value:,.2f} $"
+            if order_type.startswith("POSITION_TYPE_"):
+                match = re.match(r"POSITION_TYPE_(.*)", order_type)
+                if match:
+                    simplified_type = match.group(1)            
+            row = [
+                order_or_position.get("id", ""),
+                simplified_type,
+                order_or_position.get("symbol", ""),
+                order_or_position.get("volume", ""),
+                order_or_position.get("openPrice", ""),
+                order_or_position.get("stopLoss", ""),
+                order_or_position.get("takeProfit", ""),
+                profit_with_currency
+            ]
+            total_profit += float(order_or_position.get("profit", 0))
+        else:
+            order_type = order_or_position.get("type", "")
+            if order_type.startswith("ORDER_TYPE_"):
+                match = re.match(r"ORDER_TYPE_(.*)", order_type)
+                if match:
+                    simplified_type = match.group(1)                              
+            row = [
+                order_or_position.get("id", ""),
+                simplified_type,
+                order_or_position.get("symbol", ""),
+                order_or_position.get("volume", ""),
+                order_or_position.get("openPrice", ""),
+                order_or_position.get("stopLoss", ""),
+                order_or_position.get("takeProfit", "")
+            ]
+        rows.append(row)
+
+    if not is_pending:
+        total_profit_row = ["TOTAL PROFIT", "", "", "", "", "", "", f"{round(total_profit, 2)} $"]
+        rows.append(total_profit_row)
+    return title, headers, rows
+
 def create_table(data, is_pending=True) -> PrettyTable:
     try:
-        # Kiểm tra xem data có phải là chuỗi không
-        if isinstance(data, str):
-            # Nếu là chuỗi, chuyển đổi thành đối tượng Python
-            json_data = json.loads(data)
-        elif isinstance(data, list):
-            # Nếu là danh sách, sử dụng trực tiếp
-            json_data = data
-        else:
-            # Nếu không phải là chuỗi hoặc danh sách, xử lý lỗi hoặc trả về
-            raise ValueError("Invalid data format")
-        
+        title, headers, rows = table_rows(data, is_pending)
         table = PrettyTable()      
-        headers = ["Id", "Type", "Symbol", "Size", "Entry", "SL", "TP","Profit"]
-        table.align["Id"] = "l"
-        table.align["Type"] = "l"  
-        table.align["Symbol"] = "l" 
-        table.align["Size"] = "l"  
-        table.align["Entry"] = "l"
-        table.align["SL"] = "l"  
-        table.align["TP"] = "l"
-        table.align["Profit"] = "l"  
-        if not is_pending:
-            data_key = "positions" 
-            table.title = "Opening Trades"      
-        else:
-            data_key = "orders"
-            table.title = "Pending Orders"
-            if "Profit" in headers:
-                headers.remove("Profit")
-
+        table.title = title
         table.field_names = headers
-        total_profit = 0
-        for order_or_position in json_data:
-            # Truy cập thông tin từng vị thế hoặc order tùy thuộc vào loại dữ liệu
-            if data_key == "positions":
-                order_type = order_or_position.get("type", "")
-                profit_value = round(float(order_or_position.get("profit", 0)), 2)
-                if profit_value >= 0:
-                    profit_with_currency = f"{profit_value:,.2f} $"
-                else:
-                    profit_with_currency = f"{profit_value:,.2f} $"
-                if order_type.startswith("POSITION_TYPE_"):
-                    match = re.match(r"POSITION_TYPE_(.*)", order_type)
-                    if match:
-                        simplified_type = match.group(1)            
-                row = [
-                    order_or_position.get("id", ""),
-                    simplified_type,
-                    order_or_position.get("symbol", ""),
-                    order_or_position.get("volume", ""),
-                    order_or_position.get("openPrice", ""),
-                    order_or_position.get("stopLoss", ""),
-                    order_or_position.get("takeProfit", ""),
-                    profit_with_currency
-                ]
-                total_profit += float(order_or_position.get("profit", 0))
-            else:
-                order_type = order_or_position.get("type", "")
-                if order_type.startswith("ORDER_TYPE_"):
-                    match = re.match(r"ORDER_TYPE_(.*)", order_type)
-                    if match:
-                        simplified_type = match.group(1)                              
-                row = [
-                    order_or_position.get("id", ""),
-                    simplified_type,
-                    order_or_position.get("symbol", ""),
-                    order_or_position.get("volume", ""),
-                    order_or_position.get("openPrice", ""),
-                    order_or_position.get("stopLoss", ""),
-                    order_or_position.get("takeProfit", "")
-                ]
+        for header in headers:
+            table.align[header] = "l"
+        for row in rows:
             table.add_row(row)
-                # Sort the table by the "Profit" column in descending order
-
-        if not is_pending:
-            total_profit_row = ["TOTAL PROFIT", "", "", "", "", "", "", f"{round(total_profit, 2)} $"]
-            table.add_row(total_profit_row)
         return table
     except Exception as e:
         # Xử lý lỗi khi có vấn đề với định dạng dữ liệu
         logger.info(f"Error creating table: {e}")
         return None
 
+def render_table_chunks(title: str, headers: list, rows: list, summary: str = '', limit: int = TELEGRAM_MESSAGE_LIMIT):
+    """Renders a table as HTML <pre> messages, packing as many rows into each message as the Telegram limit allows.
+
+    Column widths are computed once over all rows and every message repeats the title and header, so each one reads on
+    its own. Messages are generated one at a time, only one is held in memory besides the rows.
+
+    Arguments:
+        title: table title
+        headers: column names
+        rows: table rows
+        summary: text put in front of the table in the first message
+        limit: maximum length of one message
+
+    Yields:
+        the HTML text of each message
+    """
+    cells = [[str(cell) for cell in row] for row in rows]
+    widths = [len(str(header)) for header in headers]
+    for row in cells:
+        for index, cell in enumerate(row):
+            if len(cell) > widths[index]:
+                widths[index] = len(cell)
+
+    # widens the last column if the title is wider than the table, like PrettyTable
+    table_width = sum(width + 3 for width in widths) + 1
+    if len(title) + 4 > table_width:
+        widths[-1] += len(title) + 4 - table_width
+        table_width = len(title) + 4
+
+    def line(values: list) -> str:
+        # pads before escaping, so the columns line up as displayed
+        return html.escape('| ' + ' | '.join(value.ljust(width) for value, width in zip(values, widths)) + ' |') + '\n'
+
+    border = '+' + '+'.join('-' * (width + 2) for width in widths) + '+\n'
+    top = ''
+    if title:
+        top = '+' + '-' * (table_width - 2) + '+\n' + html.escape('| ' + title.center(table_width - 4) + ' |') + '\n'
+    head = top + border + line([str(header) for header in headers]) + border
+
+    prefix = html.escape(summary) + '\n' if summary else ''
+    chunk = []
+    size = 0
+    for row in cells:
+        text = line(row)
+        # the message is prefix + <pre> + head + rows + border + </pre>
+        if chunk and len(prefix) + 11 + len(head) + size + len(text) + len(border) > limit:
+            yield f"{prefix}<pre>{head}{''.join(chunk)}{border.rstrip()}</pre>"
+            prefix = ''
+            chunk = []
+            size = 0
+        chunk.append(text)
+        size += len(text)
+    yield f"{prefix}<pre>{head}{''.join(chunk)}{border.rstrip()}</pre>"
+
+def split_message(parts: list, separator: str = '\n', limit: int = TELEGRAM_MESSAGE_LIMIT):
+    """Packs text parts into as few messages within the Telegram limit as possible, in order.
+
+    A part that is too long on its own is split at line breaks. A <pre> fragment in it is never cut: it stays whole if
+    it fits, otherwise its lines are spread over several fragments that each open and close their own <pre>.
+
+    Arguments:
+        parts: texts joined with separator, e.g. the lines of a summary or the replies to an update
+        separator: text put between two parts in one message
+        limit: maximum length of one message
+
+    Yields:
+        the text of each message
+    """
+    pieces = []
+    for part in parts:
+        pieces += [part] if len(part) <= limit else split_long_part(part, limit)
+
+    message = None
+    for piece in pieces:
+        if message is not None and len(message) + len(separator) + len(piece) <= limit:
+            message += separator + piece
+            continue
+        if message is not None:
+            yield message
+        message = piece
+    if message is not None:
+        yield message
+
+def split_long_part(text: str, limit: int) -> list:
+    # splits around the <pre> fragments first, then at line breaks, lines longer than the limit are cut
+    pieces = []
+    for fragment in re.split(r'(<pre>.*?</pre>)', text, flags=re.DOTALL):
+        if not fragment.strip():
+            continue
+        if len(fragment) <= limit:
+            pieces.append(fragment.strip('\n'))
+            continue
+        preformatted = fragment.startswith('<pre>')
+        body = fragment[5:-6] if preformatted else fragment
+        room = limit - 11 if preformatted else limit
+        lines = []
+        for line in body.split('\n'):
+            lines += [line[index:index + room] for index in range(0, len(line), room)] or ['']
+        for chunk in split_message(lines, '\n', room):
+            pieces.append(f'<pre>{chunk}</pre>' if preformatted else chunk)
+    return pieces
+
+class TokenBucket:
+    """Token bucket rate limiter, refilled continuously at rate tokens per second up to capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Returns the seconds until a token is available, 0 if one is available now."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        """Empties the bucket for the given seconds, used when Telegram answers with retry_after."""
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class TelegramOutbox:
+    """Sends Telegram requests from a few worker threads, in priority order and within Telegram's rate limits.
+
+    Handlers and the trading path only queue requests and never wait for them. Every chat has its own token bucket
+    (groups a slower one) on top of a global one, requests of one chat are sent one at a time and in order within a
+    priority, and a RetryAfter answer blocks the chat for the requested time before the request is retried.
+    """
+
+    def __init__(self, workers: int, global_rate: float, chat_rate: float, group_rate: float, chat_burst: float):
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.busy_chats = set()
+        self.jobs = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.stopping = False
+
+    def send(self, chat_id: int, function, priority: int = PRIORITY_INFO, delay: float = 0.0) -> Future:
+        """Queues a Telegram request.
+
+        Arguments:
+            chat_id: chat the request goes to, used for the per-chat limit and ordering
+            function: callable that makes the request on a worker thread
+            priority: PRIORITY_TRADE requests are sent before PRIORITY_INFO ones
+            delay: seconds before the request may be sent
+
+        Returns:
+            a concurrent Future that resolves with the function result
+        """
+        future = Future()
+        with self.condition:
+            if len(self.threads) < self.workers:
+                self._start_workers()
+            bisect.insort(self.jobs, (priority, next(self.sequence), chat_id, time.monotonic() + delay, function, future),
+                          key=lambda job: job[:2])
+            self.condition.notify_all()
+        return future
+
+    def drain(self, timeout: float = None) -> bool:
+        """Waits until every queued request was sent, returns False if the timeout expired first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.jobs or self.busy_chats:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Sends what is queued (up to timeout seconds) and stops the worker threads."""
+        if not self.drain(timeout):
+            logger.warning(f'Dropping {len(self.jobs)} Telegram messages on shutdown')
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+    def _start_workers(self) -> None:
+        for index in range(len(self.threads), self.workers):
+            thread = threading.Thread(target=self._work, name=f'telegram-outbox-{index}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # group and channel chat IDs are negative
+            rate = self.group_rate if chat_id is not None and chat_id < 0 else self.chat_rate
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _next_job(self):
+        with self.condition:
+            while not self.stopping:
+                now = time.monotonic()
+                wait = None
+                global_wait = self.global_bucket.wait_time(now)
+                for index, job in enumerate(self.jobs):
+                    chat_id, not_before = job[2], job[3]
+                    if chat_id in self.busy_chats:
+                        continue
+                    ready_in = max(not_before - now, self._chat_bucket(chat_id).wait_time(now), global_wait)
+                    if ready_in <= 0:
+                        del self.jobs[index]
+                        self.global_bucket.take()
+                        self._chat_bucket(chat_id).take()
+                        self.busy_chats.add(chat_id)
+                        return job
+                    wait = ready_in if wait is None else min(wait, ready_in)
+                self.condition.wait(wait)
+            return None
+
+    def _work(self) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            priority, sequence, chat_id, not_before, function, future = job
+            try:
+                future.set_result(function())
+            except RetryAfter as error:
+                logger.warning(f'Telegram flood limit for chat {chat_id}, retrying in {error.retry_after}s')
+                with self.condition:
+                    self._chat_bucket(chat_id).block(error.retry_after)
+                    bisect.insort(self.jobs, job, key=lambda job: job[:2])
+            except Exception as error:
+                logger.error(f'Error sending Telegram message: {error}')
+                future.set_exception(error)
+            finally:
+                with self.condition:
+                    self.busy_chats.discard(chat_id)
+                    self.condition.notify_all()
+
+
+telegram_outbox = TelegramOutbox(TELEGRAM_SEND_WORKERS, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE,
+                                 TELEGRAM_GROUP_RATE / 60, TELEGRAM_CHAT_BURST)
+
+
+def send_reply(update: Update, text: str, priority: int = PRIORITY_INFO, **kwargs) -> Future:
+    """Queues a reply to the message of an update on the Telegram outbox, without waiting for it.
+
+    Arguments:
+        update: update from Telegram
+        text: reply text
+        priority: PRIORITY_TRADE for trade confirmations, PRIORITY_INFO for everything else
+        kwargs: further Message.reply_text arguments such as parse_mode
+    """
+    message = update.effective_message
+    return telegram_outbox.send(message.chat_id, lambda: message.reply_text(text, **kwargs), priority)
+
+
+class ReplyAggregator:
+    """Collects the replies to one update and sends them as a single message that later replies are appended to.
+
+    Replies are flushed REPLY_DELAY seconds after the first unsent one, or when close() is called at the end of the
+    operation, so a fast operation costs one Telegram request and a slow one an edit per delay instead of a message per
+    line. A new message is started once the text would exceed the Telegram limit. The requests go through the
+    Telegram outbox, so adding a reply never waits for Telegram.
+    """
+
+    def __init__(self, message, delay: float = REPLY_DELAY, priority: int = PRIORITY_TRADE):
+        self.message = message
+        self.delay = delay
+        self.priority = priority
+        self.pending = []
+        self.unsent = []
+        self.scheduled = False
+        self.sent = None
+        self.sent_text = ''
+        self.lock = threading.Lock()
+
+    def reply_text(self, text: str, parse_mode: str = None, **kwargs) -> None:
+        """Queues a reply, taking the same arguments as Message.reply_text. Plain text is HTML-escaped."""
+        if parse_mode != ParseMode.HTML:
+            text = html.escape(text)
+        with self.lock:
+            self.pending.append(text)
+            if not self.scheduled:
+                self.scheduled = True
+                telegram_outbox.send(self.message.chat_id, self._flush, self.priority, self.delay)
+
+    def flush(self) -> None:
+        """Queues the collected replies to be sent now."""
+        with self.lock:
+            if self.pending:
+                telegram_outbox.send(self.message.chat_id, self._flush, self.priority)
+
+    def close(self) -> None:
+        """Sends what is left at the end of the operation."""
+        self.flush()
+
+    def _flush(self) -> None:
+        # runs on an outbox worker, which sends the requests of one chat one at a time
+        with self.lock:
+            self.scheduled = False
+            self.unsent += self.pending
+            self.pending = []
+            if not self.unsent:
+                return
+            text = '\n\n'.join(self.unsent)
+
+        combined = f'{self.sent_text}\n\n{text}' if self.sent_text else text
+        edited = False
+        if self.sent is not None and len(combined) <= TELEGRAM_MESSAGE_LIMIT:
+            try:
+                self.sent.edit_text(combined, parse_mode=ParseMode.HTML)
+                self.sent_text = combined
+                edited = True
+            except RetryAfter:
+                raise
+            except Exception as error:
+                logger.warning(f'Error editing reply, sending a new message: {error}')
+        if edited:
+            with self.lock:
+                self.unsent = []
+            return
+
+        # too long for one message: a <pre> table or many account lines are split without cutting a <pre> fragment
+        pieces = list(split_message(self.unsent, '\n\n'))
+        for index, piece in enumerate(pieces):
+            self.sent = self.message.reply_text(piece, parse_mode=ParseMode.HTML)
+            self.sent_text = piece
+            # a request that raised RetryAfter is retried with the pieces not sent yet
+            with self.lock:
+                self.unsent = pieces[index + 1:]
+
 
 async def pending_orders(update: Update, context: CallbackContext) -> None:
     try:
-        countrow = 0
         pending_orders_data = await get_pending_orders(update)
-        table = create_table(pending_orders_data)
-        countrow = len(table._rows)
-        update.effective_message.reply_text(f"Total Pending Orders: {countrow}")
-        batch_size = 30
-        # In các phần
-        for start in range(0, countrow, batch_size):
-            end = min(start + batch_size, countrow)
-            temp_table = table.get_string(start=start, end=end)
-            part_temp_table = f'<pre>{temp_table}</pre>'
-            update.effective_message.reply_text(part_temp_table, parse_mode=ParseMode.HTML)
+        title, headers, rows = table_rows(pending_orders_data)
+        summary = f"Total Pending Orders: {len(pending_orders_data)} ({trade_book.last_synced_text(trade_book.orders_synced)})"
+        for message in render_table_chunks(title, headers, rows, summary):
+            send_reply(update, message, parse_mode=ParseMode.HTML)
     except Exception as e:
-        update.effective_message.reply_text(f"Error pending orders: {e}")
+        send_reply(update, f"Error pending orders: {e}")
 
 async def open_trades(update: Update, context: CallbackContext) -> None:
     try:
-        countrow = 0
         open_trades_data = await get_open_trades(update)
-        table = create_table(open_trades_data, is_pending=False)
-        countrow = len(table._rows)
-        update.effective_message.reply_text(f"Total Positions: {countrow}")
-        batch_size = 30
-        # In các phần
-        for start in range(0, countrow, batch_size):
-            end = min(start + batch_size, countrow)
-            temp_table = table.get_string(start=start, end=end)
-            part_temp_table = f'<pre>{temp_table}</pre>'
-            update.effective_message.reply_text(part_temp_table, parse_mode=ParseMode.HTML)
+        title, headers, rows = table_rows(open_trades_data, is_pending=False)
+        summary = f"Total Positions: {len(open_trades_data)} ({trade_book.last_synced_text(trade_book.positions_synced)})"
+        for message in render_table_chunks(title, headers, rows, summary):
+            send_reply(update, message, parse_mode=ParseMode.HTML)
     except Exception as e:
-        update.effective_message.reply_text(f"Error open trades: {e}")
+        send_reply(update, f"Error open trades: {e}")
+
+
+async def RunBulkOperation(update: Update, title: str, position_ids: list, operation) -> None:
+    """Runs one position operation for many IDs with bounded concurrency and sends a summary reply, split over several messages if it is too long.
+
+    Arguments:
+        update: update from Telegram
+        title: name of the operation shown in the summary
+        position_ids: list of position IDs to process
+        operation: coroutine function called with a position ID that returns a success message
+    """
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
 
+    async def run_one(position_id: str) -> tuple:
+        async with semaphore:
+            try:
+                message = await asyncio.wait_for(operation(position_id), BULK_TIMEOUT)
+                return position_id, True, message
+            except asyncio.TimeoutError:
+                return position_id, False, f"timed out after {BULK_TIMEOUT:g} s"
+            except Exception as e:
+                await connection_manager.reset(e)
+                return position_id, False, str(e)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_one(position_id) for position_id in position_ids))
+    elapsed = time.perf_counter() - start
+
+    succeeded = [result for result in results if result[1]]
+    failed = [result for result in results if not result[1]]
+    lines = [f"{title}: {len(succeeded)}/{len(results)} succeeded in {elapsed:.2f} s"]
+    lines += [f"✅ {position_id}: {message}" for position_id, _, message in succeeded]
+    lines += [f"❌ {position_id}: {message}" for position_id, _, message in failed]
+    logger.info(f"{title}: {len(succeeded)} succeeded, {len(failed)} failed in {elapsed:.2f} s")
+    # one line per ID, continued in further messages past the Telegram limit
+    for message in split_message(lines):
+        send_reply(update, message, PRIORITY_TRADE)
 
 # Function to handle the /trailingstop command
 async def trailing_stop(update: Update, args) -> None:
     # Get the string of position IDs from the command arguments
     if not args:
-        update.effective_message.reply_text("Please provide a list of position IDs.")
+        send_reply(update, "Please provide a list of position IDs.")
         return
 
     # Combine the arguments into a single string, then split it into a list of position IDs
-    position_ids = "".join(args).split(',')
-
-    api = MetaApi(API_KEY)
-    account = await api.metatrader_account_api.get_account(ACCOUNT_ID)
-    initial_state = account.state
-    deployed_states = ['DEPLOYING', 'DEPLOYED']
-
-    if initial_state not in deployed_states:
-        #  wait until account is deployed and connected to broker
-        logger.info('Deploying account')
-        await account.deploy()
-
-    logger.info('Waiting for API server to connect to broker ...')
-    await account.wait_connected()
-
-    # connect to MetaApi API
-    connection = account.get_rpc_connection()
-    await connection.connect()
-    await connection.wait_synchronized()
-    # Process each position ID
-    for position_id in position_ids:
-        try:
-            # Convert position ID to an integer (assuming it's a valid integer)
-            intposition_id = str(position_id)
+    position_ids = [position_id for position_id in "".join(args).split(',') if position_id]
 
-            # Get position information
-            position = await connection.get_position(intposition_id)
-            # Modify the position with trailing stop parameters
-            
+    try:
+        connection = await connection_manager.get_connection(synchronized=True)
+    except Exception as e:
+        send_reply(update, f"Error connecting to MetaTrader: {e}")
+        return
 
-            # Check if stopLoss exists, set to its value or None
-            stopLoss = position['stopLoss'] if 'stopLoss' in position else None
+    async def move_stop_loss_to_entry(position_id: str) -> str:
+        # Get position information
+        position = await connection.get_position(position_id)
 
-            # Check if takeProfit exists, set to its value or None
-            takeProfit = position['takeProfit'] if 'takeProfit' in position else None
+        # Check if stopLoss exists, set to its value or None
+        stopLoss = position['stopLoss'] if 'stopLoss' in position else None
 
-            # Modify the position with trailing stop parameters
-            await connection.modify_position(
-                intposition_id,
-                stop_loss=position['openPrice'],  # Set stopLoss to the openPrice
-                take_profit=takeProfit  # Set takeProfit to its existing value or None if it doesn't exist
-            )
+        # Check if takeProfit exists, set to its value or None
+        takeProfit = position['takeProfit'] if 'takeProfit' in position else None
 
-            update.effective_message.reply_text(
-                f"Trailing stop set for position ID ({intposition_id}) - Change SL :  {stopLoss} to Entry: {position['openPrice']}. Successfully"
-            )
+        # Modify the position with trailing stop parameters
+        await connection.modify_position(
+            position_id,
+            stop_loss=position['openPrice'],  # Set stopLoss to the openPrice
+            take_profit=takeProfit  # Set takeProfit to its existing value or None if it doesn't exist
+        )
+        return f"Change SL : {stopLoss} to Entry: {position['openPrice']}"
+
+    await RunBulkOperation(update, "Trailing Stop", position_ids, move_stop_loss_to_entry)
 
-        except ValueError:
-            update.effective_message.reply_text(
-                f"Invalid position ID: {intposition_id}. Please provide valid integers."
-            )
-        except Exception as e:
-            update.effective_message.reply_text(
-                f"Error TrailingStop Position ID {position_id}: {str(e)}."
-            ) 
 async def close_position(update: Update, args) -> None:
    # Get the string of position IDs from the command arguments
     if not args:
-        update.effective_message.reply_text("Please provide a list of position IDs.")
+        send_reply(update, "Please provide a list of position IDs.")
         return
     # Lấy chuỗi từ args
     command_str = args[0]
     # Tách chuỗi thành danh sách các ID, tách bởi dấu phẩy
-    position_ids = command_str.split(",")
+    position_ids = [position_id for position_id in command_str.split(",") if position_id]
     if not position_ids:
-        update.effective_message.reply_text("Please provide a list of position IDs.")
+        send_reply(update, "Please provide a list of position IDs.")
         return
 
-    api = MetaApi(API_KEY)
-    account = await api.metatrader_account_api.get_account(ACCOUNT_ID)
-    initial_state = account.state
-    deployed_states = ['DEPLOYING', 'DEPLOYED']
-
-    if initial_state not in deployed_states:
-        # Wait until account is deployed and connected to the broker
-        logger.info('Deploying account')
-        await account.deploy()
-
-    logger.info('Waiting for API server to connect to the broker ...')
-    await account.wait_connected()
+    try:
+        connection = await connection_manager.get_connection(synchronized=True)
+    except Exception as e:
+        send_reply(update, f"Error connecting to MetaTrader: {e}")
+        return
 
-    # Connect to MetaApi API
-    connection = account.get_rpc_connection()
-    await connection.connect()
-    await connection.wait_synchronized()
+    async def close_one(position_id: str) -> str:
+        await connection.close_position(position_id)
+        return "Closed"
 
-    # Process each position ID
-    for position_id in position_ids:
-        try:
-            # Close position
-            await connection.close_position(position_id)
-            update.effective_message.reply_text(f"Closed Position ID {position_id} successfully.")
-
-        except ValueError:
-            update.effective_message.reply_text(f"Invalid Position ID: {position_id}. Please provide valid integers.")
-        except Exception as e:
-            update.effective_message.reply_text(f"Error closing Position ID {position_id}: {str(e)}.")
+    await RunBulkOperation(update, "Close Position", position_ids, close_one)
 
 
 
 async def close_position_partially(update: Update, args) -> None:
    # Get the string of position IDs and sizes from the command arguments
     if not args or '|' not in args[0]:
-        update.effective_message.reply_text("Please provide a list of position IDs and sizes separated by '|'.")
+        send_reply(update, "Please provide a list of position IDs and sizes separated by '|'.")
         return
 
     # Split the arguments into position IDs and sizes
     position_args = args[0].split('|')
-    listID = position_args[0].split(',')
-    # listID_str = ', '.join(map(str, listID))
-    # update.effective_message.reply_text(f"List ID: {listID_str}.")
-    listSize = list(map(float, position_args[1].split(',')))
-    api = MetaApi(API_KEY)
-    account = await api.metatrader_account_api.get_account(ACCOUNT_ID)
-    initial_state = account.state
-    deployed_states = ['DEPLOYING', 'DEPLOYED']
-
-    if initial_state not in deployed_states:
-        #  wait until account is deployed and connected to broker
-        logger.info('Deploying account')
-        await account.deploy()
-
-    logger.info('Waiting for API server to connect to broker ...')
-    await account.wait_connected()
-
-    # connect to MetaApi API
-    connection = account.get_rpc_connection()
-    await connection.connect()
-    await connection.wait_synchronized()    
-    # Process each position ID and size
-    for i, position_id in enumerate(listID):
-        try:
-            # Kiểm tra nếu không tồn tại phần tử tương ứng trong listSize
-            if i >= len(listSize):
-                update.effective_message.reply_text(f"No size provided for Position ID {position_id}.")
-                break
+    listID = [position_id for position_id in position_args[0].split(',') if position_id]
+    try:
+        listSize = list(map(float, position_args[1].split(',')))
+    except ValueError:
+        send_reply(update, f"Invalid sizes: {position_args[1]}. Please provide valid numbers.")
+        return
 
-            size = float(listSize[i])
+    try:
+        connection = await connection_manager.get_connection(synchronized=True)
+    except Exception as e:
+        send_reply(update, f"Error connecting to MetaTrader: {e}")
+        return
 
-            # Close a part of the position
-            await connection.close_position_partially(position_id, size)
+    # Kiểm tra nếu không tồn tại phần tử tương ứng trong listSize
+    sizes = dict(zip(listID, listSize))
 
-            update.effective_message.reply_text(f"Closed a part : {size} lot of Position ID : {position_id} successfully.")
-        except ValueError:
-            update.effective_message.reply_text(f"Invalid Position ID: {position_id}. Please provide valid integers.")
-        except Exception as e:
-            update.effective_message.reply_text(f"Error closing Position ID {position_id}: {str(e)}.")
+    async def close_part(position_id: str) -> str:
+        if position_id not in sizes:
+            raise ValueError("No size provided")
+        size = sizes[position_id]
 
+        # Close a part of the position
+        await connection.close_position_partially(position_id, size)
+        return f"Closed a part : {size} lot"
 
-async def account_info(update: Update) -> None:
-    try:
-        # Đoạn mã JSON của bạn
-        api = MetaApi(API_KEY)
-        account = await api.metatrader_account_api.get_account(ACCOUNT_ID)
-        initial_state = account.state
-        deployed_states = ['DEPLOYING', 'DEPLOYED']
+    await RunBulkOperation(update, "Close Partially", listID, close_part)
 
-        if initial_state not in deployed_states:
-            #  wait until account is deployed and connected to broker
-            logger.info('Deploying account')
-            await account.deploy()
-
-        logger.info('Waiting for API server to connect to broker ...')
-        await account.wait_connected()
 
-        # connect to MetaApi API
-        connection = account.get_rpc_connection()
-        await connection.connect()
-        await connection.wait_synchronized()
-        account_information = await connection.get_account_information()
+async def account_info(update: Update) -> None:
+    try:
+        account_information = await account_state.get_account_information()
         logger.info(f"Account Info : {account_information}")
         # Tạo PrettyTable
         table = PrettyTable(['Title', 'Value'])
@@ -528,31 +2298,59 @@ async def account_info(update: Update) -> None:
             table.add_row([field_name_vietnamese  , field_value])
         # Gửi bảng dưới dạng tin nhắn HTML
         temp_table = f'<pre>{table}</pre>'
-        update.effective_message.reply_text(f'<pre>{temp_table}</pre>', parse_mode=ParseMode.HTML)
+        send_reply(update, f'<pre>{temp_table}</pre>', parse_mode=ParseMode.HTML)
     except Exception as e:
-        update.effective_message.reply_text(f"Error get Account Infomation: {str(e)}.")
+        await connection_manager.reset(e)
+        send_reply(update, f"Error get Account Infomation: {str(e)}.")
     
 
+def submit_work(update: Update, queue: str, function, *args) -> bool:
+    """Queues the work of a handler on the work scheduler, answering right away if its queue is full.
+
+    Arguments:
+        update: update from Telegram
+        queue: work queue, signals, commands or views
+        function: coroutine function that does the work
+        args: arguments for the function
+
+    Returns:
+        False if the work was rejected
+    """
+    if work_scheduler.submit(queue, function, *args):
+        return True
+    send_reply(update, "The bot is busy, please try again in a moment. ⏳", PRIORITY_TRADE if queue == 'signals' else PRIORITY_INFO)
+    return False
+
 def handle_account_info(update: Update, context: CallbackContext):
-    asyncio.run(account_info(update))
+    submit_work(update, 'views', account_info, update)
 
 def handle_pending_orders(update: Update, context: CallbackContext):
-    asyncio.run(pending_orders(update,context))
+    submit_work(update, 'views', pending_orders, update, context)
 
 def handle_open_trades(update: Update, context: CallbackContext):
-    asyncio.run(open_trades(update,context))
+    submit_work(update, 'views', open_trades, update, context)
 
 def handle_trailingstop(update: Update, context: CallbackContext):
     args = update.effective_message.text.split(' ')[1:]
-    asyncio.run(trailing_stop(update,args))
+    submit_work(update, 'commands', trailing_stop, update, args)
 
 def handle_closeposition(update: Update, context: CallbackContext):
     args = update.effective_message.text.split(' ')[1:]
-    asyncio.run(close_position(update, args))
+    submit_work(update, 'commands', close_position, update, args)
 
 def handle_close_position_part(update: Update, context: CallbackContext):
     args = update.effective_message.text.split(' ')[1:]
-    asyncio.run(close_position_partially(update, args))
+    submit_work(update, 'commands', close_position_partially, update, args)
+
+def count_update(update: Update, context: CallbackContext):
+    metrics.inc('telegram_updates_total')
+
+def handle_latency(update: Update, context: CallbackContext):
+    stats = signal_cache.stats()
+    cache = (f"Signal cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} cached, "
+             f"{stats['duplicates']} duplicates ignored")
+    send_reply(update, f'<pre>Latency per stage (ms)\n{latency_recorder.report()}\n\n{html.escape(cache)}</pre>',
+               parse_mode=ParseMode.HTML)
 
 
 # def find_entry_point(trade: str, signal: list[str], signaltype : str) -> float:
@@ -573,12 +2371,82 @@ def replace_spaces(text):
   Returns:
     Chuỗi đã được xử lý
   """
-  temp = re.sub(r"(\d+) +(\d+)(?!0)", r"\1.\2", text)
+  temp = SPACED_NUMBER_PATTERN.sub(r"\1.\2", text)
   return temp
 
+class SymbolIndex:
+    """Finds allowed trading symbols in text with one precompiled pattern.
+
+    Every accepted spelling (plain, with '/', aliases and broker names) is folded into a trie that is compiled to a single regular expression, so a lookup is one pass over the text however many symbols are configured.
+    """
+
+    def __init__(self, symbols: list, aliases: dict, broker_symbols: dict = None, suffix: str = ''):
+        """
+        Arguments:
+            symbols: allowed symbols, optionally written with '/'
+            aliases: symbols that are renamed before trading, e.g. GOLD -> XAUUSD
+            broker_symbols: broker specific names of symbols, e.g. XAUUSD -> XAUUSDm
+            suffix: suffix the broker appends to every symbol without an explicit broker name
+        """
+        self.spellings = {}
+        for symbol in symbols:
+            canonical = symbol.replace('/', '')
+            self.spellings[symbol.upper()] = aliases.get(canonical, canonical)
+        for alias, canonical in aliases.items():
+            self.spellings[alias.upper()] = canonical
+
+        # broker names of every canonical symbol, and the reverse mapping so broker names are accepted in signals
+        broker_symbols = broker_symbols or {}
+        self.broker_symbols = {canonical: broker_symbols.get(canonical, canonical + suffix) for canonical in set(self.spellings.values())}
+        for canonical, broker_symbol in self.broker_symbols.items():
+            self.spellings.setdefault(broker_symbol.upper(), canonical)
+
+        # the lookahead reports the longest spelling starting at every position, overlapping ones included
+        self.pattern = re.compile(f'(?=({self._trie_pattern(self.spellings)}))')
+
+    def find(self, text: str) -> str:
+        """Returns the canonical symbol of the longest spelling found in text, the first one if several are equally long, or None."""
+        found = self.pattern.findall(text.upper())
+        if not found:
+            return None
+        return self.spellings[max(found, key=len)]
+
+    def broker_symbol(self, symbol: str) -> str:
+        """Returns the name the broker uses for a canonical symbol."""
+        return self.broker_symbols.get(symbol, symbol)
+
+    def canonical_symbol(self, broker_symbol: str) -> str:
+        """Returns the canonical symbol of a broker name, or the name itself if it is not an allowed symbol."""
+        return self.spellings.get(broker_symbol.upper(), broker_symbol)
+
+    @staticmethod
+    def _trie_pattern(words) -> str:
+        trie = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[''] = {}
+
+        def build(node: dict) -> str:
+            branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char != '']
+            if not branches:
+                return ''
+            body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+            # greedy optional children make the longest spelling win at each position
+            return f'(?:{body})?' if '' in node else body
+
+        return build(trie)
+
+
+symbol_index = SymbolIndex(SYMBOLSPLUS + SYMBOLS, SYMBOL_ALIASES, BROKER_SYMBOLS, SYMBOL_SUFFIX)
+
+@latency_recorder.timed()
 def ParseSignal(signal: str) -> dict:
     """Starts process of parsing signal and entering trade on MetaTrader account.
 
+    The message is read once: each line is lowercased and split a single time, and the entry, stop loss and take profit values are collected in the same pass.
+
     Arguments:
         signal: trading signal
 
@@ -587,113 +2455,80 @@ def ParseSignal(signal: str) -> dict:
     """
 
     # converts message to list of strings for parsing
-    signal = remove_pips(signal)
-    signal = replace_spaces(signal)
-    signal = signal.splitlines()
-    signal = [line.rstrip() for line in signal]
-    
-    #signalstripemty = [x.strip(' ') for x in signal]
+    signal = replace_spaces(remove_pips(signal))
+    lines = [line.rstrip() for line in signal.splitlines()]
+    if not lines:
+        return {}
+    lowered = [line.lower() for line in lines]
 
     trade = {}
 
-    # determines the order type of the trade
-    if('Buy Limit'.lower() in signal[0].lower() or 'Buy Limit'.lower() in signal[1].lower() or'Buy Limit'.lower() in signal[2].lower() ):
-        trade['OrderType'] = 'Buy Limit'
-
-    elif('Sell Limit'.lower() in signal[0].lower() or 'Sell Limit'.lower() in signal[1].lower() or 'Sell Limit'.lower() in signal[2].lower()):
-        trade['OrderType'] = 'Sell Limit'
-
-    elif('Buy Stop'.lower() in signal[0].lower() or 'Buy Stop'.lower() in signal[1].lower() or 'Buy Stop'.lower() in signal[2].lower()):
-        trade['OrderType'] = 'Buy Stop'
+    # determines the order type of the trade from the first three lines
+    head = '\n'.join(lowered[:3])
+    for keyword, orderType in ORDER_TYPES:
+        if keyword in head:
+            trade['OrderType'] = orderType
+            break
 
-    elif('Sell Stop'.lower() in signal[0].lower() or 'Sell Stop'.lower() in signal[1].lower() or 'Sell Stop'.lower() in signal[2].lower()):
-        trade['OrderType'] = 'Sell Stop'
-
-    elif('Buy Now'.lower() in signal[0].lower() or 'Buy Now'.lower() in signal[1].lower() or 'Buy Now'.lower() in signal[2].lower()):
-        trade['OrderType'] = 'Buy Now'
-                
-    elif('Sell Now'.lower() in signal[0].lower() or 'Sell Now'.lower() in signal[1].lower() or 'Sell Now'.lower() in signal[2].lower()):
-         trade['OrderType'] = 'Sell Now'
-         
-    elif('Buy'.lower() in signal[0].lower() or 'Buy'.lower() in signal[1].lower() or 'Buy'.lower() in signal[2].lower()):
-        trade['OrderType'] = 'Buy'
-         
-    elif('Sell'.lower() in signal[0].lower() or 'Sell'.lower() in signal[1].lower() or 'Sell'.lower() in signal[2].lower()):
-        trade['OrderType'] = 'Sell'
-        
-    
-    
     # returns an empty dictionary if an invalid order type was given
     else:
         return {}
-       
-    # extracts symbolplus '/' from trade signal if found then replace '/' to ''
-    symbolflag = 0
-    for elemental in SYMBOLSPLUS:
-        calcusymbol = signal[0].upper().find(elemental,0)
-        if(calcusymbol != -1):
-            trade['Symbol'] = elemental.replace('/','')
-            symbolflag = 1
-            
-    # extracts symbol from trade signal        
-    if(symbolflag == 0):                
-        for element in SYMBOLS:
-            calcu = signal[0].upper().find(element,0)
-            if(calcu != -1):
-                trade['Symbol'] = element
-                
-    # checks if the symbol is valid, if not, returns an empty dictionary
-    if(trade['Symbol'] not in SYMBOLS):
+
+    # extracts the longest allowed symbol from the first line, returns an empty dictionary if there is none
+    symbol = symbol_index.find(lines[0])
+    if symbol is None:
         return {}
-    
-    # change symbol trade signal
-    if(trade['Symbol'] == 'GOLD'):
-       trade['Symbol'] = 'XAUUSD'
-    elif (trade['Symbol'] == 'NAS100'):
-         trade['Symbol'] = 'USTEC'
-    
+    trade['Symbol'] = symbol
+
+    # collects the values of every keyword line in a single pass
+    entries, takeProfits, targetProfits, stopLosses, stopLossesLong = [], [], [], [], []
+    sidePrices = []
+    sideKeyword = trade['OrderType'].lower() if trade['OrderType'] in ('Buy', 'Sell') else None
+    for line, low in zip(lines, lowered):
+        if line == '':
+            continue
+        if sideKeyword is not None and sideKeyword in low:
+            sidePrices.append(PRICE_SPLIT_PATTERN.split(line)[-1])
+        try:
+            value = float(line.split()[-1])
+        except ValueError:
+            continue
+        if 'entry' in low:
+            entries.append(value)
+        if 'tp' in low:
+            takeProfits.append(value)
+        if 'target profit' in low:
+            targetProfits.append(value)
+        if 'sl' in low:
+            stopLosses.append(value)
+        if 'stop loss' in low:
+            stopLossesLong.append(value)
+
     #Find symbol 'Entry' if found 'entry' will get float entry in Signal and specical Entry = NOW
-    entrygetbuy = FindTP('ENTRY',signal)
-    flagbuyentry = 0
-    if(len(entrygetbuy)>0):
-        trade['Entry'] = float(entrygetbuy[0])
-        flagbuyentry = 1
-        
-   # checks entry for 'BUY'/'SELL' OrderType
-    if((trade['OrderType'] == 'Buy' or trade['OrderType'] == 'Sell') and flagbuyentry == 0):                
-        memforfindorderentry = trade['OrderType'].upper()
-        for i in range(len(signal)):
-          if(signal[i] != ''):   
-              j = signal[i].upper().find(memforfindorderentry,0)
-              if(j != -1 and i == 0 ):
-                getentryfirstline = re.split('[a-z]+|[-,/,@]',signal[i] ,flags=re.IGNORECASE)[-1]
-                if(getentryfirstline != ''):
-                    trade['Entry'] = float(getentryfirstline)
-                else:
-                    trade['Entry'] = ''    
-              elif(j != -1 and i > 0):
-                  getentrybyline = re.split('[a-z]+|[-,/,@]',signal[i] ,flags=re.IGNORECASE)[-1]
-                  if(getentrybyline != ''):
-                      trade['Entry'] = float(getentrybyline)
-                  else:
-                      trade['Entry'] = ''
+    if entries:
+        trade['Entry'] = entries[0]
+
+    # checks entry for 'BUY'/'SELL' OrderType, the last line with the order type wins
+    elif sideKeyword is not None:
+        for sidePrice in sidePrices:
+            trade['Entry'] = float(sidePrice) if sidePrice != '' else ''
+
     # checks wheter or not to convert entry to float because of market exectution option ("NOW")
-    if((trade['OrderType'] == 'Buy Limit' or trade['OrderType'] == 'Sell Limit') and flagbuyentry == 0):
-        oneline = re.split('[a-z]+|[-,/,@]',signal[0] ,flags=re.IGNORECASE)[-1]
+    elif trade['OrderType'] == 'Buy Limit' or trade['OrderType'] == 'Sell Limit':
+        oneline = PRICE_SPLIT_PATTERN.split(lines[0])[-1]
         if(oneline != ''):
             trade['Entry'] = float(oneline)
-            
-        elif(oneline == '' and signal[1] != ''):            
-           trade['Entry'] = float((signal[1].split())[-1]) 
-           
+
+        elif(lines[1] != ''):
+           trade['Entry'] = float((lines[1].split())[-1])
+
         else:
-            trade['Entry'] = float((signal[2].split())[-1])
-             
-      
+            trade['Entry'] = float((lines[2].split())[-1])
+
     # checks wheter or not to convert entry to float because of market exectution option ("NOW")
     if(trade['OrderType'] == 'Buy Now' or trade['OrderType'] == 'Sell Now'):
         trade['Entry'] = 'NOW'
-    
+
     #Change symbol ordertype from buy/sell to buy limit/sell limit with if : trade['Entry'] != NOW
     if(trade['OrderType'] == 'Buy' and  trade['Entry'] != 'NOW' and trade['Entry'] != ''):
         trade['OrderType'] = 'Buy Limit'
@@ -703,28 +2538,23 @@ def ParseSignal(signal: str) -> dict:
         trade['Entry'] = 'NOW'
     elif(trade['OrderType'] == 'Sell' and  trade['Entry'] != 'NOW' and trade['Entry'] == ''):
          trade['Entry'] = 'NOW'
-    
-    
+
     #find and add TP
-    arraytp = FindTP('TP',signal)
-    arraytarget = FindTP('Target Profit',signal)
-    if(len(arraytp) > 0):
-        trade['TP'] = arraytp
-    elif(len(arraytarget) > 0 and len(arraytp) == 0):
-        trade['TP'] = arraytarget
+    if(len(takeProfits) > 0):
+        trade['TP'] = takeProfits
+    elif(len(targetProfits) > 0):
+        trade['TP'] = targetProfits
     else:
-        trade['TP']= [float((signal[3].split())[-1])]
-    
+        trade['TP']= [float((lines[3].split())[-1])]
+
     #find and add SL
-    stoplosser = FindTP('SL',signal)
-    stoplosserb = FindTP('STOP LOSS',signal)
-    if(len(stoplosser) > 0):
-        trade['StopLoss'] = float(stoplosser[0])
-    elif(len(stoplosserb) > 0 and len(stoplosser) == 0):
-        trade['StopLoss'] = float(stoplosserb[0])
+    if(len(stopLosses) > 0):
+        trade['StopLoss'] = stopLosses[0]
+    elif(len(stopLossesLong) > 0):
+        trade['StopLoss'] = stopLossesLong[0]
     else:
-        trade['StopLoss'] = float((signal[2].split())[-1])
-    
+        trade['StopLoss'] = float((lines[2].split())[-1])
+
     # adds risk factor to trade
     trade['RiskFactor'] = RISK_FACTOR
     trade['RiskPerTrade'] = RISK_PERTRADE
@@ -732,79 +2562,103 @@ def ParseSignal(signal: str) -> dict:
     return trade
 
 
-def GetTradeInformation(update: Update, trade: dict, balance: float) -> None:
+def SizeTrade(trade: dict, balance: float, plan: str = None, currency: str = None) -> tuple:
+    """Calculates the stop loss and take profits in pips and sets the position size(s) of the trade for the balance.
+
+    Arguments:
+        trade: dictionary that stores trade information, PositionSize, PipValue (and RR for PLAN B) are set on it
+        balance: current balance of the MetaTrader account
+        plan: PLAN used for sizing, defaults to PLAN
+        currency: currency of the balance, defaults to the main account currency
+
+    Returns:
+        a tuple with the stop loss in pips and the list of take profits in pips
+
+    Raises:
+        ValueError: if the value of a pip is not known, a guess would size the trade for the wrong risk
+    """
+    plan = plan or PLAN
+    # pip size from the symbol specification, and the value of one pip for one lot in the account currency
+    multiplier = symbol_specs.pip_size(trade['Symbol'], trade['Entry'])
+    pipValue = pip_values.pip_value(trade['Symbol'], currency)
+    if not pipValue:
+        raise ValueError(f"The value of a pip of {trade['Symbol']} is not known, its symbol specification or the "
+                         f"{pip_values.profit_currency(trade['Symbol']) or 'profit currency'} exchange rate could not "
+                         f"be loaded. The trade was not sized.")
+    trade['PipValue'] = pipValue
+
+    # calculates the stop loss in pips
+    stopLossPips = abs(round((trade['StopLoss'] - trade['Entry']) / multiplier))
+
+    # calculates the take profit(s) in pips
+    takeProfitPips = []
+    for takeProfit in trade['TP']:
+        takeProfitPips.append(abs(round((takeProfit - trade['Entry']) / multiplier)))
+
+    if plan == 'A':
+        # calculates the position size using stop loss and RISK FACTOR
+        trade['PositionSize'] = symbol_specs.round_volume(trade['Symbol'], ((balance * trade['RiskFactor']) / stopLossPips) / pipValue)
+    elif plan == 'B':
+        # calculates the position size using stop loss and RISK FACTOR
+        rr_coefficient = calculate_rr_coefficient(takeProfitPips,stopLossPips)
+        positionSize = []
+        rickandreward = []       
+        for rr in rr_coefficient:
+            position_size = symbol_specs.round_volume(trade['Symbol'], ((balance * trade['RiskPerTrade'] * rr) / stopLossPips) / pipValue)
+            positionSize.append(position_size)
+            rickandreward.append(rr)
+        trade['RR'] = rickandreward
+        trade['PositionSize'] = positionSize
+
+    return stopLossPips, takeProfitPips
+
+
+@latency_recorder.timed()
+def GetTradeInformation(update: Update, trade: dict, balance: float, replies: ReplyAggregator = None, plan: str = None) -> None:
     """Calculates information from given trade including stop loss and take profit in pips, posiition size, and potential loss/profit.
 
     Arguments:
         update: update from Telegram
         trade: dictionary that stores trade information
         balance: current balance of the MetaTrader account
+        replies: optional aggregator the table is added to instead of being sent on its own
+        plan: PLAN used for sizing, defaults to PLAN
     """
+    reply = replies if replies is not None else ReplyAggregator(update.effective_message, 0, PRIORITY_INFO)
+    plan = plan or PLAN
     try:
-        # calculates the stop loss in pips
-        if(trade['Symbol'] == 'XAUUSD'):
-            multiplier = 0.1
-
-        elif(trade['Symbol'] == 'XAGUSD'):
-            multiplier = 0.001
-
-        elif(str(trade['Entry']).index('.') >= 2):
-            multiplier = 0.01
+        stopLossPips, takeProfitPips = SizeTrade(trade, balance, plan)
+        tradeTP = list(trade['TP'])
 
-        else:
-            multiplier = 0.0001
-
-        # calculates the stop loss in pips
-        stopLossPips = abs(round((trade['StopLoss'] - trade['Entry']) / multiplier))
-
-    
-            
-        # calculates the take profit(s) in pips
-        takeProfitPips = []
-        for takeProfit in trade['TP']:
-            takeProfitPips.append(abs(round((takeProfit - trade['Entry']) / multiplier)))
-        tradeTP =[]
-        for takeProfit in trade['TP']:
-            tradeTP.append(takeProfit)
-        
-        if PLAN == 'A':
-            # calculates the position size using stop loss and RISK FACTOR
-            trade['PositionSize'] = math.floor(((balance * trade['RiskFactor']) / stopLossPips) / 10 * 100) / 100
-        elif PLAN == 'B':
-            # calculates the position size using stop loss and RISK FACTOR
-            rr_coefficient = calculate_rr_coefficient(takeProfitPips,stopLossPips)
-            positionSize = []
-            rickandreward = []       
-            for rr in rr_coefficient:
-                position_size =  math.floor(((balance * trade['RiskPerTrade'] * rr) / stopLossPips) / 10 * 100) / 100
-                positionSize.append(position_size)
-                rickandreward.append(rr)
-            trade['RR'] = rickandreward
-            trade['PositionSize'] = positionSize
         # creates table with trade information
-        table = CreateTable(trade, balance, stopLossPips, takeProfitPips, tradeTP)
+        table = CreateTable(trade, balance, stopLossPips, takeProfitPips, tradeTP, plan)
         
         # sends user trade information and calcualted risk
-        update.effective_message.reply_text(f'<pre>{table}</pre>', parse_mode=ParseMode.HTML)
+        reply.reply_text(f'<pre>{html.escape(str(table))}</pre>', parse_mode=ParseMode.HTML)
 
     except Exception as error:
         logger.error(f'Error Trade: {error}')
-        update.effective_message.reply_text(f"There was an issue with the connection 😕\n\nError Message:\n{error}")
+        reply.reply_text(f"There was an issue calculating this trade 😕\n\nError Message:\n{error}")
 
+    if replies is None:
+        reply.close()
     return
 
-def CreateTable(trade: dict, balance: float, stopLossPips: int, takeProfitPips: int, tradeTP : float) -> PrettyTable:
+def CreateTable(trade: dict, balance: float, stopLossPips: int, takeProfitPips: int, tradeTP : float, plan: str = None) -> PrettyTable:
     """Creates PrettyTable object to display trade information to user.
 
     Arguments:
         trade: dictionary that stores trade information
         balance: current balance of the MetaTrader account
         stopLossPips: the difference in pips from stop loss price to entry price
+        plan: PLAN the trade was sized with, defaults to PLAN
 
     Returns:
         a Pretty Table object that contains trade information
     """
-    if PLAN == 'A':
+    plan = plan or PLAN
+    pipValue = trade['PipValue']
+    if plan == 'A':
 
         # creates prettytable object
         table = PrettyTable()    
@@ -829,20 +2683,20 @@ def CreateTable(trade: dict, balance: float, stopLossPips: int, takeProfitPips:
         table.add_row(['Position Size', trade['PositionSize']])
         
         table.add_row(['\nCurrent Balance', '\n$ {:,.2f}'.format(balance)])
-        table.add_row(['Potential Loss', '$ {:,.2f}'.format(round((trade['PositionSize'] * 10) * stopLossPips, 2))])
+        table.add_row(['Potential Loss', '$ {:,.2f}'.format(round((trade['PositionSize'] * pipValue) * stopLossPips, 2))])
 
         # total potential profit from trade
         totalProfit = 0
 
         for count, takeProfit in enumerate(takeProfitPips):
-            profit = round((trade['PositionSize'] * 10 * (1 / len(takeProfitPips))) * takeProfit, 2)
+            profit = round((trade['PositionSize'] * pipValue * (1 / len(takeProfitPips))) * takeProfit, 2)
             table.add_row([f'TP {count + 1} Profit', '$ {:,.2f}'.format(profit)])
             
             # sums potential profit from each take profit target
             totalProfit += profit
 
         table.add_row(['\nTotal Profit', '\n$ {:,.2f}'.format(totalProfit)])
-    elif PLAN == 'B':
+    elif plan == 'B':
         # creates prettytable object
         table = PrettyTable()
         table.title = "Trade Information AI - R:R Kelly Criterion"
@@ -871,26 +2725,24 @@ def CreateTable(trade: dict, balance: float, stopLossPips: int, takeProfitPips:
                 rounded_position_size = round(position_size, 2)
                 table.add_row([f'Position Size {count + 1}', rounded_position_size])
             else:
-                print(f"Skipping non-numeric value at index {count}")
+                logger.warning(f"Skipping non-numeric position size at index {count}")
         # total potential loss from trade
         totalLoss = 0
         
         table.add_row(['\nCurrent Balance', '\n$ {:,.2f}'.format(balance)])
         for count, position_size in enumerate(positionSize):
             if isinstance(position_size, (int, float)):
-                potential_loss = round((position_size * 10) * stopLossPips, 2)
+                potential_loss = round((position_size * pipValue) * stopLossPips, 2)
                 table.add_row([f'Potential Loss {count + 1}', '$ {:,.2f}'.format(potential_loss)])
                 totalLoss += potential_loss
             else:
-                print(f"Skipping non-numeric value at index {count}")
+                logger.warning(f"Skipping non-numeric position size at index {count}")
         # total potential profit from trade
         totalProfit = 0
 
-        for count, takeProfit in enumerate(takeProfitPips):         
-            position_sizes = positionSize[count]
-            # Retrieve the corresponding position size for the current take profit level
-            #position_sz = trade['PositionSize'][count]
-            profit = round(position_size * 10 * takeProfit, 2)
+        for count, takeProfit in enumerate(takeProfitPips):
+            # each take profit closes the position size sized for it
+            profit = round(positionSize[count] * pipValue * takeProfit, 2)
             table.add_row([f'TP {count + 1} Profit', '$ {:,.2f}'.format(profit)])
             
             # sums potential profit from each take profit target
@@ -899,298 +2751,410 @@ def CreateTable(trade: dict, balance: float, stopLossPips: int, takeProfitPips:
         table.add_row(['Total Profit', '$ {:,.2f}'.format(totalProfit)])             
     return table
 
-async def ConnectMetaTrader(update: Update, trade: dict, enterTrade: bool):
-    """Attempts connection to MetaAPI and MetaTrader to place trade.
+def IsTradeNoError(error: Exception) -> bool:
+    """Checks if a trade exception actually reports success (ERR_NO_ERROR / code 0).
+
+    Arguments:
+        error: exception raised while placing an order
+    """
+    # the SDK TradeException keeps the codes in stringCode/numericCode
+    string_code = getattr(error, 'stringCode', getattr(error, 'string_code', None))
+    numeric_code = getattr(error, 'numericCode', getattr(error, 'numeric_code', None))
+    if string_code is None and numeric_code is None:
+        try:
+            string_code = error['stringCode']
+            numeric_code = error['numericCode']
+        except (TypeError, KeyError):
+            return False
+    return string_code == 'ERR_NO_ERROR' or numeric_code == 0
+
+def ResolveEntry(trade: dict, price: dict) -> None:
+    """Sets the entry of a market execution to the current ask (buy) or bid (sell) price.
 
     Arguments:
-        update: update from Telegram
         trade: dictionary that stores trade information
+        price: current symbol price with bid and ask
+    """
+    # checks if the order is a market execution to get the current price of symbol
+    if(trade['Entry'] == 'NOW'):
+
+        # uses ask price if the order type is a buy
+        if(trade['OrderType'] == 'Buy' or trade['OrderType'] == 'Buy Now'):
+            trade['Entry'] = float(price['ask'])
+
+        # uses bid price if the order type is a sell
+        if(trade['OrderType'] == 'Sell' or trade['OrderType'] == 'Sell Now'):
+            trade['Entry'] = float(price['bid'])
+
+def AdjustOrderType(trade: dict, price: dict) -> None:
+    """Turns a limit order whose entry the price already passed into a stop order.
+
+    Arguments:
+        trade: dictionary that stores trade information
+        price: current symbol price with bid and ask
+    """
+    # Kiểm tra nếu giá hiện tại thấp hơn giá Entry cho lệnh Buy Limit
+    if trade['OrderType'] == 'Buy Limit' and float(price['bid']) < trade['Entry']:
+        trade['OrderType'] = 'Buy Stop'
+
+    # Kiểm tra nếu giá hiện tại cao hơn giá Entry cho lệnh Sell Limit
+    elif trade['OrderType'] == 'Sell Limit' and float(price['ask']) > trade['Entry']:
+        trade['OrderType'] = 'Sell Stop'
+
+def BuildOrderLegs(trade: dict, price: dict, plan: str = None, trailing: bool = None) -> list:
+    """Builds one order leg per take profit from the sized trade.
+
+    Arguments:
+        trade: dictionary that stores trade information, sized by SizeTrade
+        price: current symbol price, used for the trailing stop configuration
+        plan: PLAN the trade was sized with, defaults to PLAN
+        trailing: adds the breakeven trailing stop options, defaults to TRAILINGSTOP
 
     Returns:
-        A coroutine that confirms that the connection to MetaAPI/MetaTrader and trade placement were successful
+        a list of (take profit, volume, options) tuples
     """
+    plan = plan or PLAN
+    if trailing is None:
+        trailing = TRAILINGSTOP == 'Y'
+    legs = []
+    trailing_stop_configs = None
+    if trailing and len(trade['TP']) >= 2:
+        trailing_stop_configs = BuildTrailingStopConfigs(trade, price)
+    for i, takeProfit in enumerate(trade['TP']):
+        if plan == 'B':
+            volume = trade['PositionSize'][i]
+        else:
+            # every leg gets a whole number of volume steps
+            volume = symbol_specs.round_volume(trade['Symbol'], trade['PositionSize'] / len(trade['TP']))
+        options = None
+        if trailing_stop_configs is not None:
+            # the first leg moves SL to entry near TP1, the others once TP1 is hit
+            options = trailing_stop_configs[0] if i == 0 else trailing_stop_configs[1]
+        legs.append((takeProfit, volume, options))
+    return legs
+
+def BuildTrailingStopConfigs(trade: dict, price: dict) -> tuple:
+    """Creates the trailing stop options used when a trade has two or more take profits.
 
-    # creates connection to MetaAPI
-    api = MetaApi(API_KEY)
-    
-    try:
-        account = await api.metatrader_account_api.get_account(ACCOUNT_ID)
-        initial_state = account.state
-        deployed_states = ['DEPLOYING', 'DEPLOYED']
+    Arguments:
+        trade: dictionary that stores trade information
+        price: current symbol price, its digits are used if the symbol has no specification
 
-        if initial_state not in deployed_states:
-            #  wait until account is deployed and connected to broker
-            logger.info('Deploying account')
-            await account.deploy()
+    Returns:
+        a tuple with the options for the first leg (SL to entry at 80% of TP1) and for the other legs (SL to entry at TP1)
+    """
+    entryTrade = float(trade['Entry'])
+    tradeFirstTP = float(trade['TP'][0])
+    trailing_stop_config =  {
+                                "trailingStopLoss": {
+                                    "threshold": {
+                                    "thresholds": [
+                                        {
+                                        "threshold": tradeFirstTP,
+                                        "stopLoss": entryTrade
+                                        }
+                                    ],
+                                    "units": "ABSOLUTE_PRICE",
+                                    "stopPriceBase": "CURRENT_PRICE"
+                                    }
+                                }
+                            }
 
-        logger.info('Waiting for API server to connect to broker ...')
-        await account.wait_connected()
+    threshold_TP1 = (trade['Entry'] + ((trade['TP'][0] - trade['Entry']) * 0.8))
+    decimal_places_entry = symbol_specs.digits(trade['Symbol'], price['bid'])
+    if decimal_places_entry == 0:
+        threshold_TP1 = round(threshold_TP1)
+    else:
+        threshold_TP1 = round(threshold_TP1, decimal_places_entry)
+    trailing_stop_TP1 =  {
+        "trailingStopLoss": {
+            "threshold": {
+            "thresholds": [
+                {
+                "threshold": threshold_TP1,
+                "stopLoss": entryTrade
+                }
+            ],
+            "units": "ABSOLUTE_PRICE",
+            "stopPriceBase": "CURRENT_PRICE"
+            }
+        }
+    }
+    return trailing_stop_TP1, trailing_stop_config
+
+async def CreateOrder(connection, trade: dict, volume: float, takeProfit: float, options: dict = None):
+    """Places one order leg on the MetaTrader account using the trade order type.
 
-        # connect to MetaApi API
-        connection = account.get_rpc_connection()
-        await connection.connect()
+    Arguments:
+        connection: MetaAPI RPC connection
+        trade: dictionary that stores trade information
+        volume: position size of this leg
+        takeProfit: take profit of this leg
+        options: optional trade options such as a trailing stop loss
 
-        # wait until terminal state synchronized to the local state
-        logger.info('Waiting for SDK to synchronize to terminal state ...')
-        await connection.wait_synchronized()
+    Returns:
+        the MetaAPI trade response
+    """
+    symbol = symbol_index.broker_symbol(trade['Symbol'])
+    if trade['OrderType'] == 'Buy' or trade['OrderType'] == 'Buy Now':
+        method, args = 'create_market_buy_order', (symbol, volume, trade['StopLoss'], takeProfit, options)
+    elif trade['OrderType'] == 'Buy Limit':
+        method, args = 'create_limit_buy_order', (symbol, volume, trade['Entry'], trade['StopLoss'], takeProfit, options)
+    elif trade['OrderType'] == 'Buy Stop':
+        method, args = 'create_stop_buy_order', (symbol, volume, trade['Entry'], trade['StopLoss'], takeProfit, options)
+    elif trade['OrderType'] == 'Sell' or trade['OrderType'] == 'Sell Now':
+        method, args = 'create_market_sell_order', (symbol, volume, trade['StopLoss'], takeProfit, options)
+    elif trade['OrderType'] == 'Sell Limit':
+        method, args = 'create_limit_sell_order', (symbol, volume, trade['Entry'], trade['StopLoss'], takeProfit, options)
+    elif trade['OrderType'] == 'Sell Stop':
+        method, args = 'create_stop_sell_order', (symbol, volume, trade['Entry'], trade['StopLoss'], takeProfit, options)
+    else:
+        raise ValueError(f"Unknown order type: {trade['OrderType']}")
 
-        # obtains account information from MetaTrader server
-        account_information = await connection.get_account_information()
+    with latency_recorder.measure(f'ConnectMetaTrader.{method}'):
+        return await getattr(connection, method)(*args)
 
-        update.effective_message.reply_text("Successfully connected to MetaTrader!\nCalculating trade risk ... 🤔")
-        price = await connection.get_symbol_price(symbol=trade['Symbol'])
-        # checks if the order is a market execution to get the current price of symbol
-        if(trade['Entry'] == 'NOW'):
-            
+async def SubmitOrderGroup(connection, trade: dict, legs: list) -> tuple:
+    """Submits all order legs of one signal concurrently.
+
+    Arguments:
+        connection: MetaAPI RPC connection
+        trade: dictionary that stores trade information
+        legs: list of (take profit, volume, options) tuples
+
+    Returns:
+        a tuple with one result dictionary per leg (TP, Volume, Result, Error, Latency) and the total group latency in seconds
+    """
+    async def submit_leg(takeProfit, volume, options) -> dict:
+        leg = {'TP': takeProfit, 'Volume': volume, 'Result': None, 'Error': None}
+        start = time.perf_counter()
+        try:
+            leg['Result'] = await CreateOrder(connection, trade, volume, takeProfit, options)
+        except Exception as error:
+            # MetaAPI raises ERR_NO_ERROR for some orders that were accepted
+            if IsTradeNoError(error):
+                logger.info(f"\nTrade with ERR_NO_ERROR : {error}\n")
+            else:
+                leg['Error'] = error
+        leg['Latency'] = time.perf_counter() - start
+        metrics.inc('orders_total', type=trade['OrderType'], symbol=trade['Symbol'],
+                    result='failed' if leg['Error'] is not None else 'submitted')
+        return leg
+
+    groupStart = time.perf_counter()
+    legResults = await asyncio.gather(*(submit_leg(*leg) for leg in legs))
+    groupLatency = time.perf_counter() - groupStart
+    logger.info(f"Submitted {len(legs)} order legs for {trade['Symbol']} in {groupLatency * 1000:.0f} ms")
 
-            # uses ask price if the order type is a buy
-            if(trade['OrderType'] == 'Buy' or trade['OrderType'] == 'Buy Now'):
-                trade['Entry'] = float(price['ask'])
+    return list(legResults), groupLatency
 
-            # uses bid price if the order type is a sell
-            if(trade['OrderType'] == 'Sell' or trade['OrderType'] == 'Sell Now'):
-                trade['Entry'] = float(price['bid'])
+@latency_recorder.timed()
+async def ConnectMetaTrader(update: Update, trade: dict, enterTrade: bool, replies: ReplyAggregator = None):
+    """Attempts connection to MetaAPI and MetaTrader to place trade.
+
+    Arguments:
+        update: update from Telegram
+        trade: dictionary that stores trade information
+        replies: aggregator that already holds earlier replies to this update, a new one is used if not given
+
+    Returns:
+        True if at least one order leg was accepted by MetaTrader
+    """
+
+    # progress, risk table and result go out as one message that is edited as the trade progresses
+    if replies is None:
+        replies = ReplyAggregator(update.effective_message)
+    placed = False
+
+    try:
+        # reuses the shared connection to MetaAPI
+        with latency_recorder.measure('ConnectMetaTrader.connect'):
+            connection = await connection_manager.get_connection()
+        with latency_recorder.measure('ConnectMetaTrader.sync'):
+            connection = await connection_manager.get_connection(synchronized=True)
+
+        # obtains account information from the cached terminal state
+        with latency_recorder.measure('ConnectMetaTrader.account'):
+            account_information = await account_state.get_account_information()
+
+        replies.reply_text("Successfully connected to MetaTrader!\nCalculating trade risk ... 🤔")
+        # reads the streamed price from memory, only asking the server when it is stale
+        # the symbol specification is in memory once the streaming connection synchronized
+        with latency_recorder.measure('ConnectMetaTrader.price'):
+            price, _ = await asyncio.gather(price_cache.get_price(connection, symbol_index.broker_symbol(trade['Symbol'])),
+                                            symbol_specs.ensure(connection, trade['Symbol']))
+            pip_values.update(symbol_index.broker_symbol(trade['Symbol']), price)
+            await pip_values.ensure(connection, trade['Symbol'])
+        # market executions enter at the current price
+        ResolveEntry(trade, price)
 
         # produces a table with trade information
-        #GetTradeInformation(update, trade, account_information['balance'])
+        #GetTradeInformation(update, trade, account_information['balance'], replies)
             
         # checks if the user has indicated to enter trade
         if(enterTrade == True):
 
             # enters trade on to MetaTrader account
-            update.effective_message.reply_text("Entering trade on MetaTrader Account ... 👨🏾‍💻")
+            replies.reply_text("Entering trade on MetaTrader Account ... 👨🏾‍💻")
         
             try:
-                # executes buy market execution order
-               # Kiểm tra nếu giá hiện tại thấp hơn giá Entry cho lệnh Buy Limit
-                if trade['OrderType'] == 'Buy Limit' and float(price['bid']) < trade['Entry']:
-                    trade['OrderType'] = 'Buy Stop'
-
-                # Kiểm tra nếu giá hiện tại cao hơn giá Entry cho lệnh Sell Limit
-                elif trade['OrderType'] == 'Sell Limit' and float(price['ask']) > trade['Entry']:
-                    trade['OrderType'] = 'Sell Stop'
-
+                AdjustOrderType(trade, price)
 
                 #GET INFOMATION TRADE - CREATE TABLE TRADE
                 # produces a table with trade information
-                GetTradeInformation(update, trade, account_information['balance'])
-
-
-                if PLAN == 'A' :
-                    # Kiểm tra nếu trailing stop được kích hoạt và có ít nhất 2 TP
-                    if TRAILINGSTOP == 'Y' and len(trade['TP']) >= 2:
-                        entryTrade = float(trade['Entry'])
-                        tradeFirstTP = float(trade['TP'][0])
-                        trailing_stop_config =  {
-                                                    "trailingStopLoss": {
-                                                        "threshold": {
-                                                        "thresholds": [
-                                                            {
-                                                            "threshold": tradeFirstTP,
-                                                            "stopLoss": entryTrade
-                                                            }
-                                                        ],
-                                                        "units": "ABSOLUTE_PRICE",
-                                                        "stopPriceBase": "CURRENT_PRICE"
-                                                        }
-                                                    }
-                                                }
-
-                        threshold_TP1 = (trade['Entry'] + ((trade['TP'][0] - trade['Entry']) * 0.8))
-                        decimal_places_entry = len(str(price['bid']).split('.')[-1]) if '.' in str(price['bid']) else 0
-                        if decimal_places_entry == 0:
-                            threshold_TP1 = round(threshold_TP1)
-                        else:
-                            threshold_TP1 = round(threshold_TP1, decimal_places_entry)
-                        trailing_stop_TP1 =  {
-                            "trailingStopLoss": {
-                                "threshold": {
-                                "thresholds": [
-                                    {
-                                    "threshold": threshold_TP1,
-                                    "stopLoss": entryTrade
-                                    }
-                                ],
-                                "units": "ABSOLUTE_PRICE",
-                                "stopPriceBase": "CURRENT_PRICE"
-                                }
-                            }
-                        }                                                 
-                        # Tiếp tục thực hiện lệnh tương ứng
-                        for i, takeProfit in enumerate(trade['TP']):
-                            if i >= 1:
-                                if trade['OrderType'] == 'Buy':
-                                    result = await connection.create_market_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_config)
-                                elif trade['OrderType'] == 'Buy Now':
-                                    result = await connection.create_market_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_config)
-                                elif trade['OrderType'] == 'Buy Limit':
-                                    result = await connection.create_limit_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_config)
-                                elif trade['OrderType'] == 'Buy Stop':
-                                    result = await connection.create_stop_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_config)
-                                elif trade['OrderType'] == 'Sell':
-                                    result = await connection.create_market_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_config)
-                                elif trade['OrderType'] == 'Sell Now':
-                                    result = await connection.create_market_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_config)
-                                elif trade['OrderType'] == 'Sell Limit':
-                                    result = await connection.create_limit_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_config)
-                                elif trade['OrderType'] == 'Sell Stop':
-                                    result = await connection.create_stop_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit,trailing_stop_config)
-                            else:                          
-                                if trade['OrderType'] == 'Buy':
-                                    result = await connection.create_market_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                elif trade['OrderType'] == 'Buy Now':
-                                    result = await connection.create_market_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                elif trade['OrderType'] == 'Buy Limit':
-                                    result = await connection.create_limit_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                elif trade['OrderType'] == 'Buy Stop':
-                                    result = await connection.create_stop_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                elif trade['OrderType'] == 'Sell':
-                                    result = await connection.create_market_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'],takeProfit, trailing_stop_TP1)
-                                elif trade['OrderType'] == 'Sell Now':
-                                    result = await connection.create_market_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                elif trade['OrderType'] == 'Sell Limit':
-                                    result = await connection.create_limit_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'],takeProfit, trailing_stop_TP1)
-                                elif trade['OrderType'] == 'Sell Stop':
-                                    result = await connection.create_stop_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                    else:
-                        # Tiếp tục thực hiện lệnh tương ứng
-                        for takeProfit in trade['TP']:
-                            if trade['OrderType'] == 'Buy':
-                                result = await connection.create_market_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit)
-                            elif trade['OrderType'] == 'Buy Now':
-                                result = await connection.create_market_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit)
-                            elif trade['OrderType'] == 'Buy Limit':
-                                result = await connection.create_limit_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit)
-                            elif trade['OrderType'] == 'Buy Stop':
-                                result = await connection.create_stop_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit)
-                            elif trade['OrderType'] == 'Sell':
-                                result = await connection.create_market_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit)
-                            elif trade['OrderType'] == 'Sell Now':
-                                result = await connection.create_market_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit)
-                            elif trade['OrderType'] == 'Sell Limit':
-                                result = await connection.create_limit_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit)
-                            elif trade['OrderType'] == 'Sell Stop':
-                                result = await connection.create_stop_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit)
-                elif PLAN == 'B' :
-                        if TRAILINGSTOP == 'Y' and len(trade['TP']) >= 2:
-                            entryTrade = float(trade['Entry'])
-                            tradeFirstTP = float(trade['TP'][0])
-                            trailing_stop_config =  {
-                                                        "trailingStopLoss": {
-                                                            "threshold": {
-                                                            "thresholds": [
-                                                                {
-                                                                "threshold": tradeFirstTP,
-                                                                "stopLoss": entryTrade
-                                                                }
-                                                            ],
-                                                            "units": "ABSOLUTE_PRICE",
-                                                            "stopPriceBase": "CURRENT_PRICE"
-                                                            }
-                                                        }
-                                                    }
-
-                            threshold_TP1 = (trade['Entry'] + ((trade['TP'][0] - trade['Entry']) * 0.8))
-                            decimal_places_entry = len(str(price['bid']).split('.')[-1]) if '.' in str(price['bid']) else 0
-                            if decimal_places_entry == 0:
-                                threshold_TP1 = round(threshold_TP1)
-                            else:
-                                threshold_TP1 = round(threshold_TP1, decimal_places_entry)
-                            trailing_stop_TP1 =  {
-                                "trailingStopLoss": {
-                                    "threshold": {
-                                    "thresholds": [
-                                        {
-                                        "threshold": threshold_TP1,
-                                        "stopLoss": entryTrade
-                                        }
-                                    ],
-                                    "units": "ABSOLUTE_PRICE",
-                                    "stopPriceBase": "CURRENT_PRICE"
-                                    }
-                                }
-                            }               
-                            for i, takeProfit in enumerate(trade['TP']):
-                                if i >= 1:
-                                    if trade['OrderType'] == 'Buy':
-                                        result = await connection.create_market_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_config)
-                                    elif trade['OrderType'] == 'Buy Now':
-                                        result = await connection.create_market_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_config)
-                                    elif trade['OrderType'] == 'Buy Limit':
-                                        result = await connection.create_limit_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_config)
-                                    elif trade['OrderType'] == 'Buy Stop':
-                                        result = await connection.create_stop_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_config)
-                                    elif trade['OrderType'] == 'Sell':
-                                        result = await connection.create_market_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_config)
-                                    elif trade['OrderType'] == 'Sell Now':
-                                        result = await connection.create_market_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_config)
-                                    elif trade['OrderType'] == 'Sell Limit':
-                                        result = await connection.create_limit_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_config)
-                                    elif trade['OrderType'] == 'Sell Stop':
-                                        result = await connection.create_stop_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit,trailing_stop_config)
-                                else:                          
-                                    if trade['OrderType'] == 'Buy':
-                                        result = await connection.create_market_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                    elif trade['OrderType'] == 'Buy Now':
-                                        result = await connection.create_market_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit , trailing_stop_TP1)
-                                    elif trade['OrderType'] == 'Buy Limit':
-                                        result = await connection.create_limit_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                    elif trade['OrderType'] == 'Buy Stop':
-                                        result = await connection.create_stop_buy_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                    elif trade['OrderType'] == 'Sell':
-                                        result = await connection.create_market_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                    elif trade['OrderType'] == 'Sell Now':
-                                        result = await connection.create_market_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                    elif trade['OrderType'] == 'Sell Limit':
-                                        result = await connection.create_limit_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_TP1)
-                                    elif trade['OrderType'] == 'Sell Stop':
-                                        result = await connection.create_stop_sell_order(trade['Symbol'], trade['PositionSize'] / len(trade['TP']), trade['Entry'], trade['StopLoss'], takeProfit, trailing_stop_TP1) 
-                        else:
-                            for i, take_profit in enumerate(trade['TP']):
-                                position_size = trade['PositionSize'][i]
-                                if trade['OrderType'] == 'Buy':
-                                    result = await connection.create_market_buy_order(trade['Symbol'], position_size, trade['StopLoss'], take_profit)
-                                elif trade['OrderType'] == 'Buy Now':
-                                    result = await connection.create_market_buy_order(trade['Symbol'], position_size, trade['StopLoss'], take_profit)
-                                elif trade['OrderType'] == 'Buy Limit':
-                                    result = await connection.create_limit_buy_order(trade['Symbol'], position_size, trade['Entry'], trade['StopLoss'], take_profit)
-                                elif trade['OrderType'] == 'Buy Stop':
-                                    result = await connection.create_stop_buy_order(trade['Symbol'], position_size, trade['Entry'], trade['StopLoss'], take_profit)
-                                elif trade['OrderType'] == 'Sell':
-                                    result = await connection.create_market_sell_order(trade['Symbol'], position_size, trade['StopLoss'], take_profit)
-                                elif trade['OrderType'] == 'Sell Now':
-                                    result = await connection.create_market_sell_order(trade['Symbol'], position_size, trade['StopLoss'], take_profit)
-                                elif trade['OrderType'] == 'Sell Limit':
-                                    result = await connection.create_limit_sell_order(trade['Symbol'], position_size, trade['Entry'], trade['StopLoss'], take_profit)
-                                elif trade['OrderType'] == 'Sell Stop':
-                                    result = await connection.create_stop_sell_order(trade['Symbol'], position_size, trade['Entry'], trade['StopLoss'], take_profit)
-                # sends success message to user
-                update.effective_message.reply_text("Trade entered successfully! 💰")
-                
-                # prints success message to console
-                logger.info('\nTrade entered successfully!')
-                logger.info(f"\nResult Code: {result}\n")          
+                GetTradeInformation(update, trade, account_information['balance'], replies)
+                # a trade that could not be sized is not placed, GetTradeInformation replied why
+                if 'PositionSize' not in trade:
+                    return placed
+
+
+                # builds one order leg per take profit
+                legs = BuildOrderLegs(trade, price)
+
+                # submits every leg of the signal at once so later legs are not filled at a worse price
+                legResults, groupLatency = await SubmitOrderGroup(connection, trade, legs)
+                failedLegs = [leg for leg in legResults if leg['Error'] is not None]
+                placed = len(failedLegs) < len(legResults)
+                report = '\n'.join(
+                    f"TP {count + 1} ({leg['TP']}): {'OK' if leg['Error'] is None else leg['Error']} - {leg['Latency'] * 1000:.0f} ms"
+                    for count, leg in enumerate(legResults)
+                )
+
+                if not failedLegs:
+                    # sends success message to user
+                    replies.reply_text(f"Trade entered successfully! 💰\n\n{report}\nTotal: {groupLatency * 1000:.0f} ms")
+
+                    # prints success message to console
+                    logger.info('\nTrade entered successfully!')
+                else:
+                    logger.info(f"\nTrade failed with error: {[leg['Error'] for leg in failedLegs]}\n")
+                    replies.reply_text(f"There was an issue 😕\n\nError Message:\n{report}\nTotal: {groupLatency * 1000:.0f} ms")
+                logger.info(f"\nResult Code: {[leg['Result'] for leg in legResults]}\n")
             except Exception as errors:
-                if errors['stringCode'] == 'ERR_NO_ERROR' or errors['numericCode'] == 0:
+                if IsTradeNoError(errors):
+                     placed = True
                      logger.info(f"\nTrade with ERR_NO_ERROR : {errors}\n")
                 else:
                     logger.info(f"\nTrade failed with error: {errors}\n")
-                    update.effective_message.reply_text(f"There was an issue 😕\n\nError Message:\n{errors}")
+                    replies.reply_text(f"There was an issue 😕\n\nError Message:\n{errors}")
     
     except Exception as error:
+        await connection_manager.reset(error)
         logger.error(f'Error Trade: {error}')
-        update.effective_message.reply_text(f"There was an issue with the connection 😕\n\nError Message:\n{error}")
+        replies.reply_text(f"There was an issue with the connection 😕\n\nError Message:\n{error}")
+    finally:
+        replies.close()
     
-    return
+    return placed
+
+
+async def PlaceOnAccount(account: TradingAccount, trade: dict) -> dict:
+    """Sizes a signal for the balance and risk settings of one account and submits its order legs there.
+
+    Arguments:
+        account: account the signal is copied to
+        trade: dictionary that stores the parsed trade, it is copied and not changed
+
+    Returns:
+        a dictionary with the Account name, Balance, Lots, Legs (SubmitOrderGroup results), Error and Latency in seconds
+    """
+    trade = CopyTrade(trade)
+    trade['RiskFactor'] = account.risk_factor
+    trade['RiskPerTrade'] = account.risk_per_trade
+    result = {'Account': account.name, 'Balance': None, 'Lots': None, 'Legs': [], 'Error': None}
+    start = time.perf_counter()
+    try:
+        with latency_recorder.measure(f'PlaceOnAccount.{account.name}'):
+            manager = account.connection_manager
+            connection = await manager.get_connection(synchronized=True)
+            symbol = symbol_index.broker_symbol(trade['Symbol'])
+            if manager is connection_manager:
+                # the main account has its balance and prices streamed
+                account_information, price, _ = await asyncio.gather(account_state.get_account_information(),
+                                                                     price_cache.get_price(connection, symbol),
+                                                                     symbol_specs.ensure(connection, trade['Symbol']))
+            else:
+                account_information, price, _ = await asyncio.gather(connection.get_account_information(),
+                                                                     connection.get_symbol_price(symbol),
+                                                                     symbol_specs.ensure(connection, trade['Symbol']))
+            result['Balance'] = account_information['balance']
+            pip_values.update(symbol, price)
+            await pip_values.ensure(connection, trade['Symbol'])
+
+            ResolveEntry(trade, price)
+            AdjustOrderType(trade, price)
+            # pip values are converted to the currency of this account's balance
+            SizeTrade(trade, result['Balance'], account.plan, account_information.get('currency'))
+            legs = BuildOrderLegs(trade, price, account.plan)
+            result['Lots'] = sum(volume for _, volume, _ in legs)
+            result['Legs'], _ = await SubmitOrderGroup(connection, trade, legs)
+    except Exception as error:
+        await account.connection_manager.reset(error)
+        logger.error(f'Error placing trade on account {account.name}: {error}')
+        result['Error'] = error
+    result['Latency'] = time.perf_counter() - start
+
+    failed = result['Error'] is not None or any(leg['Error'] is not None for leg in result['Legs'])
+    metrics.inc('account_trades_total', account=account.name, result='failed' if failed else 'entered')
+    return result
+
+def AccountResultLine(result: dict) -> str:
+    """Formats the result of PlaceOnAccount as one reply line."""
+    latency = f"{result['Latency'] * 1000:.0f} ms"
+    if result['Error'] is not None:
+        return f"❌ {result['Account']}: {result['Error']} - {latency}"
+    errors = [leg['Error'] for leg in result['Legs'] if leg['Error'] is not None]
+    legs = f"{len(result['Legs']) - len(errors)}/{len(result['Legs'])} legs, {result['Lots']:.2f} lots"
+    if errors:
+        return f"❌ {result['Account']}: {legs}, {errors[0]} - {latency}"
+    return f"✅ {result['Account']}: {legs} - {latency}"
+
+@latency_recorder.timed()
+async def FanOutTrade(update: Update, trade: dict, accounts: list, replies: ReplyAggregator = None) -> list:
+    """Copies a signal to every account at once, each sized for its own balance.
+
+    Every account places its orders over its own pooled connection, and its result is reported as soon as it
+    finishes, so a slow or failing account does not hold up the others.
+
+    Arguments:
+        update: update from Telegram
+        trade: dictionary that stores the parsed trade
+        accounts: TradingAccount objects the signal is copied to
+        replies: aggregator that already holds earlier replies to this update, a new one is used if not given
+
+    Returns:
+        the PlaceOnAccount results in the order the accounts finished
+    """
+    if replies is None:
+        replies = ReplyAggregator(update.effective_message)
+
+    results = []
+    start = time.perf_counter()
+    try:
+        replies.reply_text(f"Entering trade on {len(accounts)} MetaTrader accounts ... 👨🏾‍💻")
+        for finished in asyncio.as_completed([PlaceOnAccount(account, trade) for account in accounts]):
+            result = await finished
+            results.append(result)
+            replies.reply_text(AccountResultLine(result))
+
+        entered = [result for result in results if result['Error'] is None
+                   and all(leg['Error'] is None for leg in result['Legs'])]
+        replies.reply_text(f"Trade entered on {len(entered)}/{len(results)} accounts in "
+                           f"{(time.perf_counter() - start) * 1000:.0f} ms {'💰' if len(entered) == len(results) else '😕'}")
+        logger.info(f"Trade entered on {len(entered)}/{len(results)} accounts")
+    finally:
+        replies.close()
+    return results
 
 
 # Handler Functions
-def PlaceTrade(update: Update, context: CallbackContext) -> int:
+def PlaceTrade(update: Update, context: CallbackContext, trade: dict = None) -> int:
     """Parses trade and places on MetaTrader account.   
     
     Arguments:
         update: update from Telegram
         context: CallbackContext object that stores commonly used objects in handler callbacks
+        trade: trade already parsed by ClassifySignal, the message is parsed again if not given
     """
     # checks if the trade has already been parsed or not
     #if(context.user_data['trade'] is None):
@@ -1199,7 +3163,8 @@ def PlaceTrade(update: Update, context: CallbackContext) -> int:
         # parses signal from Telegram message
         #errorMessage1 = f"There was \nError: {update.effective_message.text}\n."
         #update.effective_message.reply_text(errorMessage1)
-        trade = ParseSignal(update.effective_message.text)
+        if trade is None:
+            trade = ParseSignal(update.effective_message.text)
         #update.effective_message.reply_text(trade)
         
         # Test Done OK Here
@@ -1212,24 +3177,65 @@ def PlaceTrade(update: Update, context: CallbackContext) -> int:
         #Fixing here
         #context.user_data['trade'] = trade
         
-        update.effective_message.reply_text("Trade Successfully Parsed! 🥳\nConnecting to MetaTrader ... \n(May take a while) ⏰")
+        # skips a signal that was already placed within the duplicate window (forwarded, edited or re-posted)
+        if signal_cache.is_duplicate(trade):
+            metrics.inc('signals_total', result='duplicate')
+            logger.info(f"Duplicate signal ignored: {SignalKey(trade)}")
+            send_reply(update, "Duplicate signal ignored, this trade was already placed recently. 🔁", PRIORITY_TRADE)
+            return TRADE
+
+        # the placement progress and result are appended to this reply
+        replies = ReplyAggregator(update.effective_message)
+        replies.reply_text("Trade Successfully Parsed! 🥳\nConnecting to MetaTrader ... \n(May take a while) ⏰")
     
     except Exception as error:
         logger.error(f'Error: {error}')
         errorMessage = f"There was an error parsing this trade 😕\n\nError: {error}\n"
-        update.effective_message.reply_text(errorMessage)
+        send_reply(update, errorMessage, PRIORITY_TRADE)
 
         # returns to TRADE state to reattempt trade parsing
         return TRADE
     
-    # attempts connection to MetaTrader and places trade
-    asyncio.run(ConnectMetaTrader(update, trade, True))
+    # attempts connection to MetaTrader and places trade once the start-up warm-up finished
+    if not work_scheduler.submit('signals', PlaceWhenReady, update, trade, replies):
+        # the signal was not placed, so a repost is not a duplicate
+        signal_cache.forget(trade)
+        replies.reply_text("The bot is busy, this trade was not placed. Please send it again in a moment. ⏳")
+        replies.close()
     
     # removes trade from user context data
     #context.user_data['trade'] = None
 
     return TRADE
 
+async def PlaceWhenReady(update: Update, trade: dict, replies: ReplyAggregator = None) -> None:
+    """Waits for the start-up warm-up before placing the trade, so it does not race the account deployment.
+
+    Arguments:
+        update: update from Telegram
+        trade: dictionary that stores trade information
+        replies: aggregator holding the earlier replies to this update
+    """
+    with latency_recorder.measure('PlaceTrade.wait_ready'):
+        ready = await account_warmup.wait_ready(WARMUP_TIMEOUT)
+    if not ready:
+        # places the trade anyway, ConnectMetaTrader connects on its own
+        logger.warning(f'MetaAPI account not warmed up after {WARMUP_TIMEOUT:.0f}s, placing trade anyway')
+
+    # placing fills in the entry of market orders, which changes the duplicate key
+    signal = CopyTrade(trade)
+    placed = False
+    try:
+        if trading_accounts:
+            results = await FanOutTrade(update, trade, trading_accounts, replies)
+            placed = any(leg['Error'] is None for result in results for leg in result['Legs'])
+        else:
+            placed = await ConnectMetaTrader(update, trade, True, replies)
+    finally:
+        # a signal none of whose orders was accepted is not a duplicate when it is sent again
+        if not placed:
+            signal_cache.forget(signal)
+
 def CalculateTrade(update: Update, context: CallbackContext) -> int:
     """Parses trade and places on MetaTrader account.   
     
@@ -1251,21 +3257,22 @@ def CalculateTrade(update: Update, context: CallbackContext) -> int:
 
             # sets the user context trade equal to the parsed trade
             context.user_data['trade'] = trade
-            update.effective_message.reply_text("Trade Successfully Parsed! 🥳\nConnecting to MetaTrader ... (May take a while) ⏰")
+            send_reply(update, "Trade Successfully Parsed! 🥳\nConnecting to MetaTrader ... (May take a while) ⏰")
         
         except Exception as error:
             logger.error(f'Error CalculateTrade : {error}')
             errorMessage = f"There was an error parsing this trade 😕\n\nError: {error}\n"
-            update.effective_message.reply_text(errorMessage)
+            send_reply(update, errorMessage)
 
             # returns to CALCULATE to reattempt trade parsing
             return CALCULATE
     
     # attempts connection to MetaTrader and calculates trade information
-    asyncio.run(ConnectMetaTrader(update, context.user_data['trade'], False))
+    # waits for the calculation so the decision prompt follows the trade table
+    event_loop_thread.submit(ConnectMetaTrader(update, context.user_data['trade'], False)).result()
 
     # asks if user if they would like to enter or decline trade
-    update.effective_message.reply_text("Would you like to enter this trade?\nTo enter, select: /yes\nTo decline, select: /no")
+    send_reply(update, "Would you like to enter this trade?\nTo enter, select: /yes\nTo decline, select: /no")
 
     return DECISION
 
@@ -1278,10 +3285,10 @@ def unknown_command(update: Update, context: CallbackContext) -> None:
     """
     user_username = update.effective_message.chat.username
     if user_username not in AUTHORIZED_USERS:
-        update.effective_message.reply_text("You are not authorized to use this bot! 🙅🏽‍♂️")
+        send_reply(update, "You are not authorized to use this bot! 🙅🏽‍♂️")
         return ConversationHandler.END
 
-    update.effective_message.reply_text("Unknown command. Use /trade to place a trade or /calculate to find information for a trade. You can also use the /help command to view instructions for this bot.")
+    send_reply(update, "Unknown command. Use /trade to place a trade or /calculate to find information for a trade. You can also use the /help command to view instructions for this bot.")
 
     return
 
@@ -1298,7 +3305,7 @@ def welcome(update: Update, context: CallbackContext) -> None:
     welcome_message = "Welcome to the FX Signal Copier Telegram Bot! 💻💸\n\nYou can use this bot to enter trades directly from Telegram and get a detailed look at your risk to reward ratio with profit, loss, and calculated lot size. You are able to change specific settings such as allowed symbols, risk factor, and more from your personalized Python script and environment variables.\n\nUse the /help command to view instructions and example trades."
     
     # sends messages to user
-    update.effective_message.reply_text(welcome_message)
+    send_reply(update, welcome_message)
 
     return
 
@@ -1316,9 +3323,9 @@ def help(update: Update, context: CallbackContext) -> None:
     # market_execution_example = "Market Execution:\nBUY GBPUSD\nEntry NOW\nSL 1.14336\nTP 1.28930\nTP 1.29845\n\n"
     # limit_example = "Limit Execution:\nBUY LIMIT GBPUSD\nEntry 1.14480\nSL 1.14336\nTP 1.28930\n\n"
     # note = "You are able to enter up to two take profits. If two are entered, both trades will use half of the position size, and one will use TP1 while the other uses TP2.\n\nNote: Use 'NOW' as the entry to enter a market execution trade."
-    commandtrade = "\n----Bot commands:\n\t/accountinfo : Check infomation account\n\t/opentrades : Check all Opening Position\n\t/pendingorders : Check all Pending Orders\n\tcloseposition id,id,id \n\tclosepart id,id|size,size \n\ttrailingstop id,id,id"
+    commandtrade = "\n----Bot commands:\n\t/accountinfo : Check infomation account\n\t/opentrades : Check all Opening Position\n\t/pendingorders : Check all Pending Orders\n\tcloseposition id,id,id \n\tclosepart id,id|size,size \n\ttrailingstop id,id,id\n\t/latency : Latency per pipeline stage"
     # sends messages to user
-    update.effective_message.reply_text(help_message + commandtrade)
+    send_reply(update, help_message + commandtrade)
     #update.effective_message.reply_text(commands)
     # update.effective_message.reply_text(trade_example + market_execution_example + limit_example + note + commandtrade)
     #update.effective_message.reply_text(commandtrade)
@@ -1332,7 +3339,7 @@ def cancel(update: Update, context: CallbackContext) -> int:
         context: CallbackContext object that stores commonly used objects in handler callbacks
     """
 
-    update.effective_message.reply_text("Command has been canceled.")
+    send_reply(update, "Command has been canceled.")
 
     # removes trade from user context data
     if context.user_data['trade'] is not None:
@@ -1361,7 +3368,7 @@ def Trade_Command(update: Update, context: CallbackContext) -> int:
     """
     user_username = update.effective_message.chat.username
     if user_username not in AUTHORIZED_USERS:
-        update.effective_message.reply_text("You are not authorized to use this bot! 🙅🏽‍♂️")
+        send_reply(update, "You are not authorized to use this bot! 🙅🏽‍♂️")
         return ConversationHandler.END
     
     # initializes the user's trade as empty prior to input and parsing
@@ -1382,7 +3389,7 @@ def Calculation_Command(update: Update, context: CallbackContext) -> int:
     """
     user_username = update.effective_message.chat.username
     if user_username not in AUTHORIZED_USERS:
-        update.effective_message.reply_text("You are not authorized to use this bot! 🙅🏽‍♂️")
+        send_reply(update, "You are not authorized to use this bot! 🙅🏽‍♂️")
         return ConversationHandler.END
 
     # initializes the user's trade as empty prior to input and parsing
@@ -1390,45 +3397,189 @@ def Calculation_Command(update: Update, context: CallbackContext) -> int:
         context.user_data['trade'] = None
 
     # asks user to enter the trade
-    update.effective_message.reply_text("Please enter the trade that you would like to calculate.")
+    send_reply(update, "Please enter the trade that you would like to calculate.")
 
     return CALCULATE
 
 # Function for handle message
+@latency_recorder.timed()
 def TotalMessHandle(update: Update, context: CallbackContext)-> int:
-    checktruesignal = CheckSignalMessage(update.effective_message.text)
+    confidence, trade = ClassifySignal(update.effective_message.text)
+    metrics.inc('signals_total', result='parsed' if confidence >= SIGNAL_MIN_CONFIDENCE else 'rejected')
     temp = Trade_Command(update,context)
-    if temp == TRADE and checktruesignal == TRADE :      
-        PlaceTrade(update,context)
+    if temp == TRADE and confidence >= SIGNAL_MIN_CONFIDENCE :
+        # hands the parsed trade over so the message is not parsed twice
+        PlaceTrade(update,context,trade)
     return TRADE
 
 # Function for check message is a signal format true
+@latency_recorder.timed()
 def CheckSignalMessage(signal:str)-> int:
-    signal = signal.splitlines()
-    signal = [line.rstrip() for line in signal]
-    # extracts symbolplus '/' from trade signal if found then replace '/' to ''
-    for elemental in SYMBOLSPLUS:
-        calcusymbol = signal[0].upper().find(elemental,0)
-        for symbolother in TYPETRADE:
-            for item in signal:
-                calcusymbolother = item.upper().find(symbolother,0)
-                if(calcusymbol != -1 & calcusymbolother != -1) :          
-                    return TRADE   
-   # extracts symbol from trade signal                      
-    for element in SYMBOLS:
-        calcu = signal[0].upper().find(element,0)
-        for symbol_other in TYPETRADE:
-            for item in signal:
-                calcu_symbolother = item.upper().find(symbol_other,0)
-                if(calcu != -1 & calcu_symbolother != -1) :          
-                    return TRADE
+    confidence, trade = ClassifySignal(signal)
+    if confidence >= SIGNAL_MIN_CONFIDENCE:
+        return TRADE
     return ERROR
-    
+
+@latency_recorder.timed()
+def ClassifySignal(signal: str) -> tuple:
+    """Decides if a message is a trade signal.
+
+    Chatter without a buy/sell keyword is rejected with one regular expression search. Other messages are parsed once and the parsed prices are checked for consistency. Results are cached by normalized text, so forwarded or re-posted copies are not parsed again.
+
+    Arguments:
+        signal: text of the Telegram message
+
+    Returns:
+        a tuple with the confidence (0 when the message is not a signal, 0.5 - 1.0 otherwise) and the parsed trade
+    """
+    if not signal or SIGNAL_PREFILTER_PATTERN.search(signal) is None:
+        return 0.0, {}
+
+    key = NormalizeSignal(signal)
+    cached = signal_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = ScoreSignal(signal)
+    signal_cache.put(key, result)
+    return result
+
+def ScoreSignal(signal: str) -> tuple:
+    """Parses a message and scores how consistent the parsed prices are.
+
+    Arguments:
+        signal: text of the Telegram message
+
+    Returns:
+        a tuple with the confidence and the parsed trade, (0.0, {}) if the message cannot be parsed, its stop loss,
+        take profits and entry are inconsistent or a pending order has no entry
+    """
+    try:
+        trade = ParseSignal(signal)
+    except Exception:
+        return 0.0, {}
+    if not trade:
+        return 0.0, {}
+
+    isBuy = trade['OrderType'].startswith('Buy')
+    stopLoss = trade['StopLoss']
+    takeProfits = trade['TP']
+    entry = trade.get('Entry')
+
+    # stop loss and take profits on the same side, or prices of different magnitudes (e.g. '1 925' read as 1.925 next
+    # to 1910), cannot be traded whatever SIGNAL_MIN_CONFIDENCE is
+    if not (stopLoss < min(takeProfits) if isBuy else stopLoss > max(takeProfits)):
+        return 0.0, {}
+    prices = [stopLoss] + takeProfits + ([entry] if isinstance(entry, float) else [])
+    if not (min(prices) > 0 and max(prices) / min(prices) < 1.5):
+        return 0.0, {}
+    # a limit or stop order cannot be placed without its price
+    if trade['OrderType'].endswith(('Limit', 'Stop')) and not isinstance(entry, float):
+        return 0.0, {}
+
+    # an entry outside stop loss and the first take profit lowers the confidence, the entry may be a range bound
+    if isinstance(entry, float) and not (stopLoss < entry < takeProfits[0] if isBuy else takeProfits[0] < entry < stopLoss):
+        return 0.5, trade
+    return 1.0, trade
+
+def NormalizeSignal(signal: str) -> str:
+    """Normalizes a message the way ParseSignal sees it, so copies that only differ in line endings or trailing spaces share one key."""
+    return '\n'.join(line.rstrip() for line in signal.splitlines())
+
+def SignalKey(trade: dict) -> tuple:
+    """Returns the (symbol, side, entry, SL, TPs) tuple that identifies a trade for duplicate suppression."""
+    return (trade['Symbol'], trade['OrderType'].split()[0], trade.get('Entry'), trade['StopLoss'], tuple(trade['TP']))
+
+class SignalCache:
+    """Bounded LRU cache of classified signals plus a time window of recently placed trades.
+
+    Telegram handlers run on several dispatcher threads, so every access takes the lock.
+    """
+
+    def __init__(self, maxsize: int, window: float):
+        self.parsed = LRUCache(maxsize=maxsize)
+        self.placed = TTLCache(maxsize=maxsize, ttl=window) if window > 0 else None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+
+    def get(self, key: str):
+        """Returns a copy of the cached (confidence, trade) for a normalized message, or None."""
+        with self.lock:
+            cached = self.parsed.get(key)
+            if cached is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.inc('signal_cache_lookups_total', result='miss' if cached is None else 'hit')
+        if cached is None:
+            return None
+        confidence, trade = cached
+        # ConnectMetaTrader updates the trade it is given, so callers never get the cached dictionary
+        return confidence, CopyTrade(trade)
+
+    def put(self, key: str, result: tuple) -> None:
+        confidence, trade = result
+        with self.lock:
+            self.parsed[key] = (confidence, CopyTrade(trade))
+
+    def is_duplicate(self, trade: dict) -> bool:
+        """Checks if an identical trade was placed within the window and records this one if not.
+
+        The trade is recorded before it is placed, so a copy arriving meanwhile is not placed twice. It must be
+        forgotten again if none of its orders is accepted.
+        """
+        if self.placed is None:
+            return False
+        key = SignalKey(trade)
+        with self.lock:
+            if key in self.placed:
+                self.duplicates += 1
+                return True
+            self.placed[key] = True
+            return False
+
+    def forget(self, trade: dict) -> None:
+        """Removes a trade recorded by is_duplicate, for a trade that was not placed after all."""
+        if self.placed is None:
+            return
+        with self.lock:
+            self.placed.pop(SignalKey(trade), None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'duplicates': self.duplicates, 'size': len(self.parsed)}
+
+    def cache_metrics(self) -> list:
+        """Reports the cached signals and the trades in the duplicate window as gauges for the metrics endpoint."""
+        with self.lock:
+            return [
+                ('signal_cache_size', {}, len(self.parsed)),
+                ('signal_duplicate_window_trades', {}, len(self.placed) if self.placed is not None else 0),
+            ]
+
+def CopyTrade(trade: dict) -> dict:
+    copied = dict(trade)
+    if 'TP' in copied:
+        copied['TP'] = list(copied['TP'])
+    return copied
+
+signal_cache = SignalCache(PARSE_CACHE_SIZE, DUPLICATE_WINDOW)
+metrics.add_collector(signal_cache.cache_metrics)
+
 
 def main() -> None:
     """Runs the Telegram bot."""
 
-    updater = Updater(TOKEN, use_context=True)
+    # starts the event loop shared by all MetaAPI calls and warms up the account before accepting updates
+    event_loop_thread.start()
+    warmup = event_loop_thread.submit(account_warmup.warm_up())
+    if PRICE_SUBSCRIBE_ALL:
+        event_loop_thread.submit(price_cache.subscribe_all())
+
+    # the bot times every Bot API request, its connection pool covers the 4 dispatcher workers, the updater and the outbox
+    updater = Updater(bot=TimedBot(TOKEN, request=Request(con_pool_size=8 + TELEGRAM_SEND_WORKERS)), use_context=True)
 
     # get the dispatcher to register handlers
     dp = updater.dispatcher
@@ -1461,14 +3612,30 @@ def main() -> None:
     dp.add_handler(MessageHandler(Filters.command & Filters.regex('trailingstop'),handle_trailingstop ))
     dp.add_handler(MessageHandler(Filters.command & Filters.regex('closeposition'),handle_closeposition ))
     dp.add_handler(MessageHandler(Filters.command & Filters.regex('closepart'),handle_close_position_part ))
+    dp.add_handler(MessageHandler(Filters.command & Filters.regex('latency'),handle_latency ))
     dp.add_handler(MessageHandler(Filters.text, TotalMessHandle))
 
+    # counts every update before the other handlers see it
+    dp.add_handler(TypeHandler(Update, count_update), group=-1)
+
     # log all errors
     dp.add_error_handler(error)
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
     
+    # waits for the warm-up, trades placed after the timeout still wait on the ready flag
+    try:
+        warmup.result(timeout=WARMUP_TIMEOUT)
+    except Exception as error:
+        logger.warning(f'Starting without a warmed up MetaAPI account: {error!r}')
+
     # listens for incoming updates from Telegram
     updater.start_webhook(listen="0.0.0.0", port=PORT, url_path=TOKEN, webhook_url=APP_URL + TOKEN)
     updater.idle()
+    event_loop_thread.stop()
+    telegram_outbox.stop()
+    latency_recorder.log_report()
 
     return
 